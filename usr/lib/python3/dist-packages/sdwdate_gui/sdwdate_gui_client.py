@@ -3,7 +3,7 @@
 ## Copyright (C) 2015 - 2025 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
 ## See the file COPYING for copying conditions.
 
-# pylint: disable=broad-exception-caught,import-error,duplicate-code
+# pylint: disable=broad-exception-caught,import-error,duplicate-code,too-many-lines
 
 """
 The client component of sdwdate-gui. Monitors sdwdate and Tor states, reports
@@ -16,6 +16,8 @@ import sys
 import logging
 import subprocess
 import json
+import random
+import time
 
 from collections import deque
 from pathlib import Path
@@ -23,11 +25,19 @@ from typing import NoReturn, Any
 
 import pyinotify  # type: ignore
 
+from .sdwdate_gui_profiling import setup_profiling
+from .sdwdate_gui_trace import (
+    TraceData,
+    ClientTrace,
+    setup_tracing,
+)
 from .sdwdate_gui_shared import (
     ConfigData,
     MAX_MSG_SIZE,
+    CONFIG_RELOAD_DELAY_MS,
     parse_ipc_command,
     parse_config_files,
+    reload_config_files,
 )
 
 ## Maximum length of the sdwdate status message we send. Messages can be a
@@ -35,6 +45,13 @@ from .sdwdate_gui_shared import (
 ## length, so cap the raw message well under a quarter of that limit.
 MAX_STATUS_MSG_LEN: int = 1000
 
+## Reconnect attempts back off exponentially between these delays, in
+## seconds. A connection that stayed up for RECONNECT_DELAY_MAX resets the
+## delay. Waiting for the server is cut short by inotify as soon as its
+## socket or PID file appears, the delays only matter while nothing changes.
+RECONNECT_DELAY_MIN: float = 1.0
+RECONNECT_DELAY_MAX: float = 60.0
+
 
 # pylint: disable=too-few-public-methods
 class GlobalData:
@@ -60,9 +77,22 @@ class GlobalData:
     tor_path: str = "/run/tor"
     torrc_path: str = "/usr/local/etc/torrc.d"
     tor_running_path: str = "/run/tor/tor.pid"
-    last_tor_status: str = ""
+    ## The current Tor and sdwdate state, kept up to date by the inotify
+    ## handlers whether or not a server is connected, and replayed to each
+    ## newly connected server. See replay_state.
+    tor_state: str | None = None
+    sdwdate_state: tuple[str, str] | None = None
+    state_replayed: bool = False
     watch_manager: pyinotify.WatchManager | None = None
     notifier: pyinotify.AsyncioNotifier | None = None
+    config_watch_manager: pyinotify.WatchManager | None = None
+    config_notifier: pyinotify.AsyncioNotifier | None = None
+    config_reload_handle: asyncio.TimerHandle | None = None
+    reconnect_delay: float = RECONNECT_DELAY_MIN
+    server_watch_manager: pyinotify.WatchManager | None = None
+    server_notifier: pyinotify.AsyncioNotifier | None = None
+    server_watch_dirs: set[str] = set()
+    server_event: asyncio.Event | None = None
     awaitable_tasks: deque[asyncio.Task[Any]] = deque()
     background_tasks: set[asyncio.Task[Any]] = set()
 
@@ -85,8 +115,11 @@ class INotifyEventHandler(pyinotify.ProcessEvent):  # type: ignore[misc]
                 asyncio.create_task(tor_status_changed())
             )
         elif path_str == GlobalData.sdwdate_status_path:
+            trace: ClientTrace | None = None
+            if TraceData.enabled:
+                trace = ClientTrace(time.monotonic_ns())
             GlobalData.awaitable_tasks.append(
-                asyncio.create_task(sdwdate_status_changed())
+                asyncio.create_task(sdwdate_status_changed(trace))
             )
         else:
             logging.error("Unexpected path change at '%s'!", path_str)
@@ -146,6 +179,34 @@ class INotifyEventHandler(pyinotify.ProcessEvent):  # type: ignore[misc]
             )
 
 
+# pylint: disable=invalid-name
+class ConfigEventHandler(pyinotify.ProcessEvent):  # type: ignore[misc]
+    """
+    Handles incoming inotify events for the configuration directories.
+    """
+
+    def process_default(self, event: pyinotify.Event) -> None:
+        """
+        Handler for all events.
+        """
+        schedule_config_reload()
+
+
+# pylint: disable=invalid-name
+class ServerPathEventHandler(pyinotify.ProcessEvent):  # type: ignore[misc]
+    """
+    Handles incoming inotify events for the directories the server's socket
+    and PID file appear in.
+    """
+
+    def process_default(self, event: pyinotify.Event) -> None:
+        """
+        Handler for all events.
+        """
+        if GlobalData.server_event is not None:
+            GlobalData.server_event.set()
+
+
 GlobalData.tor_control_panel_installed = os.path.exists(
     "/usr/bin/tor-control-panel"
 )
@@ -323,21 +384,26 @@ def suppress_client_reconnect() -> None:
 
 
 ## CLIENT-TO-SERVER RPC CALLS
-async def generic_rpc_call(msg_bytes: bytes) -> None:
+def frame_rpc_call(msg_bytes: bytes) -> bytes:
     """
-    Sends an RCP call from the server to the client, following the wire format
-    documented for this module.
+    Prepends the length prefix to an RPC call from the client to the server,
+    following the wire format documented for this module.
     """
 
-    assert GlobalData.sock_write is not None
     msg_len: int = len(msg_bytes)
     if msg_len > MAX_MSG_SIZE:
         logging.critical("Tried to send oversized IPC message!")
         sys.exit(1)
-    msg_buf: bytes = (
-        msg_len.to_bytes(2, byteorder="big", signed=False) + msg_bytes
-    )
-    GlobalData.sock_write.write(msg_buf)
+    return msg_len.to_bytes(2, byteorder="big", signed=False) + msg_bytes
+
+
+async def generic_rpc_call(msg_bytes: bytes) -> None:
+    """
+    Sends an RCP call from the client to the server.
+    """
+
+    assert GlobalData.sock_write is not None
+    GlobalData.sock_write.write(frame_rpc_call(msg_bytes))
     await GlobalData.sock_write.drain()
 
 
@@ -359,10 +425,9 @@ async def set_client_name(name: str) -> None:
     )
 
 
-async def set_sdwdate_status(status: str, msg: str) -> None:
+def encode_sdwdate_msg(msg: str) -> str:
     """
-    RPC call from client to server. Updates the sdwdate status shown by
-    the server.
+    Prepares an sdwdate status message for sending it to the server.
     """
 
     ## Coerce to ASCII (the wire is ASCII only, otherwise encode() below
@@ -378,31 +443,98 @@ async def set_sdwdate_status(status: str, msg: str) -> None:
     msg_copy: str = msg.replace("\\", "\\134")
     msg_copy = msg_copy.replace(" ", "\\040")
     msg_copy = msg_copy.replace("\n", "\\012")
+    return msg_copy
 
-    await generic_rpc_call(
+
+def sdwdate_status_call(
+    status: str, msg: str, trace: ClientTrace | None = None
+) -> bytes:
+    """
+    Builds a set_sdwdate_status RPC call. If a trace is given, a trace token
+    is appended to the call.
+    """
+
+    msg_bytes: bytes = (
         b"set_sdwdate_status "
         + status.encode(encoding="ascii")
         + b" "
-        + msg_copy.encode(encoding="ascii")
+        + encode_sdwdate_msg(msg).encode(encoding="ascii")
     )
+    if trace is not None:
+        trace_bytes: bytes = b" " + trace.token().encode(encoding="ascii")
+        ## Rather drop the token than send an oversized message.
+        if len(msg_bytes) + len(trace_bytes) <= MAX_MSG_SIZE:
+            msg_bytes += trace_bytes
+    return msg_bytes
 
 
-async def set_tor_status(status: str) -> None:
+async def set_sdwdate_status(
+    status: str, msg: str, trace: ClientTrace | None = None
+) -> None:
     """
     RPC call from client to server. Updates the sdwdate status shown by
-    the server. This call avoids sending duplicate status change messages.
+    the server.
     """
-    if status != GlobalData.last_tor_status:
-        GlobalData.last_tor_status = status
-        await generic_rpc_call(
-            b"set_tor_status " + status.encode(encoding="ascii")
+
+    await generic_rpc_call(sdwdate_status_call(status, msg, trace))
+
+
+def tor_status_call(status: str) -> bytes:
+    """
+    Builds a set_tor_status RPC call.
+    """
+
+    return b"set_tor_status " + status.encode(encoding="ascii")
+
+
+async def set_tor_status(status: str) -> None:
+    """
+    RPC call from client to server. Updates the Tor status shown by the
+    server.
+    """
+
+    await generic_rpc_call(tor_status_call(status))
+
+
+def state_sendable() -> bool:
+    """
+    Checks if state changes can be sent to the server right away. If not,
+    they are only recorded, and sent by replay_state once a server is
+    connected.
+    """
+
+    return (
+        GlobalData.state_replayed
+        and GlobalData.sock_write is not None
+        and not GlobalData.sock_write.is_closing()
+    )
+
+
+async def replay_state() -> None:
+    """
+    Sends the current Tor and sdwdate state to a newly connected server in a
+    single write. Afterwards, state changes are sent as they happen.
+    """
+
+    assert GlobalData.sock_write is not None
+    msg_buf: bytes = b""
+    if GlobalData.tor_state is not None:
+        msg_buf += frame_rpc_call(tor_status_call(GlobalData.tor_state))
+    if GlobalData.sdwdate_state is not None:
+        msg_buf += frame_rpc_call(
+            sdwdate_status_call(*GlobalData.sdwdate_state)
         )
+    GlobalData.state_replayed = True
+    if msg_buf != b"":
+        GlobalData.sock_write.write(msg_buf)
+        await GlobalData.sock_write.drain()
 
 
 ## WATCHER EVENTS
-async def sdwdate_status_changed() -> None:
+async def sdwdate_status_changed(trace: ClientTrace | None = None) -> None:
     """
-    Determine the current sdwdate status and send it to the server.
+    Determine the current sdwdate status and send it to the server, if one is
+    connected.
     """
 
     if not os.path.isfile(GlobalData.sdwdate_status_path):
@@ -451,15 +583,35 @@ async def sdwdate_status_changed() -> None:
         logging.warning("Invalid data found in sdwdate status file!")
         return
 
-    if status_str in ("success", "busy", "error"):
-        await set_sdwdate_status(status_str, message_str)
-    else:
+    if status_str not in ("success", "busy", "error"):
         logging.warning("Invalid data found in sdwdate status file!")
+        return
+
+    GlobalData.sdwdate_state = (status_str, message_str)
+    if not state_sendable():
+        return
+    if trace is not None:
+        trace.mark_parsed()
+    await set_sdwdate_status(status_str, message_str, trace)
+
+
+async def update_tor_state(status: str) -> None:
+    """
+    Records the current Tor status and sends it to the server, if one is
+    connected. Avoids sending duplicate status change messages.
+    """
+
+    if status == GlobalData.tor_state:
+        return
+    GlobalData.tor_state = status
+    if state_sendable():
+        await set_tor_status(status)
 
 
 async def tor_status_changed() -> None:
     """
-    Determine the current Tor status and send it to the server.
+    Determine the current Tor status and send it to the server, if one is
+    connected.
     """
 
     if not GlobalData.tor_control_panel_installed:
@@ -474,14 +626,197 @@ async def tor_status_changed() -> None:
         return
 
     if tor_is_enabled and tor_is_running:
-        await set_tor_status("running")
+        await update_tor_state("running")
     elif not tor_is_enabled:
         if tor_is_running:
-            await set_tor_status("disabled_running")
+            await update_tor_state("disabled_running")
         else:
-            await set_tor_status("disabled")
+            await update_tor_state("disabled")
     else:
-        await set_tor_status("stopped")
+        await update_tor_state("stopped")
+
+
+## CONFIGURATION RELOADING
+def schedule_config_reload() -> None:
+    """
+    Reloads the configuration once the configuration directories have been
+    quiet for CONFIG_RELOAD_DELAY_MS.
+    """
+
+    if GlobalData.config_reload_handle is not None:
+        GlobalData.config_reload_handle.cancel()
+    GlobalData.config_reload_handle = asyncio.get_running_loop().call_later(
+        CONFIG_RELOAD_DELAY_MS / 1000, reload_config
+    )
+
+
+def reload_config() -> None:
+    """
+    Re-parses the configuration and applies it. The only key the client
+    uses is 'disable', which makes it disconnect and exit.
+    """
+
+    GlobalData.config_reload_handle = None
+    changed_keys: set[str] = reload_config_files()
+    if "disable" not in changed_keys or not ConfigData.conf_dict["disable"]:
+        return
+
+    logging.info(
+        "'disable' configuration key set to 'True', therefore exiting."
+    )
+    GlobalData.do_reconnect = False
+    ## main_loop() notices the closed connection, or checks 'disable' before
+    ## connecting again, and exits. Wake up wait_for_server() so that this
+    ## happens right away rather than after the current reconnect delay.
+    if GlobalData.sock_write is not None:
+        GlobalData.sock_write.close()
+    if GlobalData.server_event is not None:
+        GlobalData.server_event.set()
+
+
+def setup_config_watch() -> None:
+    """
+    Watches the configuration directories for changes.
+    """
+
+    watch_mask: int = (
+        pyinotify.IN_MODIFY
+        | pyinotify.IN_CREATE
+        | pyinotify.IN_DELETE
+        | pyinotify.IN_MOVED_FROM
+        | pyinotify.IN_MOVED_TO
+    )
+
+    GlobalData.config_watch_manager = pyinotify.WatchManager()
+    GlobalData.config_notifier = pyinotify.AsyncioNotifier(
+        GlobalData.config_watch_manager,
+        asyncio.get_running_loop(),
+        default_proc_fun=ConfigEventHandler(),
+    )
+    for conf_dir in ConfigData.conf_dir_list:
+        if not os.path.isdir(conf_dir):
+            continue
+        ret: dict[str, int] = GlobalData.config_watch_manager.add_watch(
+            conf_dir, watch_mask
+        )
+        for path, wd in ret.items():
+            if wd < 0:
+                logging.error("Failed to add inotify watch for '%s'!", path)
+
+
+## WAITING FOR THE SERVER
+def server_paths() -> tuple[Path, ...]:
+    """
+    Returns the paths whose appearance is a reason to try connecting to the
+    server right away.
+    """
+
+    return (
+        GlobalData.server_socket_path,
+        GlobalData.server_pid_path,
+        GlobalData.qubes_gateway_server_disabled_path,
+    )
+
+
+def server_paths_state() -> tuple[tuple[int, int] | None, ...]:
+    """
+    Returns the inode and modification time of each of server_paths(), or
+    None for paths that do not exist.
+    """
+
+    states: list[tuple[int, int] | None] = []
+    for path in server_paths():
+        try:
+            stat_result: os.stat_result = os.stat(path)
+        except OSError:
+            states.append(None)
+            continue
+        states.append((stat_result.st_ino, stat_result.st_mtime_ns))
+    return tuple(states)
+
+
+def watch_server_paths() -> None:
+    """
+    Watches the directories of server_paths(). A directory that does not
+    exist yet is covered by watching its parent, until it is created.
+    """
+
+    if GlobalData.server_watch_manager is None:
+        GlobalData.server_event = asyncio.Event()
+        GlobalData.server_watch_manager = pyinotify.WatchManager()
+        GlobalData.server_notifier = pyinotify.AsyncioNotifier(
+            GlobalData.server_watch_manager,
+            asyncio.get_running_loop(),
+            default_proc_fun=ServerPathEventHandler(),
+        )
+
+    watch_mask: int = (
+        pyinotify.IN_CREATE
+        | pyinotify.IN_MOVED_TO
+        | pyinotify.IN_DELETE
+        | pyinotify.IN_ATTRIB
+    )
+    for path in server_paths():
+        watch_dir: Path = path.parent
+        if not watch_dir.is_dir():
+            watch_dir = watch_dir.parent
+        if not watch_dir.is_dir():
+            continue
+        if str(watch_dir) in GlobalData.server_watch_dirs:
+            continue
+        ret: dict[str, int] = GlobalData.server_watch_manager.add_watch(
+            str(watch_dir), watch_mask
+        )
+        for watch_path, wd in ret.items():
+            if wd < 0:
+                logging.error(
+                    "Failed to add inotify watch for '%s'!", watch_path
+                )
+            else:
+                GlobalData.server_watch_dirs.add(watch_path)
+
+
+async def wait_for_server(delay: float) -> None:
+    """
+    Waits for up to `delay` seconds, returning early as soon as the server's
+    socket or PID file, or the qubes-gateway-server-disabled flag file, is
+    created or replaced, or the client is disabled.
+    """
+
+    watch_server_paths()
+    assert GlobalData.server_event is not None
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    deadline: float = loop.time() + delay
+    start_state: tuple[tuple[int, int] | None, ...] = server_paths_state()
+    while True:
+        remaining: float = deadline - loop.time()
+        if remaining <= 0:
+            return
+        GlobalData.server_event.clear()
+        try:
+            await asyncio.wait_for(GlobalData.server_event.wait(), remaining)
+        except TimeoutError:
+            return
+        if ConfigData.conf_dict.get("disable", False):
+            return
+        ## Something changed in one of the watched directories. That may be
+        ## a directory we have to watch next, or something unrelated.
+        watch_server_paths()
+        if server_paths_state() != start_state:
+            return
+
+
+def next_reconnect_delay() -> float:
+    """
+    Returns how long to wait before the next reconnect attempt, and backs off
+    further for the attempt after it. The delay is jittered, so that clients
+    that were disconnected at the same time do not all reconnect at the same
+    time.
+    """
+
+    delay: float = GlobalData.reconnect_delay
+    GlobalData.reconnect_delay = min(RECONNECT_DELAY_MAX, delay * 2)
+    return random.uniform(delay / 2, delay)
 
 
 ## SETUP FUNCTIONS
@@ -491,7 +826,11 @@ async def open_connection() -> bool:
     """
 
     while not GlobalData.server_socket_path.exists():
-        await asyncio.sleep(0.1)
+        if ConfigData.conf_dict.get("disable", False):
+            return False
+        if GlobalData.qubes_gateway_server_disabled_path.is_file():
+            return False
+        await wait_for_server(RECONNECT_DELAY_MAX)
     try:
         GlobalData.sock_read, GlobalData.sock_write = (
             await asyncio.open_unix_connection(GlobalData.server_socket_path)
@@ -509,7 +848,16 @@ async def setup_connection() -> None:
     """
 
     assert GlobalData.sock_write is not None
-    if GlobalData.server_pid_path.is_file() or not running_in_qubes_os():
+    ## Under Qubes OS, the socket is either that of a server running in the
+    ## same VM, or the qrexec proxy to one in another VM, which provides the
+    ## header and name for us. A socket activated server only creates its
+    ## PID file once it is up, so also go by the configuration that tells
+    ## whether a server is supposed to run here.
+    if (
+        GlobalData.server_pid_path.is_file()
+        or not running_in_qubes_os()
+        or ConfigData.conf_dict.get("run_server_in_qubes", False)
+    ):
         ## We have to send our own blank qrexec header.
         GlobalData.sock_write.write(b"\0")
         await GlobalData.sock_write.drain()
@@ -532,16 +880,17 @@ async def setup_connection() -> None:
 
 async def find_and_handle_tor_and_sdwdate_state() -> tuple[bool, bool]:
     """
-    Waits for the Tor and sdwdate state files to appear, sends information
-    about them to the server, and determines which files are available to be
-    watched via inotify.
+    Waits for the Tor and sdwdate state files to appear, records the current
+    state, and determines which files are available to be watched via
+    inotify. Only needed until the inotify watches exist, they keep the
+    state up to date from then on.
     """
 
     found_tor_paths: bool = False
     found_sdwdate_path: bool = False
 
     if not GlobalData.tor_control_panel_installed:
-        await set_tor_status("absent")
+        await update_tor_state("absent")
     else:
         for _ in range(20):
             if os.path.isdir(GlobalData.tor_path) and os.path.isdir(
@@ -552,7 +901,7 @@ async def find_and_handle_tor_and_sdwdate_state() -> tuple[bool, bool]:
             await asyncio.sleep(1)
         if not found_tor_paths:
             logging.error("tor status or configuration path does not exist!")
-            await set_tor_status("disabled")
+            await update_tor_state("disabled")
         else:
             await tor_status_changed()
 
@@ -563,7 +912,11 @@ async def find_and_handle_tor_and_sdwdate_state() -> tuple[bool, bool]:
         await asyncio.sleep(1)
     if not found_sdwdate_path:
         logging.error("sdwdate status path does not exist!")
-        await set_sdwdate_status("error", "sdwdate status path does not exist!")
+        GlobalData.sdwdate_state = (
+            "error",
+            "sdwdate status path does not exist!",
+        )
+        await replay_state()
         await kick_server()
     await sdwdate_status_changed()
 
@@ -621,29 +974,27 @@ async def do_setup() -> bool:
     Connects to the server and sets up inotify if needed.
     """
 
+    ## State changes are held back until the new server got the full state.
+    GlobalData.state_replayed = False
     if not await open_connection():
         return False
 
     try:
         await setup_connection()
 
-        found_tor_paths: bool
-        found_sdwdate_path: bool
-        found_tor_paths, found_sdwdate_path = (
-            await find_and_handle_tor_and_sdwdate_state()
-        )
-        if not found_sdwdate_path:
-            return False
-
         if GlobalData.watch_manager is None:
+            found_tor_paths: bool
+            found_sdwdate_path: bool
+            found_tor_paths, found_sdwdate_path = (
+                await find_and_handle_tor_and_sdwdate_state()
+            )
+            if not found_sdwdate_path:
+                return False
             await setup_inotify_watches(found_tor_paths, found_sdwdate_path)
 
-        ## Clear the last set tor status here so that we will send a repeated
-        ## tor status message in the event of a server restart. Not doing this
-        ## will result in the server thinking that the client's tor status is
-        ## UNKNOWN after a restart, resulting in Tor-related buttons being
-        ## improperly displayed.
-        GlobalData.last_tor_status = ""
+        ## The server may have been restarted and know nothing about us, so
+        ## always send the full state, even if it did not change.
+        await replay_state()
 
     except Exception:
         logging.error("sdwdate-gui server disconnected very quickly!")
@@ -667,8 +1018,12 @@ async def main_loop() -> None:
                 str(GlobalData.qubes_gateway_server_disabled_path),
             )
             break
+        if ConfigData.conf_dict.get("disable", False):
+            break
         if not await do_setup():
+            await wait_for_server(next_reconnect_delay())
             continue
+        connected_time: float = time.monotonic()
         while True:
             try:
                 in_data_task: asyncio.Task[bool] = asyncio.create_task(
@@ -697,7 +1052,9 @@ async def main_loop() -> None:
             or GlobalData.server_pid_path.is_file()
         ):
             sys.exit(0)
-        await asyncio.sleep(1)
+        if time.monotonic() - connected_time >= RECONNECT_DELAY_MAX:
+            GlobalData.reconnect_delay = RECONNECT_DELAY_MIN
+        await wait_for_server(next_reconnect_delay())
         continue
 
 
@@ -717,6 +1074,8 @@ async def main() -> NoReturn:
     logging.basicConfig(
         format="%(funcName)s: %(levelname)s: %(message)s", level=logging.INFO
     )
+    setup_profiling("client")
+    setup_tracing()
 
     try:
         parse_config_files()
@@ -730,5 +1089,6 @@ async def main() -> NoReturn:
         )
         sys.exit(0)
 
+    setup_config_watch()
     await main_loop()
     sys.exit(0)
@@ -0,0 +1,662 @@
+#!/usr/bin/python3 -su
+
+## Copyright (C) 2026 - 2026 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
+## See the file COPYING for copying conditions.
+
+# pylint: disable=broad-exception-caught
+
+"""
+Headless mode of sdwdate_gui_server, started by 'sdwdate-gui-server
+--headless'. Collects the status of sdwdate_gui_client instances on gateways
+and other systems without a display. Clients connect to the same socket and
+are held to the same rules as with the tray icon, see SdwdateGuiProtocol,
+but everything runs on plain asyncio, without loading Qt. The state of all
+clients is kept in memory and can be read from the query socket, see
+sdwdate_gui_query.
+"""
+
+import asyncio
+import os
+import sys
+import signal
+import socket
+import logging
+import time
+
+from collections import deque
+from typing import NoReturn, Any
+from pathlib import Path
+
+from .sdwdate_gui_metrics import (
+    count_metric,
+    observe_metric,
+    format_metrics,
+)
+from .sdwdate_gui_profiling import setup_profiling
+from .sdwdate_gui_trace import (
+    ServerTrace,
+    setup_tracing,
+)
+from .sdwdate_gui_shared import (
+    ConfigData,
+    MAX_MSG_SIZE,
+    parse_config_files,
+)
+from .sdwdate_gui_protocol import (
+    HANDSHAKE_TIMEOUT_MS,
+    WAITING_READ_BUFFER_SIZE,
+    SdwdateStatus,
+    TorStatus,
+    SdwdateGuiProtocol,
+    running_in_qubes_os,
+    claim_server_socket,
+    bind_server_socket,
+)
+from .sdwdate_gui_query import (
+    QUERY_SOCKET_NAME,
+    QUERY_REQUEST_MAX_LEN,
+    QUERY_REQUEST_TIMEOUT_MS,
+    MAX_SUBSCRIBER_BACKLOG,
+    MAX_QUERY_CONNECTIONS,
+    parse_query_request,
+    client_entry,
+    snapshot_message,
+    update_message,
+    remove_message,
+)
+from .sdwdate_gui_textfile import (
+    METRICS_TEXTFILE_INTERVAL_MS,
+    MetricsTextfile,
+)
+
+
+# pylint: disable=too-few-public-methods
+class GlobalData:
+    """
+    Global data for sdwdate_gui_headless.
+    """
+
+    uid_str: str = str(os.getuid())
+    sdwdate_run_dir: Path = Path(f"/run/user/{uid_str}/sdwdate-gui")
+    server_socket_path: Path = sdwdate_run_dir.joinpath(
+        "sdwdate-gui-server.socket",
+    )
+    server_pid_path: Path = sdwdate_run_dir.joinpath("server_pid")
+    query_socket_path: Path = sdwdate_run_dir.joinpath(QUERY_SOCKET_NAME)
+    ## All connected clients, and those of them that set their name.
+    connections: "set[HeadlessConnection]" = set()
+    named_connections: "dict[str, HeadlessConnection]" = {}
+    ## Clients waiting for a slot while 'max_clients' clients are connected,
+    ## in the order they connected.
+    admission_queue: "deque[HeadlessConnection]" = deque()
+    ## All connected query clients with the tasks serving them, and those of
+    ## them that subscribed to changes.
+    query_connections: dict[asyncio.StreamWriter, asyncio.Task[Any]] = {}
+    query_subscribers: set[asyncio.StreamWriter] = set()
+    metrics_textfile: MetricsTextfile = MetricsTextfile()
+    exit_event: asyncio.Event | None = None
+
+
+# pylint: disable=too-many-instance-attributes
+class HeadlessConnection(SdwdateGuiProtocol):
+    """
+    A sdwdate-gui client connected to the headless server. Holds the last
+    status the client reported.
+    """
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Creates a new HeadlessConnection for a newly accepted client.
+        """
+
+        SdwdateGuiProtocol.__init__(self)
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self.sdwdate_status: SdwdateStatus = SdwdateStatus.UNKNOWN
+        self.sdwdate_msg: str | None = None
+        self.tor_status: TorStatus = TorStatus.UNKNOWN
+        self.connected_at: float = time.monotonic()
+        self.last_update: float | None = None
+        self.__handshake_handle: asyncio.TimerHandle | None = None
+        self.__flush_handle: asyncio.TimerHandle | None = None
+        self.finished: asyncio.Event = asyncio.Event()
+        ## Resolved with True once a waiting client is admitted, or with
+        ## False if it is turned away, see handle_client.
+        self.admission: asyncio.Future[bool] | None = None
+        ## Data read from the client while it was waiting for admission.
+        self.__waiting_data: bytes = b""
+
+    async def run(self) -> None:
+        """
+        Feeds data from the client to the protocol until the client
+        disconnects or is kicked.
+        """
+
+        self.__handshake_handle = asyncio.get_running_loop().call_later(
+            HANDSHAKE_TIMEOUT_MS / 1000, self.__expire_handshake
+        )
+        try:
+            if len(self.__waiting_data) != 0:
+                self.handle_data(self.__waiting_data)
+                self.__waiting_data = b""
+            while not self.closed:
+                new_data: bytes
+                try:
+                    new_data = await self.reader.read(MAX_MSG_SIZE)
+                except OSError:
+                    break
+                if len(new_data) == 0:
+                    break
+                self.handle_data(new_data)
+        except Exception as e:
+            logging.error(
+                "Could not handle data from client '%s'!",
+                self.client_name_or_unknown(),
+                exc_info=e,
+            )
+        self.connection_lost()
+        self.writer.close()
+        self.finished.set()
+
+    async def wait_for_admission(self) -> bool:
+        """
+        Waits until the client is admitted or turned away, and returns True
+        or False respectively. Meanwhile, up to WAITING_READ_BUFFER_SIZE
+        bytes the client sends are read and kept for run(), so that a client
+        that disconnects while waiting is noticed and leaves the queue.
+        """
+
+        assert self.admission is not None
+        read_task: asyncio.Task[bytes] | None = None
+        try:
+            while (
+                not self.admission.done()
+                and len(self.__waiting_data) < WAITING_READ_BUFFER_SIZE
+            ):
+                read_task = asyncio.create_task(
+                    self.reader.read(
+                        WAITING_READ_BUFFER_SIZE - len(self.__waiting_data)
+                    )
+                )
+                await asyncio.wait(
+                    (read_task, self.admission),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not read_task.done():
+                    break
+                new_data: bytes
+                try:
+                    new_data = read_task.result()
+                except OSError:
+                    new_data = b""
+                read_task = None
+                if len(new_data) == 0:
+                    if not self.admission.done():
+                        GlobalData.admission_queue.remove(self)
+                        return False
+                    break
+                self.__waiting_data += new_data
+        finally:
+            ## Only one read may be pending on the stream at a time, so the
+            ## read has to be gone before run() starts reading.
+            if read_task is not None:
+                read_task.cancel()
+                await asyncio.wait((read_task,))
+        return await self.admission
+
+    def registered(self) -> bool:
+        """
+        Checks if the client is known under its name.
+        """
+
+        return (
+            self.client_name is not None
+            and GlobalData.named_connections.get(self.client_name) is self
+        )
+
+    def query_entry(self) -> dict[str, Any]:
+        """
+        Returns the description of the client sent to query clients.
+        """
+
+        assert self.client_name is not None
+        return client_entry(
+            self.client_name,
+            self.sdwdate_status,
+            self.sdwdate_msg,
+            self.tor_status,
+            self.last_update,
+            self.connected_at,
+        )
+
+    def __expire_handshake(self) -> None:
+        """
+        Kicks the client if it did not provide its name in time.
+        """
+
+        self.__handshake_handle = None
+        if self.handshake_pending:
+            count_metric("handshakes_expired")
+            self.handshake_timeout()
+
+    ## SdwdateGuiProtocol I/O
+    def write_data(self, data: bytes) -> None:
+        """
+        Queues data for sending to the client.
+        """
+
+        if self.writer.is_closing():
+            return
+        try:
+            self.writer.write(data)
+        except Exception:
+            self.kick_client("write_error")
+
+    def close_connection(self) -> None:
+        """
+        Disconnects the client, the read loop in run() ends afterwards.
+        """
+
+        self.writer.close()
+
+    def start_flush_timer(self, delay: float) -> None:
+        """
+        Schedules flush_pending_updates.
+        """
+
+        self.__flush_handle = asyncio.get_running_loop().call_later(
+            delay, self.flush_pending_updates
+        )
+
+    def stop_flush_timer(self) -> None:
+        """
+        Cancels the scheduled flush_pending_updates.
+        """
+
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+
+    def pass_on_name(self, client_name: str) -> None:
+        """
+        Registers the client under its name. Duplicate names are handled
+        like SdwdateTrayIcon.handle_client_name_change does.
+        """
+
+        if self.__handshake_handle is not None:
+            self.__handshake_handle.cancel()
+            self.__handshake_handle = None
+        old_connection: HeadlessConnection | None = (
+            GlobalData.named_connections.get(client_name)
+        )
+        if old_connection is not None:
+            if running_in_qubes_os():
+                ## The same VM reconnected before the server noticed the
+                ## previous connection had dropped.
+                old_connection.kick_client("stale_duplicate")
+            else:
+                logging.warning(
+                    "Kicking client '%s' for attempting to set a name "
+                    "'%s' identical to another client's name",
+                    self.client_name_or_unknown(),
+                    client_name,
+                )
+                self.kick_client("duplicate_name")
+                return
+        GlobalData.named_connections[client_name] = self
+        publish_query_message(update_message(self.query_entry()))
+
+    def pass_on_sdwdate_status(
+        self,
+        sdwdate_status: SdwdateStatus,
+        sdwdate_msg_str: str,
+        trace: ServerTrace | None,
+    ) -> None:
+        """
+        Records an sdwdate status update, unless it changes nothing.
+        """
+
+        if (
+            sdwdate_status == self.sdwdate_status
+            and sdwdate_msg_str == self.sdwdate_msg
+        ):
+            count_metric("status_updates_suppressed", kind="sdwdate")
+            if trace is not None:
+                trace.finish(self.client_name_or_unknown())
+            return
+        self.sdwdate_status = sdwdate_status
+        self.sdwdate_msg = sdwdate_msg_str
+        self.last_update = time.time()
+        if self.registered():
+            publish_query_message(update_message(self.query_entry()))
+        if trace is not None:
+            trace.finish(self.client_name_or_unknown())
+
+    def pass_on_tor_status(self, tor_status: TorStatus) -> None:
+        """
+        Records a Tor status update, unless it changes nothing.
+        """
+
+        if tor_status == self.tor_status:
+            count_metric("status_updates_suppressed", kind="tor")
+            return
+        self.tor_status = tor_status
+        self.last_update = time.time()
+        if self.registered():
+            publish_query_message(update_message(self.query_entry()))
+
+    def pass_on_close(self) -> None:
+        """
+        Forgets the client.
+        """
+
+        if self.__handshake_handle is not None:
+            self.__handshake_handle.cancel()
+            self.__handshake_handle = None
+        GlobalData.connections.discard(self)
+        if self.registered():
+            assert self.client_name is not None
+            del GlobalData.named_connections[self.client_name]
+            publish_query_message(remove_message(self.client_name))
+        admit_waiting_clients()
+
+
+def publish_query_message(message: bytes) -> None:
+    """
+    Sends an update or remove message to all subscribed query clients.
+    """
+
+    for writer in list(GlobalData.query_subscribers):
+        if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BACKLOG:
+            count_metric("query_subscribers_dropped")
+            GlobalData.query_subscribers.discard(writer)
+            ## Closing would wait for the backlog to be sent first.
+            writer.transport.abort()
+            continue
+        writer.write(message)
+
+
+async def handle_client(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """
+    Serves a newly connected sdwdate-gui client.
+    """
+
+    connection: HeadlessConnection = HeadlessConnection(reader, writer)
+    max_clients: int = ConfigData.conf_dict["max_clients"]
+    if (
+        len(GlobalData.connections) < max_clients
+        and len(GlobalData.admission_queue) == 0
+    ):
+        GlobalData.connections.add(connection)
+    elif (
+        len(GlobalData.admission_queue)
+        < ConfigData.conf_dict["admission_queue_size"]
+    ):
+        connection.admission = asyncio.get_running_loop().create_future()
+        GlobalData.admission_queue.append(connection)
+        count_metric("clients_queued")
+        if not await connection.wait_for_admission():
+            connection.close_connection()
+            connection.finished.set()
+            return
+    else:
+        logging.warning(
+            "Rejecting new client; already at the %d client limit",
+            max_clients,
+        )
+        connection.kick_client("client_limit")
+        return
+    count_metric("clients_accepted")
+    observe_metric(
+        "accept_latency_seconds", time.monotonic() - connection.connected_at
+    )
+    await connection.run()
+
+
+def admit_waiting_clients() -> None:
+    """
+    Admits waiting clients for as long as fewer than 'max_clients' clients
+    are connected.
+    """
+
+    max_clients: int = ConfigData.conf_dict["max_clients"]
+    while (
+        len(GlobalData.admission_queue) != 0
+        and len(GlobalData.connections) < max_clients
+    ):
+        connection: HeadlessConnection = GlobalData.admission_queue.popleft()
+        assert connection.admission is not None
+        ## Taking the slot right away, rather than once the waiting
+        ## client's task runs, keeps further clients from taking it too.
+        GlobalData.connections.add(connection)
+        connection.admission.set_result(True)
+
+
+async def handle_query(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """
+    Serves a newly connected query client, see sdwdate_gui_query.
+    """
+
+    if len(GlobalData.query_connections) >= MAX_QUERY_CONNECTIONS:
+        count_metric("queries_rejected")
+        writer.close()
+        return
+    query_task: asyncio.Task[Any] | None = asyncio.current_task()
+    assert query_task is not None
+    GlobalData.query_connections[writer] = query_task
+    try:
+        await serve_query(reader, writer)
+    except (ValueError, TimeoutError, OSError, asyncio.IncompleteReadError):
+        ## An over-long or late request, or a query client that went away.
+        pass
+    except Exception as e:
+        logging.error("Could not answer query client!", exc_info=e)
+    del GlobalData.query_connections[writer]
+    GlobalData.query_subscribers.discard(writer)
+    writer.close()
+
+
+async def serve_query(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """
+    Answers the request of a query client. For a subscription, waits until
+    the query client disconnects.
+    """
+
+    ## The reader's limit is QUERY_REQUEST_MAX_LEN, readline() raises
+    ## ValueError for longer lines.
+    request_line: bytes = await asyncio.wait_for(
+        reader.readline(), QUERY_REQUEST_TIMEOUT_MS / 1000
+    )
+    request: str | None = parse_query_request(request_line)
+    if request is None:
+        return
+    count_metric("queries_answered", request=request)
+    writer.write(snapshot_message(query_entries()))
+    if request == "snapshot":
+        await writer.drain()
+        return
+
+    GlobalData.query_subscribers.add(writer)
+    ## Subscribers have nothing more to say, anything they send is ignored.
+    while len(await reader.read(QUERY_REQUEST_MAX_LEN)) != 0:
+        pass
+
+
+def query_entries() -> list[dict[str, Any]]:
+    """
+    Returns the descriptions of all clients known under their name.
+    """
+
+    return [
+        connection.query_entry()
+        for _, connection in sorted(GlobalData.named_connections.items())
+    ]
+
+
+def update_metrics_textfile() -> None:
+    """
+    Rewrites the metrics file if anything changed since it was last
+    written, and schedules the next check. See sdwdate_gui_textfile.
+    """
+
+    GlobalData.metrics_textfile.update(
+        query_entries(), len(GlobalData.connections)
+    )
+    asyncio.get_running_loop().call_later(
+        METRICS_TEXTFILE_INTERVAL_MS / 1000, update_metrics_textfile
+    )
+
+
+def request_exit() -> None:
+    """
+    Handles SIGINT and SIGTERM.
+    """
+
+    logging.info("Received SIGINT or SIGTERM, exiting.")
+    assert GlobalData.exit_event is not None
+    GlobalData.exit_event.set()
+
+
+def log_metrics() -> None:
+    """
+    Handles SIGUSR2 by dumping all runtime metrics to the log.
+    """
+
+    logging.info("Runtime metrics:")
+    for line in format_metrics():
+        logging.info("  %s", line)
+
+
+async def serve() -> None:
+    """
+    Serves clients and queries until asked to exit.
+    """
+
+    activation_fd: int | None = claim_server_socket(
+        GlobalData.sdwdate_run_dir,
+        GlobalData.server_pid_path,
+        GlobalData.server_socket_path,
+    )
+    server_sock: socket.socket
+    query_sock: socket.socket
+    try:
+        if activation_fd is not None:
+            server_sock = socket.socket(fileno=activation_fd)
+        else:
+            server_sock = bind_server_socket(
+                GlobalData.server_socket_path,
+                ConfigData.conf_dict["listen_backlog"],
+            )
+        query_sock = bind_server_socket(
+            GlobalData.query_socket_path, MAX_QUERY_CONNECTIONS
+        )
+        server: asyncio.Server = await asyncio.start_unix_server(
+            handle_client, sock=server_sock
+        )
+        query_server: asyncio.Server = await asyncio.start_unix_server(
+            handle_query, sock=query_sock, limit=QUERY_REQUEST_MAX_LEN
+        )
+    except Exception as e:
+        logging.error("Could not listen on server socket!", exc_info=e)
+        sys.exit(1)
+
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    GlobalData.exit_event = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, request_exit)
+    loop.add_signal_handler(signal.SIGTERM, request_exit)
+    loop.add_signal_handler(signal.SIGUSR2, log_metrics)
+
+    if ConfigData.conf_dict["metrics_textfile_dir"] != "":
+        update_metrics_textfile()
+
+    await GlobalData.exit_event.wait()
+
+    GlobalData.metrics_textfile.remove()
+
+    query_server.close()
+    server.close()
+    waiting: list[HeadlessConnection] = list(GlobalData.admission_queue)
+    GlobalData.admission_queue.clear()
+    for connection in waiting:
+        assert connection.admission is not None
+        connection.admission.set_result(False)
+    connections: list[HeadlessConnection] = list(GlobalData.connections)
+    for connection in connections:
+        connection.close_connection()
+    for connection in connections + waiting:
+        await connection.finished.wait()
+    query_tasks: list[asyncio.Task[Any]] = list(
+        GlobalData.query_connections.values()
+    )
+    ## Do not wait for query clients to read what is still queued for them.
+    for writer in GlobalData.query_connections:
+        writer.transport.abort()
+    await asyncio.gather(*query_tasks, return_exceptions=True)
+    ## A socket from systemd has to stay for the next server to be
+    ## activated by.
+    stale_paths: list[Path] = [GlobalData.query_socket_path]
+    if activation_fd is None:
+        stale_paths.append(GlobalData.server_socket_path)
+    for stale_path in stale_paths:
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+def main() -> NoReturn:
+    """
+    Main function.
+    """
+
+    if os.geteuid() == 0:
+        print("ERROR: Do not run with sudo / as root!")
+        sys.exit(1)
+
+    if Path("/run/qubes/this-is-templatevm").is_file():
+        print("INFO: Refusing to run in a QubesOS TemplateVM.")
+        sys.exit(0)
+
+    logging.basicConfig(
+        format="%(funcName)s: %(levelname)s: %(message)s", level=logging.INFO
+    )
+    setup_profiling("server")
+    setup_tracing()
+
+    try:
+        parse_config_files()
+    except Exception as e:
+        logging.error("Configuration file parsing failed!", exc_info=e)
+        sys.exit(1)
+    assert isinstance(ConfigData.conf_dict["disable"], bool)
+    assert isinstance(ConfigData.conf_dict["run_server_in_qubes"], bool)
+    assert isinstance(ConfigData.conf_dict["max_clients"], int)
+    assert isinstance(ConfigData.conf_dict["listen_backlog"], int)
+    assert isinstance(ConfigData.conf_dict["admission_queue_size"], int)
+    assert isinstance(ConfigData.conf_dict["status_rate_limit"], int)
+    assert isinstance(ConfigData.conf_dict["status_rate_burst"], int)
+    assert isinstance(ConfigData.conf_dict["status_flood_kick_limit"], int)
+    assert isinstance(ConfigData.conf_dict["metrics_textfile_dir"], str)
+    if ConfigData.conf_dict["disable"]:
+        logging.info(
+            "'disable' configuration key set to 'True', therefore exiting."
+        )
+        sys.exit(0)
+    if running_in_qubes_os():
+        if not ConfigData.conf_dict["run_server_in_qubes"]:
+            logging.info(
+                "Running in Qubes OS, but 'run_server_in_qubes' config is "
+                "set to 'False', therefore exiting."
+            )
+            sys.exit(0)
+
+    asyncio.run(serve())
+    sys.exit(0)
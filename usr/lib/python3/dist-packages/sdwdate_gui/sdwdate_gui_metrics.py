@@ -0,0 +1,261 @@
+#!/usr/bin/python3 -su
+
+## Copyright (C) 2025 - 2025 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
+## See the file COPYING for copying conditions.
+
+"""
+Lightweight runtime metrics for sdwdate-gui. Provides counters and latency
+histograms that can be dumped to the log on request, or exported in the
+Prometheus text format, see sdwdate_gui_textfile. Metrics may be recorded
+from any thread.
+"""
+
+import functools
+import math
+import threading
+import time
+
+from typing import Any, Callable, TypeVar, cast
+
+## Metrics are identified by their name plus a sorted tuple of label
+## key-value pairs, so that e.g. kicks can be counted per reason.
+MetricKey = tuple[str, tuple[tuple[str, str], ...]]
+
+## Upper bounds of the histogram buckets, in seconds. Everything slower than
+## the last bound lands in an implicit overflow bucket.
+HISTOGRAM_BUCKETS: tuple[float, ...] = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+)
+
+FuncT = TypeVar("FuncT", bound=Callable[..., Any])
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram of durations.
+    """
+
+    __slots__ = ("bucket_counts", "count", "total", "maximum")
+
+    def __init__(self) -> None:
+        """
+        Creates an empty histogram.
+        """
+
+        self.bucket_counts: list[int] = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.maximum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Records one observation.
+        """
+
+        idx: int = 0
+        while idx < len(HISTOGRAM_BUCKETS) and value > HISTOGRAM_BUCKETS[idx]:
+            idx += 1
+        self.bucket_counts[idx] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Returns an upper bound for the given quantile, taken from the bucket
+        boundaries. Observations in the overflow bucket are reported as the
+        largest observed value.
+        """
+
+        if self.count == 0:
+            return 0.0
+        target: float = fraction * self.count
+        seen: int = 0
+        for idx, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= target:
+                if idx < len(HISTOGRAM_BUCKETS):
+                    return min(HISTOGRAM_BUCKETS[idx], self.maximum)
+                break
+        return self.maximum
+
+
+# pylint: disable=too-few-public-methods
+class MetricsData:
+    """
+    Global metrics storage.
+    """
+
+    counters: dict[MetricKey, int] = {}
+    histograms: dict[MetricKey, Histogram] = {}
+    ## Reentrant, since format_metrics() is called from a signal handler,
+    ## which may interrupt the main thread while it holds the lock.
+    lock: threading.RLock = threading.RLock()
+
+
+def metric_key(name: str, labels: dict[str, str]) -> MetricKey:
+    """
+    Builds the key a metric is stored under.
+    """
+
+    return name, tuple(sorted(labels.items()))
+
+
+def count_metric(name: str, amount: int = 1, **labels: str) -> None:
+    """
+    Increments a counter.
+    """
+
+    key: MetricKey = metric_key(name, labels)
+    with MetricsData.lock:
+        MetricsData.counters[key] = MetricsData.counters.get(key, 0) + amount
+
+
+def observe_metric(name: str, value: float, **labels: str) -> None:
+    """
+    Records a duration, in seconds, in a histogram.
+    """
+
+    key: MetricKey = metric_key(name, labels)
+    with MetricsData.lock:
+        histogram: Histogram | None = MetricsData.histograms.get(key)
+        if histogram is None:
+            histogram = Histogram()
+            MetricsData.histograms[key] = histogram
+        histogram.observe(value)
+
+
+def timed_metric(name: str) -> Callable[[FuncT], FuncT]:
+    """
+    Decorator that records the wall time of every call to the decorated
+    function in the histogram 'name'. The histogram's count doubles as the
+    number of calls.
+    """
+
+    def decorator(func: FuncT) -> FuncT:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start_time: float = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe_metric(name, time.perf_counter() - start_time)
+
+        return cast(FuncT, wrapper)
+
+    return decorator
+
+
+def format_metric_key(key: MetricKey) -> str:
+    """
+    Renders a metric key as 'name{label="value",...}'.
+    """
+
+    name, labels = key
+    if len(labels) == 0:
+        return name
+    label_str: str = ",".join(f'{k}="{v}"' for k, v in labels)
+    return f"{name}{{{label_str}}}"
+
+
+def format_metrics() -> list[str]:
+    """
+    Renders all metrics as human-readable lines, suitable for logging.
+    """
+
+    lines: list[str] = []
+    with MetricsData.lock:
+        for key, value in sorted(MetricsData.counters.items()):
+            lines.append(f"{format_metric_key(key)}: {value}")
+        for key, histogram in sorted(MetricsData.histograms.items()):
+            lines.append(
+                f"{format_metric_key(key)}: count={histogram.count} "
+                f"avg={histogram.total / histogram.count * 1000:.3f}ms "
+                f"p50<={histogram.quantile(0.5) * 1000:.3f}ms "
+                f"p99<={histogram.quantile(0.99) * 1000:.3f}ms "
+                f"max={histogram.maximum * 1000:.3f}ms"
+            )
+    if len(lines) == 0:
+        lines.append("No metrics recorded yet.")
+    return lines
+
+
+def escape_label_value(value: str) -> str:
+    """
+    Escapes a label value for the Prometheus text exposition format.
+    """
+
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_exposition_key(
+    name: str, labels: tuple[tuple[str, str], ...]
+) -> str:
+    """
+    Renders a metric name and labels in the Prometheus text exposition
+    format.
+    """
+
+    if len(labels) == 0:
+        return name
+    label_str: str = ",".join(
+        f'{k}="{escape_label_value(v)}"' for k, v in labels
+    )
+    return f"{name}{{{label_str}}}"
+
+
+def format_exposition_metrics(prefix: str) -> list[str]:
+    """
+    Renders all metrics in the Prometheus text exposition format, with
+    `prefix` prepended to their names. Counters get the conventional
+    '_total' suffix, histograms are exported with cumulative buckets.
+    """
+
+    lines: list[str] = []
+    typed_names: set[str] = set()
+    with MetricsData.lock:
+        for (name, labels), value in sorted(MetricsData.counters.items()):
+            counter_name: str = f"{prefix}{name}_total"
+            if counter_name not in typed_names:
+                typed_names.add(counter_name)
+                lines.append(f"# TYPE {counter_name} counter")
+            lines.append(
+                f"{format_exposition_key(counter_name, labels)} {value}"
+            )
+        for (name, labels), histogram in sorted(
+            MetricsData.histograms.items()
+        ):
+            histogram_name: str = f"{prefix}{name}"
+            if histogram_name not in typed_names:
+                typed_names.add(histogram_name)
+                lines.append(f"# TYPE {histogram_name} histogram")
+            cumulative_count: int = 0
+            for bound, bucket_count in zip(
+                HISTOGRAM_BUCKETS + (math.inf,), histogram.bucket_counts
+            ):
+                cumulative_count += bucket_count
+                bound_str: str = "+Inf" if math.isinf(bound) else repr(bound)
+                lines.append(
+                    format_exposition_key(
+                        f"{histogram_name}_bucket",
+                        labels + (("le", bound_str),),
+                    )
+                    + f" {cumulative_count}"
+                )
+            lines.append(
+                f"{format_exposition_key(f'{histogram_name}_sum', labels)} "
+                f"{histogram.total!r}"
+            )
+            lines.append(
+                f"{format_exposition_key(f'{histogram_name}_count', labels)} "
+                f"{histogram.count}"
+            )
+    return lines
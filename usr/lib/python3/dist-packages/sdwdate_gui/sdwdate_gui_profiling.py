@@ -0,0 +1,198 @@
+#!/usr/bin/python3 -su
+
+## Copyright (C) 2025 - 2025 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
+## See the file COPYING for copying conditions.
+
+# pylint: disable=broad-exception-caught
+
+"""
+On-demand profiling for sdwdate-gui. Sending SIGUSR1 to the server or client
+starts cProfile and tracemalloc collection, sending it again stops collection
+and writes the results to /run/user/UID/sdwdate-gui/profiles/. Setting
+SDWDATE_GUI_PROFILE=1 in the environment starts collection at startup.
+Nothing is hooked into the interpreter while collection is stopped.
+
+Before Python 3.12, a cProfile profiler only sees the thread that enabled
+it. Other threads running Python code register with
+register_profiled_thread(), so that they get a profiler of their own while
+collection runs. All profilers are written to the same report.
+"""
+
+import atexit
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+from pathlib import Path
+from types import FrameType
+from typing import Callable
+
+## Number of allocation sites listed in the tracemalloc report.
+TRACEMALLOC_TOP_COUNT: int = 50
+## Number of stack frames tracemalloc records per allocation.
+TRACEMALLOC_FRAME_COUNT: int = 10
+
+
+# pylint: disable=too-few-public-methods
+class ProfilingData:
+    """
+    Global profiling state.
+    """
+
+    component: str = ""
+    profiles_dir: Path = Path(
+        f"/run/user/{os.getuid()}/sdwdate-gui/profiles",
+    )
+    profiler: cProfile.Profile | None = None
+    ## Profilers of other threads, by thread identifier, and the hooks that
+    ## start or stop them. See register_profiled_thread().
+    thread_profilers: dict[int, cProfile.Profile] = {}
+    thread_hooks: list[Callable[[bool], None]] = []
+    thread_lock: threading.Lock = threading.Lock()
+
+
+def register_profiled_thread(hook: Callable[[bool], None]) -> None:
+    """
+    Registers a thread to be profiled along with the main thread. `hook` is
+    called with True when collection starts and with False when it stops,
+    and has to make the thread call start_thread_profiling() or
+    stop_thread_profiling() respectively before returning. A thread that
+    starts while collection is running calls start_thread_profiling()
+    itself.
+    """
+
+    ProfilingData.thread_hooks.append(hook)
+
+
+def start_thread_profiling() -> None:
+    """
+    Starts a profiler for the calling thread if collection is running. Not
+    needed since Python 3.12, where cProfile sees all threads.
+    """
+
+    if ProfilingData.profiler is None or sys.version_info >= (3, 12):
+        return
+    profiler: cProfile.Profile = cProfile.Profile()
+    with ProfilingData.thread_lock:
+        ProfilingData.thread_profilers[threading.get_ident()] = profiler
+    profiler.enable()
+
+
+def stop_thread_profiling() -> None:
+    """
+    Stops the profiler of the calling thread, if it has one. Its results are
+    kept for the report.
+    """
+
+    with ProfilingData.thread_lock:
+        profiler: cProfile.Profile | None = ProfilingData.thread_profilers.get(
+            threading.get_ident()
+        )
+    if profiler is not None:
+        profiler.disable()
+
+
+def start_profiling() -> None:
+    """
+    Starts cProfile and tracemalloc collection.
+    """
+
+    ProfilingData.profiler = cProfile.Profile()
+    tracemalloc.start(TRACEMALLOC_FRAME_COUNT)
+    ProfilingData.profiler.enable()
+    for hook in ProfilingData.thread_hooks:
+        hook(True)
+    logging.info("Profiling started.")
+
+
+def stop_profiling() -> None:
+    """
+    Stops cProfile and tracemalloc collection and writes the reports.
+    """
+
+    assert ProfilingData.profiler is not None
+    ProfilingData.profiler.disable()
+    for hook in ProfilingData.thread_hooks:
+        hook(False)
+    snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    profiler: cProfile.Profile = ProfilingData.profiler
+    ProfilingData.profiler = None
+    with ProfilingData.thread_lock:
+        thread_profilers: list[cProfile.Profile] = list(
+            ProfilingData.thread_profilers.values()
+        )
+        ProfilingData.thread_profilers.clear()
+
+    report_prefix: str = (
+        f"{ProfilingData.component}-{os.getpid()}-"
+        f"{time.strftime('%Y%m%d-%H%M%S')}"
+    )
+    pstats_path: Path = ProfilingData.profiles_dir.joinpath(
+        f"{report_prefix}.pstats"
+    )
+    alloc_path: Path = ProfilingData.profiles_dir.joinpath(
+        f"{report_prefix}-allocations.txt"
+    )
+    try:
+        ProfilingData.profiles_dir.mkdir(
+            mode=0o700,
+            parents=True,
+            exist_ok=True,
+        )
+        stats: pstats.Stats = pstats.Stats(profiler)
+        for thread_profiler in thread_profilers:
+            stats.add(thread_profiler)
+        stats.dump_stats(pstats_path)
+        with open(alloc_path, "w", encoding="utf-8") as f:
+            for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP_COUNT]:
+                f.write(f"{stat}\n")
+    except Exception as e:
+        logging.error("Could not write profiling reports!", exc_info=e)
+        return
+    logging.info(
+        "Profiling stopped, reports written to '%s' and '%s'.",
+        str(pstats_path),
+        str(alloc_path),
+    )
+
+
+# pylint: disable=unused-argument
+def profiling_signal_handler(sig: int, frame: FrameType | None) -> None:
+    """
+    Handles SIGUSR1 by toggling profiling.
+    """
+
+    if ProfilingData.profiler is None:
+        start_profiling()
+    else:
+        stop_profiling()
+
+
+def stop_profiling_at_exit() -> None:
+    """
+    Writes the reports of a still-running profiling session on exit.
+    """
+
+    if ProfilingData.profiler is not None:
+        stop_profiling()
+
+
+def setup_profiling(component: str) -> None:
+    """
+    Installs the profiling signal handler, and starts profiling right away
+    if requested through the environment. `component` is used to name the
+    report files.
+    """
+
+    ProfilingData.component = component
+    signal.signal(signal.SIGUSR1, profiling_signal_handler)
+    atexit.register(stop_profiling_at_exit)
+    if os.environ.get("SDWDATE_GUI_PROFILE", "") == "1":
+        start_profiling()
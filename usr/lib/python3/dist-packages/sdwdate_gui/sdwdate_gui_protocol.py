@@ -0,0 +1,1027 @@
+#!/usr/bin/python3 -su
+
+## Copyright (C) 2026 - 2026 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
+## See the file COPYING for copying conditions.
+
+# pylint: disable=broad-exception-caught,too-many-lines
+
+"""
+The server side of the sdwdate-gui protocol, shared by sdwdate_gui_server and
+its headless mode in sdwdate_gui_headless: framing, validation of everything
+a client sends, rate limiting of status updates, and setting up the server
+socket. Nothing in here depends on Qt, SdwdateGuiProtocol leaves the actual
+I/O to its subclasses.
+"""
+
+import os
+import sys
+import socket
+import re
+import logging
+import time
+
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Pattern
+from pathlib import Path
+
+from sanitize_string.sanitize_string_lib import sanitize_string
+
+from .sdwdate_gui_metrics import count_metric
+from .sdwdate_gui_trace import (
+    TraceData,
+    ServerTrace,
+)
+from .sdwdate_gui_shared import (
+    ConfigData,
+    check_bytes_printable,
+    parse_ipc_command,
+)
+
+
+## Reasonable maximum lengths for untrusted strings shown to the user. A VM
+## name under Qubes OS is at most 31 characters; the non-Qubes self-reported
+## name is capped at 255.
+MAX_QUBES_NAME_LEN: int = 31
+MAX_DISPLAY_NAME_LEN: int = 255
+
+## Bound how long a client may stay connected without completing its
+## handshake (providing a name), so a misbehaving or hostile client cannot
+## exhaust memory or file descriptors with idle half-open connections. The
+## number of clients connected at once is bounded by the 'max_clients'
+## configuration key.
+HANDSHAKE_TIMEOUT_MS: int = 30000
+
+## Bytes read ahead from a client waiting for admission, see
+## 'admission_queue_size'. Anything more it sends is held back until it is
+## admitted.
+WAITING_READ_BUFFER_SIZE: int = 4096
+
+## Length of the window in which throttled status updates are counted
+## against the 'status_flood_kick_limit' configuration key.
+FLOOD_WINDOW_SECONDS: float = 10.0
+
+## First file descriptor passed by systemd socket activation, see
+## sd_listen_fds(3).
+SD_LISTEN_FDS_START: int = 3
+
+## Functions the client may call on the server.
+SERVER_RPC_CALLS: tuple[str, ...] = (
+    "set_client_name",
+    "set_sdwdate_status",
+    "set_tor_status",
+)
+
+
+def sanitize_for_richtext(untrusted: str, max_length: int) -> str:
+    """
+    Remove Unicode and HTML from an untrusted string and truncate it to a
+    maximum length.
+    """
+
+    return sanitize_string(untrusted)[:max_length]
+
+
+## Matches an octal escape in an sdwdate status message.
+OCTAL_ESCAPE_RE: Pattern[str] = re.compile(r"\\\d{3}")
+
+
+def octal_decode(octal_match: re.Match[str]) -> str:
+    """
+    Decodes an octal escape in an sdwdate status string.
+    """
+
+    octal_str: str = octal_match.group().strip("\\")
+    octal_int: int = int(octal_str, 8)
+    if (octal_int < 0x20 or octal_int > 0x7E) and octal_int != 0x0A:
+        raise ValueError(f"Unsafe octal escape '{octal_str}'")
+    real_char: str = chr(octal_int)
+    return real_char
+
+
+def decode_sdwdate_msg(sdwdate_msg_str: str) -> str:
+    """
+    Decodes the octal escapes in an sdwdate status message received from a
+    client. Raises ValueError if the message contains an unsafe escape.
+    """
+
+    ## We used to do this by getting a set of all escapes, then iterating
+    ## through them and replacing each one, but this could cause
+    ## non-deterministic behavior and was inefficient. Now we offload most of
+    ## the work to Python's regex engine, which processes everything in a
+    ## single left-to-right pass.
+    return OCTAL_ESCAPE_RE.sub(octal_decode, sdwdate_msg_str)
+
+
+class SdwdateStatus(Enum):
+    """
+    Status of the sdwdate process running on a client system.
+    """
+
+    SUCCESS = 0
+    BUSY = 1
+    ERROR = 2
+    UNKNOWN = 0xFF
+
+
+class TorStatus(Enum):
+    """
+    Status of the Tor process running on a client system, if Tor is present on
+    the client.
+    """
+
+    RUNNING = 0
+    STOPPED = 1
+    DISABLED = 2
+    DISABLED_RUNNING = 3
+    ABSENT = 0xFE
+    UNKNOWN = 0xFF
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Holds up to `capacity` tokens, refilled at
+    `rate` tokens per second.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "last_refill")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        Creates a full bucket.
+        """
+
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.last_refill: float = time.monotonic()
+
+    def __refill(self) -> None:
+        """
+        Adds the tokens accumulated since the last refill.
+        """
+
+        now: float = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.last_refill) * self.rate,
+        )
+        self.last_refill = now
+
+    def try_take(self) -> bool:
+        """
+        Takes a token if one is available.
+        """
+
+        self.__refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def seconds_until_token(self) -> float:
+        """
+        Returns how long it takes until a token is available.
+        """
+
+        self.__refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reconfigure(self, rate: float, capacity: float) -> None:
+        """
+        Changes the rate and capacity, keeping the tokens accumulated so far
+        as far as they fit.
+        """
+
+        self.__refill()
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+
+def running_in_qubes_os() -> bool:
+    """
+    Detects if the server is running on Qubes OS. The behavior when getting
+    the client's name has to be somewhat different on Qubes OS, so we need to
+    adjust for that use case.
+    """
+
+    if Path("/usr/share/qubes/marker-vm").is_file():
+        return True
+
+    return False
+
+
+def activation_socket_fd(socket_path: Path) -> int | None:
+    """
+    Returns the listening socket passed by systemd socket activation, see
+    sdwdate-gui-server.socket, or None if the server was not socket activated
+    and has to create its socket itself. Exits if the passed socket is not
+    listening at `socket_path`, where clients connect to.
+    """
+
+    ## Not meant for any process we might start.
+    listen_pid: str | None = os.environ.pop("LISTEN_PID", None)
+    listen_fds: str | None = os.environ.pop("LISTEN_FDS", None)
+    os.environ.pop("LISTEN_FDNAMES", None)
+    if listen_pid != str(os.getpid()) or listen_fds is None:
+        return None
+    if listen_fds != "1":
+        logging.error(
+            "Expected one socket from systemd, got '%s'!", listen_fds
+        )
+        sys.exit(1)
+
+    try:
+        listen_sock: socket.socket = socket.socket(fileno=SD_LISTEN_FDS_START)
+        try:
+            sock_ok: bool = (
+                listen_sock.family == socket.AF_UNIX
+                and listen_sock.type == socket.SOCK_STREAM
+                and listen_sock.getsockopt(
+                    socket.SOL_SOCKET, socket.SO_ACCEPTCONN
+                )
+                != 0
+                and listen_sock.getsockname() == str(socket_path)
+            )
+        finally:
+            listen_sock.detach()
+        os.set_inheritable(SD_LISTEN_FDS_START, False)
+    except Exception as e:
+        logging.error("Could not use socket from systemd!", exc_info=e)
+        sys.exit(1)
+    if not sock_ok:
+        logging.error(
+            "Socket from systemd is not a listening socket at '%s'!",
+            str(socket_path),
+        )
+        sys.exit(1)
+    return SD_LISTEN_FDS_START
+
+
+def claim_server_socket(
+    sdwdate_run_dir: Path,
+    sdwdate_pid_file: Path,
+    sdwdate_socket_file: Path,
+) -> int | None:
+    """
+    Makes sure no other server is running, records our PID, and clears the
+    way for creating the server socket. Returns the listening socket passed
+    by systemd socket activation, if any, see activation_socket_fd. Exits on
+    failure.
+    """
+
+    try:
+        sdwdate_run_dir.mkdir(
+            parents=True,
+            exist_ok=True,
+        )
+    except Exception:
+        logging.critical(
+            "Could not create '%s' directory!'!",
+            str(sdwdate_run_dir),
+        )
+        sys.exit(1)
+
+    ## This PID file mechanism is prone to race conditions. If we were
+    ## trying to be highly robust, we'd want to use advisory locking via
+    ## os.lockf rather than a PID file. That would probably be overkill
+    ## for this applet though, as the OS will only ever try to start once
+    ## instance of the server per logged-in user account, unless the
+    ## end-user is intentionally trying to run multiple server instances.
+    if sdwdate_pid_file.is_file():
+        try:
+            with open(sdwdate_pid_file, "r", encoding="utf-8") as f:
+                sdwdate_pid_str: str = f.readline().strip()
+            pid_verify_re: Pattern[str] = re.compile("^[0-9]+$")
+            if not pid_verify_re.match(sdwdate_pid_str):
+                logging.error(
+                    "PID marker file contains non-numeric characters!",
+                )
+                sys.exit(1)
+            if Path(f"/proc/{sdwdate_pid_str}").is_dir():
+                logging.error(
+                    "sdwdate_gui_server is already running!",
+                )
+                sys.exit(1)
+        except Exception as e:
+            logging.error(
+                "Could not check for running sdwdate_gui_server!",
+                exc_info=e,
+            )
+            sys.exit(1)
+
+    try:
+        os.remove(sdwdate_pid_file)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(
+            "Could not erase old PID file!",
+            exc_info=e,
+        )
+        sys.exit(1)
+
+    try:
+        with open(sdwdate_pid_file, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+    except Exception as e:
+        logging.error(
+            "Could not save PID to PID file!",
+            exc_info=e,
+        )
+        sys.exit(1)
+
+    ## Under socket activation, systemd already created the socket and
+    ## clients may be queued on it.
+    activation_fd: int | None = activation_socket_fd(sdwdate_socket_file)
+    if activation_fd is None:
+        try:
+            os.remove(sdwdate_socket_file)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(
+                "Could not erase old server socket!",
+                exc_info=e,
+            )
+            sys.exit(1)
+    return activation_fd
+
+
+def bind_server_socket(socket_path: Path, backlog: int) -> socket.socket:
+    """
+    Creates a listening socket at `socket_path` that only the owning user
+    may connect to. `backlog` is the number of connections the kernel
+    queues until they are accepted; further connections are refused.
+    """
+
+    try:
+        os.remove(socket_path)
+    except FileNotFoundError:
+        pass
+    listen_sock: socket.socket = socket.socket(
+        socket.AF_UNIX, socket.SOCK_STREAM
+    )
+    ## Restrict the socket to the owning user rather than relying solely on
+    ## the 0700 mode of the parent /run/user/UID directory.
+    old_umask: int = os.umask(0o077)
+    try:
+        listen_sock.bind(str(socket_path))
+    finally:
+        os.umask(old_umask)
+    listen_sock.listen(backlog)
+    return listen_sock
+
+
+# pylint: disable=too-many-instance-attributes
+class SdwdateGuiProtocol(ABC):
+    """
+    The server side of a connection with a sdwdate-gui client. Does all
+    framing and validation of the data the client sends, and only passes on
+    validated state changes. Subclasses do the I/O: they feed the data they
+    read to handle_data, call connection_lost once the client is gone, and
+    implement the abstract methods below.
+
+    Each message is sent as a length-prefixed packet. Each length prefix is a
+    two-byte, big-endian integer specifying the number of bytes in the
+    message. The messages then consist of a string, with space-separated
+    words. The first word is the name of the function being called, subsequent
+    strings are arguments. Functions do not "return" any values.
+
+    The following functions are provided by the server and can be called by
+    the client:
+    - set_client_name <name>
+    - set_sdwdate_status [success|busy|error] [message] [trace token]
+    - set_tor_status [running|stopped|disabled|disabled_running|absent]
+
+    The following functions are provided by the client and can be called by
+    the server:
+    - open_tor_control_panel
+    - open_sdwdate_log
+    - restart_sdwdate
+    - stop_sdwdate
+    - suppress_client_reconnect
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes the state of a newly connected client.
+        """
+
+        self.client_name: str | None = None
+        self.client_name_set: bool = False
+        self.qubes_header_parsed: bool = False
+        self.kick_in_progress: bool = False
+        self.closed: bool = False
+
+        self.__received_ns: int = 0
+        self.__received_wall_ns: int = 0
+
+        self.__sock_buf: bytes = b""
+
+        ## A client that connects but never completes its handshake by
+        ## providing a name is kicked once HANDSHAKE_TIMEOUT_MS passed, so
+        ## half-open / idle connections cannot accumulate. This is cleared as
+        ## soon as the name is set or the client disconnects.
+        self.handshake_pending: bool = True
+
+        ## Status updates each cause work for the server, so they are rate
+        ## limited. Updates over the limit are not passed on right away, the
+        ## latest one of each kind is kept and passed on once the bucket
+        ## allows it.
+        self.status_bucket: TokenBucket = TokenBucket(
+            ConfigData.conf_dict["status_rate_limit"],
+            ConfigData.conf_dict["status_rate_burst"],
+        )
+        self.__pending_sdwdate_status: (
+            tuple[SdwdateStatus, str, ServerTrace | None] | None
+        ) = None
+        self.__pending_tor_status: TorStatus | None = None
+        self.__flush_scheduled: bool = False
+        self.__flood_window_start: float = time.monotonic()
+        self.__flood_window_count: int = 0
+
+    ## I/O, PROVIDED BY SUBCLASSES
+    @abstractmethod
+    def write_data(self, data: bytes) -> None:
+        """
+        Sends data to the client. Kicks the client on write errors.
+        """
+
+    @abstractmethod
+    def close_connection(self) -> None:
+        """
+        Disconnects the client. connection_lost is called right afterwards,
+        so this must not call it again.
+        """
+
+    @abstractmethod
+    def start_flush_timer(self, delay: float) -> None:
+        """
+        Calls flush_pending_updates in `delay` seconds.
+        """
+
+    @abstractmethod
+    def stop_flush_timer(self) -> None:
+        """
+        Cancels a call scheduled with start_flush_timer.
+        """
+
+    @abstractmethod
+    def pass_on_name(self, client_name: str) -> None:
+        """
+        Passes on the client's validated and sanitized name.
+        """
+
+    @abstractmethod
+    def pass_on_sdwdate_status(
+        self,
+        sdwdate_status: SdwdateStatus,
+        sdwdate_msg_str: str,
+        trace: ServerTrace | None,
+    ) -> None:
+        """
+        Passes on a validated sdwdate status update.
+        """
+
+    @abstractmethod
+    def pass_on_tor_status(self, tor_status: TorStatus) -> None:
+        """
+        Passes on a validated Tor status update.
+        """
+
+    @abstractmethod
+    def pass_on_close(self) -> None:
+        """
+        Passes on that the client is gone.
+        """
+
+    ## CONNECTION STATE
+    def connection_lost(self) -> None:
+        """
+        Tears down the connection after the client disconnected or was
+        kicked.
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        self.handshake_pending = False
+        self.discard_pending_updates()
+        self.pass_on_close()
+
+    def handshake_timeout(self) -> None:
+        """
+        Kick a still-connected client that never set its name in time.
+        """
+
+        if not self.handshake_pending or self.client_name_set or self.closed:
+            return
+        logging.warning(
+            "Kicking client '%s' for not completing its handshake in time",
+            self.client_name_or_unknown(),
+        )
+        self.kick_client("handshake_timeout")
+
+    def client_name_or_unknown(self) -> str:
+        """
+        Returns the client name if set, otherwise returns "Unknown".
+        """
+
+        if self.client_name is not None:
+            return self.client_name
+
+        return "Unknown"
+
+    def kick_client(self, reason: str) -> None:
+        """
+        Forcibly disconnects the client from the server. Used when a client
+        sends invalid data to the server as a security measure. `reason` is
+        a short machine-readable tag used for metrics.
+        """
+
+        ## Guard against re-entrancy. On Qubes OS this calls
+        ## suppress_client_reconnect(), which sends an RPC; if that send hits
+        ## a write error, write_data() calls kick_client() again, which would
+        ## recurse indefinitely.
+        if self.kick_in_progress or self.closed:
+            return
+        self.kick_in_progress = True
+        count_metric("clients_kicked", reason=reason)
+
+        if running_in_qubes_os():
+            ## Under Qubes OS, the client will automatically reconnect if the
+            ## server disconnects it. Suggest to the client that it not do
+            ## that. Assuming the cause of client misbehavior is simply a bug,
+            ## this should help prevent endless reconnect loops. Note that the
+            ## client may disregard this; we cannot assume the client won't
+            ## try to reconnect after receiving this.
+            self.call_rpc("suppress_client_reconnect")
+
+        self.close_connection()
+        self.connection_lost()
+
+    ## RATE LIMITING
+    def __admit_status_update(self) -> bool:
+        """
+        Takes a token for a status update. Returns True if the update may be
+        passed on right away, False if it has to be kept as pending. Kicks
+        the client if it keeps flooding the server with updates.
+        """
+
+        if self.status_bucket.try_take():
+            return True
+
+        count_metric("status_updates_throttled")
+        now: float = time.monotonic()
+        if now - self.__flood_window_start >= FLOOD_WINDOW_SECONDS:
+            self.__flood_window_start = now
+            self.__flood_window_count = 0
+        self.__flood_window_count += 1
+        if (
+            self.__flood_window_count
+            > ConfigData.conf_dict["status_flood_kick_limit"]
+        ):
+            logging.warning(
+                "Kicking client '%s' for flooding the server with status "
+                "updates",
+                self.client_name_or_unknown(),
+            )
+            self.kick_client("rate_limit")
+            return False
+
+        if not self.__flush_scheduled:
+            self.__schedule_flush()
+        return False
+
+    def __schedule_flush(self) -> None:
+        """
+        Runs flush_pending_updates once the next token is available.
+        """
+
+        self.__flush_scheduled = True
+        self.start_flush_timer(self.status_bucket.seconds_until_token())
+
+    def flush_pending_updates(self) -> None:
+        """
+        Passes on status updates that were held back by the rate limit, as
+        far as the bucket allows.
+        """
+
+        self.__flush_scheduled = False
+        if self.__pending_sdwdate_status is not None:
+            if not self.status_bucket.try_take():
+                self.__schedule_flush()
+                return
+            sdwdate_status: SdwdateStatus
+            sdwdate_msg_str: str
+            trace: ServerTrace | None
+            sdwdate_status, sdwdate_msg_str, trace = (
+                self.__pending_sdwdate_status
+            )
+            self.__pending_sdwdate_status = None
+            self.pass_on_sdwdate_status(sdwdate_status, sdwdate_msg_str, trace)
+        if self.__pending_tor_status is not None:
+            if not self.status_bucket.try_take():
+                self.__schedule_flush()
+                return
+            tor_status: TorStatus = self.__pending_tor_status
+            self.__pending_tor_status = None
+            self.pass_on_tor_status(tor_status)
+
+    def discard_pending_updates(self) -> None:
+        """
+        Drops held back status updates of a disconnected client.
+        """
+
+        self.__pending_sdwdate_status = None
+        self.__pending_tor_status = None
+        if self.__flush_scheduled:
+            self.__flush_scheduled = False
+            self.stop_flush_timer()
+
+    ## PARSING
+    def __parse_qubes_data(self) -> bool:
+        """
+        Gets the client name from the qrexec connection header if possible.
+        """
+
+        qrexec_header_bytes: bytes | None = None
+        for idx, byte in enumerate(self.__sock_buf):
+            if byte == 0:
+                qrexec_header_bytes = self.__sock_buf[:idx]
+                self.__sock_buf = self.__sock_buf[idx + 1 :]
+                break
+
+        if qrexec_header_bytes is None:
+            if len(self.__sock_buf) > 4096:
+                logging.warning(
+                    "Kicking client '%s' for sending too much data in qrexec "
+                    "header",
+                    self.client_name_or_unknown(),
+                )
+                self.kick_client("qrexec_header_too_long")
+            return False
+
+        if not check_bytes_printable(qrexec_header_bytes):
+            logging.warning(
+                "Kicking client '%s' for sending invalid bytes in qrexec "
+                "header",
+                self.client_name_or_unknown(),
+            )
+            self.kick_client("qrexec_header_invalid")
+            return False
+
+        self.qubes_header_parsed = True
+
+        qrexec_header: str = qrexec_header_bytes.decode("ascii")
+        qrexec_header_parts = qrexec_header.split(" ")
+        if len(qrexec_header_parts) < 2:
+            return True
+
+        ## Don't set the client name directly in this function,
+        ## __set_client_name is designed to handle the qrexec case too.
+        header_name: str = qrexec_header_parts[1]
+        self.__set_client_name(header_name)
+
+        return True
+
+    # pylint: disable=too-many-return-statements,too-many-branches
+    def __try_parse_commands(self) -> None:
+        """
+        Tries to run any commands in the buffer.
+        """
+
+        ## A command may get the client kicked, e.g. for a duplicate name,
+        ## after which the rest of the buffer is of no interest.
+        while len(self.__sock_buf) >= 2 and not self.closed:
+            function_name: str | None
+            msg_parts: list[str] | None
+            try:
+                preproc_sock_buf_len: int = len(self.__sock_buf)
+                self.__sock_buf, function_name, msg_parts = parse_ipc_command(
+                    self.__sock_buf
+                )
+                postproc_sock_buf_len: int = len(self.__sock_buf)
+                if preproc_sock_buf_len == postproc_sock_buf_len:
+                    ## If the buffer didn't shrink, that means that we've only
+                    ## received part of a message. Break so that we can receive
+                    ## the rest of it later on.
+                    break
+                if function_name is None:
+                    continue
+                assert function_name is not None
+                assert msg_parts is not None
+                ## Only label known commands, a client must not be able to
+                ## create an unbounded number of metrics.
+                count_metric(
+                    "frames_parsed",
+                    command=(
+                        function_name
+                        if function_name in SERVER_RPC_CALLS
+                        else "unknown"
+                    ),
+                )
+            except ValueError:
+                logging.warning(
+                    "Kicking client '%s' for sending invalid bytes in "
+                    "command buffer",
+                    self.client_name_or_unknown(),
+                )
+                self.kick_client("invalid_frame")
+                return
+
+            match function_name:
+                case "set_client_name":
+                    if len(msg_parts) != 1:
+                        logging.warning(
+                            "Kicking client '%s' for sending incorrect "
+                            "number of arguments for 'set_client_name' "
+                            "call",
+                            self.client_name_or_unknown(),
+                        )
+                        self.kick_client("bad_argument_count")
+                        return
+                    if not self.__set_client_name(msg_parts[0]):
+                        return
+                case "set_sdwdate_status":
+                    if len(msg_parts) not in (2, 3):
+                        logging.warning(
+                            "Kicking client '%s' for sending incorrect "
+                            "number of arguments for 'set_sdwdate_status' "
+                            "call",
+                            self.client_name_or_unknown(),
+                        )
+                        self.kick_client("bad_argument_count")
+                        return
+                    if not self.__set_sdwdate_status(
+                        msg_parts[0],
+                        msg_parts[1],
+                        msg_parts[2] if len(msg_parts) == 3 else None,
+                    ):
+                        return
+                case "set_tor_status":
+                    if len(msg_parts) != 1:
+                        logging.warning(
+                            "Kicking client '%s' for sending incorrect "
+                            "number of arguments for 'set_tor_status' "
+                            "call",
+                            self.client_name_or_unknown(),
+                        )
+                        self.kick_client("bad_argument_count")
+                        return
+                    if not self.__set_tor_status(msg_parts[0]):
+                        return
+                case _:
+                    self.kick_client("unknown_command")
+                    return
+
+    def handle_data(self, new_data: bytes) -> None:
+        """
+        Adds data read from the client to the buffer, parsing and running
+        commands from the data.
+        """
+
+        if self.closed:
+            return
+        count_metric("bytes_received", len(new_data))
+        self.__sock_buf += new_data
+        if TraceData.enabled:
+            self.__received_ns = time.monotonic_ns()
+            self.__received_wall_ns = time.time_ns()
+
+        if not self.qubes_header_parsed:
+            if not self.__parse_qubes_data():
+                return
+
+        self.__try_parse_commands()
+
+    ## CLIENT-TO-SERVER RPC CALLS
+    def __set_client_name(self, client_name: str) -> bool:
+        """
+        RPC call from client to server. Sets the client's name on the
+        server side.
+
+        IMPORTANT: On non-Qubes systems, this data MUST be provided by the
+        client itself, while on Qubes OS, this data MUST be provided by the
+        qrexec subsystem. NOT provided by the client. If a client never
+        sends a client name, the client will never appear in the GUI on
+        non-Qubes systems, while if the client always sends a client name,
+        the server will forcibly disconnect it under Qubes OS.
+        """
+
+        if self.client_name_set:
+            ## Client is attempting to change its name after already providing
+            ## it once, kick it
+            logging.warning(
+                "Kicking client '%s' for attempting to change its name to "
+                "'%s'",
+                self.client_name_or_unknown(),
+                client_name,
+            )
+            self.kick_client("name_change")
+            return False
+
+        if running_in_qubes_os():
+            ## Name rules taken from Qubes OS
+            ## (qubes-core-admin/qubes/vm/__init__.py)
+            if (
+                ## Name must be shorter than 32 characters
+                len(client_name) > MAX_QUBES_NAME_LEN
+                ## Name must consist of alphanumeric characters, numbers,
+                ## underscores, dots, and hyphens, and the first character
+                ## must be an alphabetic character
+                or re.match(r"\A[a-zA-Z][a-zA-Z0-9_.-]*\Z", client_name)
+                is None
+                ## Name cannot be "Domain-0", "none", or "default"
+                or client_name in ("Domain-0", "none", "default")
+                ## Name cannot end in "-dm"
+                or client_name.endswith("-dm")
+            ):
+                logging.warning(
+                    "Kicking client '%s' for attempting to set invalid name "
+                    "'%s'",
+                    self.client_name_or_unknown(),
+                    client_name,
+                )
+                self.kick_client("invalid_name")
+                return False
+        else:
+            ## Less restrictive set of rules for outside of Qubes OS
+            ## Name must be shorter than 256 characters
+            if len(client_name) > MAX_DISPLAY_NAME_LEN:
+                logging.warning(
+                    "Kicking client '%s' for attempting to set invalid name "
+                    "'%s'",
+                    self.client_name_or_unknown(),
+                    client_name,
+                )
+                self.kick_client("invalid_name")
+                return False
+
+        ## It's theoretically possible for a client name to be "unsafe"
+        ## without being malicious (what if the hostname contains Unicode?),
+        ## so fix unsafe names instead of rejecting them.
+        safe_name: str = sanitize_for_richtext(
+            client_name, MAX_DISPLAY_NAME_LEN
+        )
+
+        self.client_name = safe_name
+        self.client_name_set = True
+        self.handshake_pending = False
+        self.pass_on_name(safe_name)
+        return True
+
+    def __set_sdwdate_status(
+        self,
+        sdwdate_status_str: str,
+        sdwdate_msg_str: str,
+        trace_token: str | None,
+    ) -> bool:
+        """
+        RPC call from client to server. Updates the sdwdate status shown by
+        the server. The optional trace token is described in
+        sdwdate_gui_trace.
+        """
+
+        if not self.client_name_set:
+            logging.warning(
+                "Kicking client '%s' for attempting to set sdwdate status "
+                "before setting name",
+                self.client_name_or_unknown(),
+            )
+            self.kick_client("status_before_name")
+            return False
+
+        sdwdate_status: SdwdateStatus
+        match sdwdate_status_str:
+            case "success":
+                sdwdate_status = SdwdateStatus.SUCCESS
+            case "busy":
+                sdwdate_status = SdwdateStatus.BUSY
+            case "error":
+                sdwdate_status = SdwdateStatus.ERROR
+            case _:
+                logging.warning(
+                    "Kicking client '%s' for attempting to set an invalid "
+                    "status of '%s'",
+                    self.client_name_or_unknown(),
+                    sdwdate_status_str,
+                )
+                self.kick_client("invalid_status")
+                return False
+
+        try:
+            sdwdate_msg_str = decode_sdwdate_msg(sdwdate_msg_str)
+        except Exception as e:
+            logging.warning(
+                "Kicking client '%s' for sending invalid or unsafe octal "
+                "escape in sdwdate status message '%s'",
+                self.client_name_or_unknown(),
+                sdwdate_msg_str,
+                exc_info=e,
+            )
+            self.kick_client("invalid_octal_escape")
+            return False
+
+        trace: ServerTrace | None = None
+        if trace_token is not None:
+            try:
+                trace = ServerTrace(
+                    trace_token,
+                    self.__received_wall_ns,
+                    self.__received_ns,
+                )
+            except ValueError:
+                logging.warning(
+                    "Kicking client '%s' for sending an invalid trace token",
+                    self.client_name_or_unknown(),
+                )
+                self.kick_client("invalid_trace")
+                return False
+            if not TraceData.enabled:
+                trace = None
+
+        if not self.__admit_status_update():
+            if self.kick_in_progress:
+                return False
+            if self.__pending_sdwdate_status is not None:
+                count_metric("status_updates_collapsed", kind="sdwdate")
+            self.__pending_sdwdate_status = (
+                sdwdate_status,
+                sdwdate_msg_str,
+                trace,
+            )
+            return True
+
+        ## This update is newer than any held back one.
+        self.__pending_sdwdate_status = None
+        self.pass_on_sdwdate_status(sdwdate_status, sdwdate_msg_str, trace)
+        return True
+
+    def __set_tor_status(self, tor_status_str: str) -> bool:
+        """
+        RPC call from client to server. Updates the sdwdate status shown by
+        the server.
+        """
+
+        if not self.client_name_set:
+            logging.warning(
+                "Kicking client '%s' for attempting to set tor status "
+                "before setting name",
+                self.client_name_or_unknown(),
+            )
+            self.kick_client("status_before_name")
+            return False
+
+        tor_status: TorStatus
+        match tor_status_str:
+            case "running":
+                tor_status = TorStatus.RUNNING
+            case "stopped":
+                tor_status = TorStatus.STOPPED
+            case "disabled":
+                tor_status = TorStatus.DISABLED
+            case "disabled_running":
+                tor_status = TorStatus.DISABLED_RUNNING
+            case "absent":
+                tor_status = TorStatus.ABSENT
+            case _:
+                logging.warning(
+                    "Kicking client '%s' for attempting to set an invalid "
+                    "Tor status of '%s'",
+                    self.client_name_or_unknown(),
+                    tor_status_str,
+                )
+                self.kick_client("invalid_status")
+                return False
+
+        if not self.__admit_status_update():
+            if self.kick_in_progress:
+                return False
+            if self.__pending_tor_status is not None:
+                count_metric("status_updates_collapsed", kind="tor")
+            self.__pending_tor_status = tor_status
+            return True
+
+        ## This update is newer than any held back one.
+        self.__pending_tor_status = None
+        self.pass_on_tor_status(tor_status)
+        return True
+
+    ## SERVER-TO-CLIENT RPC CALLS
+    def call_rpc(self, function_name: str) -> None:
+        """
+        Sends an RPC call from the server to the client, following the wire
+        format documented for this class. The server-to-client RPC calls
+        take no arguments.
+        """
+
+        if self.closed:
+            return
+        msg_bytes: bytes = function_name.encode("ascii")
+        msg_len: int = len(msg_bytes)
+        self.write_data(
+            msg_len.to_bytes(2, byteorder="big", signed=False) + msg_bytes
+        )
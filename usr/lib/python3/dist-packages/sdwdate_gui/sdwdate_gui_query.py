@@ -0,0 +1,135 @@
+#!/usr/bin/python3 -su
+
+## Copyright (C) 2026 - 2026 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
+## See the file COPYING for copying conditions.
+
+"""
+The query socket lets monitoring tools read the state of all clients from a
+running sdwdate_gui_server, whether it shows the tray icon or runs headless,
+instead of scraping the tray. It listens next to the server socket and is
+only accessible to the owning user.
+
+A query client sends a single request line:
+- snapshot: the server answers with a snapshot message and closes the
+  connection.
+- subscribe: the server answers with a snapshot message, followed by an
+  update message whenever a client changes and a remove message whenever a
+  client is gone, until the query client disconnects. A subscriber that
+  does not keep up with reading is disconnected.
+
+Every message is a single line of JSON:
+- {"type": "snapshot", "clients": [<client>, ...]}
+- {"type": "update", "client": <client>}
+- {"type": "remove", "name": <name>}
+
+where <client> is an object with these keys:
+- name
+- sdwdate_status: SdwdateStatus name
+- sdwdate_msg: the last sdwdate status message, or null
+- tor_status: TorStatus name
+- last_update: Unix time of the last status change, or null
+- connection_age: seconds since the client connected, or null if the client
+  is only known from the state snapshot of a previous server instance
+"""
+
+import json
+import time
+
+from typing import Any
+
+from .sdwdate_gui_protocol import (
+    SdwdateStatus,
+    TorStatus,
+)
+
+QUERY_SOCKET_NAME: str = "sdwdate-gui-query.socket"
+
+## Limits for query clients. A request line longer than
+## QUERY_REQUEST_MAX_LEN or not sent within QUERY_REQUEST_TIMEOUT_MS gets the
+## query client disconnected, as does more than MAX_SUBSCRIBER_BACKLOG bytes
+## of messages it did not read yet. At most MAX_QUERY_CONNECTIONS query
+## clients are served at once.
+QUERY_REQUEST_MAX_LEN: int = 64
+QUERY_REQUEST_TIMEOUT_MS: int = 5000
+MAX_SUBSCRIBER_BACKLOG: int = 1048576
+MAX_QUERY_CONNECTIONS: int = 16
+
+## Requests a query client may send.
+QUERY_REQUESTS: tuple[str, ...] = (
+    "snapshot",
+    "subscribe",
+)
+
+
+def parse_query_request(request_line: bytes) -> str | None:
+    """
+    Returns the request sent by a query client, or None if it is not a
+    valid request.
+    """
+
+    if not request_line.endswith(b"\n"):
+        return None
+    request: str = request_line.rstrip(b"\r\n").decode("ascii", "replace")
+    if request not in QUERY_REQUESTS:
+        return None
+    return request
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def client_entry(
+    name: str,
+    sdwdate_status: SdwdateStatus,
+    sdwdate_msg: str | None,
+    tor_status: TorStatus,
+    last_update: float | None,
+    connected_at: float | None,
+) -> dict[str, Any]:
+    """
+    Returns the description of a client sent to query clients.
+    `last_update` is a Unix time, `connected_at` a time.monotonic() time.
+    """
+
+    return {
+        "name": name,
+        "sdwdate_status": sdwdate_status.name,
+        "sdwdate_msg": sdwdate_msg,
+        "tor_status": tor_status.name,
+        "last_update": last_update,
+        "connection_age": (
+            None
+            if connected_at is None
+            else round(time.monotonic() - connected_at, 3)
+        ),
+    }
+
+
+def encode_query_message(message: dict[str, Any]) -> bytes:
+    """
+    Encodes a message for sending to a query client.
+    """
+
+    return json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def snapshot_message(entries: list[dict[str, Any]]) -> bytes:
+    """
+    Returns a snapshot message describing the clients in `entries`.
+    """
+
+    return encode_query_message({"type": "snapshot", "clients": entries})
+
+
+def update_message(entry: dict[str, Any]) -> bytes:
+    """
+    Returns an update message for a client that changed.
+    """
+
+    return encode_query_message({"type": "update", "client": entry})
+
+
+def remove_message(name: str) -> bytes:
+    """
+    Returns a remove message for a client that is gone.
+    """
+
+    return encode_query_message({"type": "remove", "name": name})
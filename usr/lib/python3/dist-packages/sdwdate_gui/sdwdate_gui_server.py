@@ -15,23 +15,35 @@ component and runs tasks at the server component's request.
 import os
 import sys
 import signal
-import re
+import atexit
 import functools
+import hashlib
+import json
 import logging
+import math
+import time
 
+from abc import ABCMeta
+from collections import OrderedDict, deque
 from enum import Enum
-from typing import NoReturn, Pattern, Callable
+from typing import NoReturn, Callable, Iterator, Any
 from types import FrameType
 from pathlib import Path
 
+from PyQt5 import sip
 from PyQt5.QtCore import (
     pyqtSignal,
+    pyqtSlot,
     Qt,
     QObject,
     QTimer,
+    QThread,
+    QMetaObject,
+    QFileSystemWatcher,
 )
 from PyQt5.QtGui import (
     QIcon,
+    QPixmap,
     QCursor,
 )
 from PyQt5.QtWidgets import (
@@ -50,66 +62,289 @@ from PyQt5.QtNetwork import (
     QLocalServer,
 )
 
-from sanitize_string.sanitize_string_lib import sanitize_string
-
+from .sdwdate_gui_metrics import (
+    count_metric,
+    observe_metric,
+    timed_metric,
+    format_metrics,
+)
+from .sdwdate_gui_profiling import (
+    setup_profiling,
+    register_profiled_thread,
+    start_thread_profiling,
+    stop_thread_profiling,
+)
+from .sdwdate_gui_trace import (
+    ServerTrace,
+    setup_tracing,
+)
 from .sdwdate_gui_shared import (
     ConfigData,
     MAX_MSG_SIZE,
-    check_bytes_printable,
-    parse_ipc_command,
+    CONFIG_RELOAD_DELAY_MS,
     parse_config_files,
+    reload_config_files,
+)
+from .sdwdate_gui_protocol import (
+    MAX_DISPLAY_NAME_LEN,
+    HANDSHAKE_TIMEOUT_MS,
+    WAITING_READ_BUFFER_SIZE,
+    SdwdateStatus,
+    TorStatus,
+    SdwdateGuiProtocol,
+    sanitize_for_richtext,
+    running_in_qubes_os,
+    claim_server_socket,
+    bind_server_socket,
+)
+from .sdwdate_gui_query import (
+    QUERY_SOCKET_NAME,
+    QUERY_REQUEST_MAX_LEN,
+    QUERY_REQUEST_TIMEOUT_MS,
+    MAX_SUBSCRIBER_BACKLOG,
+    MAX_QUERY_CONNECTIONS,
+    parse_query_request,
+    client_entry,
+    snapshot_message,
+    update_message,
+    remove_message,
+)
+from .sdwdate_gui_textfile import (
+    METRICS_TEXTFILE_INTERVAL_MS,
+    MetricsTextfile,
 )
 
 
-## Reasonable maximum lengths for untrusted strings shown in the GUI. A VM
-## name under Qubes OS is at most 31 characters; the non-Qubes self-reported
-## name is capped at 255. sdwdate messages are already limited to 4096 bytes,
-## but that is far more than is useful in a status window.
-MAX_QUBES_NAME_LEN: int = 31
-MAX_DISPLAY_NAME_LEN: int = 255
+## Reasonable maximum lengths for sdwdate messages shown in the GUI, see
+## sdwdate_gui_protocol for client names. sdwdate messages are already
+## limited to 4096 bytes, but that is far more than is useful in a status
+## window.
 MAX_DISPLAY_MSG_LEN: int = 2048
+MAX_HISTORY_MSG_LEN: int = 80
+
+## Number of sdwdate messages no client currently reports that are kept in
+## the message store, see MessageStore.
+MESSAGE_STORE_MAX_IDLE: int = 256
+
+## Expired handshakes are swept in batches at this interval, so a client may
+## be kicked up to this much later than HANDSHAKE_TIMEOUT_MS.
+HANDSHAKE_SWEEP_INTERVAL_MS: int = 1000
+
+## The last known state of all clients is saved to a snapshot file, so that
+## a restarted server can show it right away instead of waiting for every
+## client to reconnect. Writes are batched, at most one per
+## STATE_SNAPSHOT_DELAY_MS. Restored states are marked as stale until their
+## client reconnects, and dropped if it does not do so within
+## STALE_STATE_TIMEOUT_SECONDS of when they were last confirmed. See
+## SdwdateTrayIcon.restore_state_snapshot.
+STATE_SNAPSHOT_VERSION: int = 1
+STATE_SNAPSHOT_DELAY_MS: int = 2000
+STALE_STATE_TIMEOUT_SECONDS: float = 300.0
+
+## File names of the icons in /usr/share/sdwdate-gui/icons/. The status
+## icons are indexed by TorStatus and SdwdateStatus values.
+TOR_ICON_FILES: tuple[str, ...] = (
+    "tor-ok.png",
+    "error.png",
+    "error.png",
+    "tor-warning.png",
+)
+SDWDATE_ICON_FILES: tuple[str, ...] = (
+    "sdwdate-success.png",
+    "sdwdate-wait.png",
+    "sdwdate-stopped.png",
+)
+ERROR_ICON: str = "error.png"
+ADVANCED_SETTINGS_ICON: str = "advancedsettings.ico"
+SDWDATE_LOG_ICON: str = "sdwdate-log.png"
+RESTART_SDWDATE_ICON: str = "restart-sdwdate.png"
+STOP_SDWDATE_ICON: str = "stop-sdwdate.png"
+APPLICATION_EXIT_ICON: str = "application-exit.png"
+
+
+class StoredMessage:
+    """
+    An sdwdate status message held by MessageStore, along with its sanitized
+    renderings, which are computed once on first use.
+    """
+
+    __slots__ = ("digest", "text", "ref_count", "__display", "__history")
+
+    def __init__(self, digest: bytes, text: str) -> None:
+        """
+        Wraps a decoded, but not yet sanitized, sdwdate message.
+        """
+
+        self.digest: bytes = digest
+        self.text: str = text
+        self.ref_count: int = 0
+        self.__display: str | None = None
+        self.__history: str | None = None
+
+    def display_text(self) -> str:
+        """
+        Returns the message sanitized and truncated for status windows.
+        """
+
+        if self.__display is None:
+            self.__display = sanitize_for_richtext(
+                self.text, MAX_DISPLAY_MSG_LEN
+            )
+        return self.__display
+
+    def history_text(self) -> str:
+        """
+        Returns the message sanitized and truncated to a single line for the
+        status history window.
+        """
 
-## Bound how many clients may be connected at once, and how long a client may
-## stay connected without completing its handshake (providing a name), so a
-## misbehaving or hostile client cannot exhaust memory or file descriptors
-## with a flood of connections or idle half-open ones. The limit is far above
-## any realistic number of VMs for desktop use.
-MAX_CLIENTS: int = 64
-HANDSHAKE_TIMEOUT_MS: int = 30000
+        if self.__history is None:
+            self.__history = sanitize_for_richtext(
+                self.text.replace("\n", " "), MAX_HISTORY_MSG_LEN
+            )
+        return self.__history
 
 
-def sanitize_for_richtext(untrusted: str, max_length: int) -> str:
+class MessageStore:
     """
-    Remove Unicode and HTML from an untrusted string and truncate it to a
-    maximum length.
+    Content-addressed store of sdwdate status messages. Clients reporting
+    the same message share one StoredMessage, and with it one copy of the
+    text and of its sanitized renderings.
+
+    Clients hold a reference to their current message through acquire and
+    release. Messages nobody holds a reference to are kept in an LRU list of
+    at most `max_idle` entries, so a message that comes back, e.g. a client
+    flapping between two states, does not have to be sanitized again.
+    Status history entries keep their message alive without holding a
+    reference, so a message evicted from the store stays valid for them.
     """
 
-    return sanitize_string(untrusted)[:max_length]
+    def __init__(self, max_idle: int) -> None:
+        """
+        Initializes an empty store.
+        """
+
+        self.max_idle: int = max_idle
+        self.__messages: dict[bytes, StoredMessage] = {}
+        ## Messages with a reference count of zero, least recently used
+        ## first.
+        self.__idle: OrderedDict[bytes, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__messages)
+
+    def acquire(self, text: str) -> StoredMessage:
+        """
+        Returns the stored message for `text`, adding it if necessary, and
+        takes a reference to it.
+        """
+
+        digest: bytes = hashlib.blake2b(
+            text.encode("utf-8", errors="surrogatepass"),
+            digest_size=16,
+        ).digest()
+        message: StoredMessage | None = self.__messages.get(digest)
+        if message is None:
+            message = StoredMessage(digest, text)
+            self.__messages[digest] = message
+            count_metric("message_store_misses")
+        else:
+            count_metric("message_store_hits")
+        if message.ref_count == 0:
+            self.__idle.pop(digest, None)
+        message.ref_count += 1
+        return message
+
+    def release(self, message: StoredMessage) -> None:
+        """
+        Drops a reference taken with acquire.
+        """
+
+        assert message.ref_count > 0
+        message.ref_count -= 1
+        if message.ref_count != 0:
+            return
+        if self.__messages.get(message.digest) is not message:
+            return
+        self.__idle[message.digest] = None
+        while len(self.__idle) > self.max_idle:
+            evicted_digest: bytes
+            evicted_digest, _ = self.__idle.popitem(last=False)
+            del self.__messages[evicted_digest]
+            count_metric("message_store_evictions")
 
 
-class SdwdateStatus(Enum):
+class IconCache:
     """
-    Status of the sdwdate process running on a client system.
+    Icons used by the server. Each icon is only loaded from `icon_dir` when
+    it is first used, so that starting the server does not have to wait for
+    all of them. Pixmaps rendered from the icons are memoized per icon, size
+    and device pixel ratio.
     """
 
-    SUCCESS = 0
-    BUSY = 1
-    ERROR = 2
-    UNKNOWN = 0xFF
+    def __init__(self, icon_dir: Path) -> None:
+        """
+        Initializes an empty cache. Does not need a QApplication yet.
+        """
+
+        self.icon_dir: Path = icon_dir
+        self.__icons: dict[str, QIcon] = {}
+        self.__pixmaps: dict[tuple[str, int, float], QPixmap] = {}
+
+    def icon(self, icon_name: str) -> QIcon:
+        """
+        Returns the icon with the file name `icon_name`, loading it if
+        necessary.
+        """
+
+        icon: QIcon | None = self.__icons.get(icon_name)
+        if icon is None:
+            icon = QIcon(str(self.icon_dir.joinpath(icon_name)))
+            self.__icons[icon_name] = icon
+        return icon
+
+    def pixmap(
+        self,
+        icon_name: str,
+        size: int,
+        device_pixel_ratio: float,
+    ) -> QPixmap:
+        """
+        Returns the icon with the file name `icon_name` rendered as a
+        `size` x `size` pixmap for a screen with the given device pixel
+        ratio.
+        """
+
+        pixmap_key: tuple[str, int, float] = (
+            icon_name,
+            size,
+            device_pixel_ratio,
+        )
+        pixmap: QPixmap | None = self.__pixmaps.get(pixmap_key)
+        if pixmap is None:
+            device_size: int = round(size * device_pixel_ratio)
+            pixmap = self.icon(icon_name).pixmap(device_size, device_size)
+            pixmap.setDevicePixelRatio(device_pixel_ratio)
+            self.__pixmaps[pixmap_key] = pixmap
+        return pixmap
 
 
-class TorStatus(Enum):
+# pylint: disable=too-few-public-methods
+class GlobalData:
     """
-    Status of the Tor process running on a client system, if Tor is present on
-    the client.
+    Global data for sdwdate_gui_server.
     """
 
-    RUNNING = 0
-    STOPPED = 1
-    DISABLED = 2
-    DISABLED_RUNNING = 3
-    ABSENT = 0xFE
-    UNKNOWN = 0xFF
+    uid_str: str = str(os.getuid())
+    sdwdate_run_dir: Path = Path(f"/run/user/{uid_str}/sdwdate-gui")
+    server_socket_path: Path = sdwdate_run_dir.joinpath(
+        "sdwdate-gui-server.socket",
+    )
+    server_pid_path: Path = sdwdate_run_dir.joinpath("server_pid")
+    state_snapshot_path: Path = sdwdate_run_dir.joinpath("state_snapshot.json")
+    query_socket_path: Path = sdwdate_run_dir.joinpath(QUERY_SOCKET_NAME)
+    message_store: MessageStore = MessageStore(MESSAGE_STORE_MAX_IDLE)
+    icon_cache: IconCache = IconCache(Path("/usr/share/sdwdate-gui/icons"))
 
 
 class MessageType(Enum):
@@ -121,500 +356,437 @@ class MessageType(Enum):
     SDWDATE = 0
     TOR = 1
     DISCONNECTED = 2
+    HISTORY = 3
 
 
-def running_in_qubes_os() -> bool:
+# pylint: disable=too-few-public-methods
+class StatusHistoryEntry:
     """
-    Detects if the server is running on Qubes OS. The behavior when getting
-    the client's name has to be somewhat different on Qubes OS, so we need to
-    adjust for that use case.
+    A single recorded status change of a client. Slotted, since a client can
+    keep many of these around. The message points into the message store, so
+    repeatedly reported messages are only kept once.
     """
 
-    if Path("/usr/share/qubes/marker-vm").is_file():
-        return True
+    __slots__ = ("timestamp", "status", "message")
+
+    def __init__(
+        self,
+        status: SdwdateStatus | TorStatus,
+        message: StoredMessage | None,
+    ) -> None:
+        """
+        Records a status change that happened just now.
+        """
 
-    return False
+        self.timestamp: float = time.monotonic()
+        self.status: SdwdateStatus | TorStatus = status
+        self.message: StoredMessage | None = message
 
 
-# pylint: disable=too-many-instance-attributes
-class SdwdateGuiClient(QObject):
+class SdwdateGuiConnectionMeta(sip.wrappertype, ABCMeta):
     """
-    An object representing a sdwdate-gui client. Each client object acts as a
-    two-way RPC channel, allowing the server to call certain functions in the
-    client and vice versa.
-
-    Each message is sent as a length-prefixed packet. Each length prefix is a
-    two-byte, big-endian integer specifying the number of bytes in the
-    message. The messages then consist of a string, with space-separated
-    words. The first word is the name of the function being called, subsequent
-    strings are arguments. Functions do not "return" any values.
-
-    The following functions are provided by the server and can be called by
-    the client:
-    - set_client_name <name>
-    - set_sdwdate_status [success|busy|error] [message]
-    - set_tor_status [running|stopped|disabled|disabled_running|absent]
-
-    The following functions are provided by the client and can be called by
-    the server:
-    - open_tor_control_panel
-    - open_sdwdate_log
-    - restart_sdwdate
-    - stop_sdwdate
-    - suppress_client_reconnect
+    Metaclass of SdwdateGuiConnection, which is both a QObject and a
+    SdwdateGuiProtocol, whose metaclasses Python cannot combine by itself.
     """
 
-    clientDisconnected: pyqtSignal = pyqtSignal()
-    clientNameChanged: pyqtSignal = pyqtSignal()
-    sdwdateStatusChanged: pyqtSignal = pyqtSignal()
-    torStatusChanged: pyqtSignal = pyqtSignal()
+
+# pylint: disable=too-many-ancestors
+class SdwdateGuiConnection(
+    SdwdateGuiProtocol, QObject, metaclass=SdwdateGuiConnectionMeta
+):
+    """
+    The I/O side of a sdwdate-gui client. Lives in the server's I/O thread
+    (see SdwdateGuiListener) and owns the client's socket. Framing and
+    validation are done by SdwdateGuiProtocol, the resulting state changes
+    are passed on to the client's SdwdateGuiClient in the GUI thread through
+    queued signals. A client flooding the server with data therefore costs
+    I/O thread time, but never delays the GUI.
+    """
+
+    nameReceived: pyqtSignal = pyqtSignal(str)
+    sdwdateStatusReceived: pyqtSignal = pyqtSignal(object, str, object)
+    torStatusReceived: pyqtSignal = pyqtSignal(object)
+    connectionClosed: pyqtSignal = pyqtSignal()
 
     def __init__(
         self, client_socket: QLocalSocket, parent: QObject | None = None
     ) -> None:
         """
-        Creates a new SdwdateGuiClient object from a socket.
+        Creates a new SdwdateGuiConnection object from a socket. Nothing is
+        read from the socket, and the client disconnecting is not acted on,
+        before start_reading() is called.
         """
+
+        ## SdwdateGuiProtocol comes first in the bases, so that QObject's
+        ## cooperative __init__ does not run it a second time.
         QObject.__init__(self, parent)
+        SdwdateGuiProtocol.__init__(self)
         self.client_socket: QLocalSocket = client_socket
         self.client_socket.setParent(self)
-        self.client_name: str | None = None
-        self.client_name_set: bool = False
-        self.sdwdate_status: SdwdateStatus = SdwdateStatus.UNKNOWN
-        self.sdwdate_msg: str | None = None
-        self.tor_status: TorStatus = TorStatus.UNKNOWN
-        self.qubes_header_parsed: bool = False
-        self.present_in_menu: bool = False
-        self.kick_in_progress: bool = False
+        self.client_socket.disconnected.connect(self.__handle_disconnected)
+        self.__reading: bool = False
+        self.__flush_timer: QTimer = QTimer(self)
+        self.__flush_timer.setSingleShot(True)
+        self.__flush_timer.timeout.connect(self.flush_pending_updates)
+        ## When the listener took the connection from QLocalServer, for the
+        ## accept latency metric.
+        self.accepted_at: float = time.monotonic()
 
-        self.__sock_buf: bytes = b""
+    @pyqtSlot()
+    def start_reading(self) -> None:
+        """
+        Starts processing data from the client, once the GUI side is ready
+        to receive the resulting state changes. Data the client sent earlier
+        is waiting in the socket's buffer.
+        """
 
+        if self.closed:
+            return
+        self.__reading = True
         self.client_socket.readyRead.connect(self.__handle_incoming_data)
-        self.client_socket.disconnected.connect(self.clientDisconnected.emit)
+        if self.client_socket.bytesAvailable() > 0:
+            self.__handle_incoming_data()
+        if self.client_socket.state() != QLocalSocket.ConnectedState:
+            self.connection_lost()
 
-        ## Kick a client that connects but never completes its handshake by
-        ## providing a name, so half-open / idle connections cannot
-        ## accumulate. The timer is stopped as soon as the name is set.
-        self.handshake_timer: QTimer = QTimer(self)
-        self.handshake_timer.setSingleShot(True)
-        self.handshake_timer.timeout.connect(self.__handshake_timeout)
-        self.clientNameChanged.connect(self.handshake_timer.stop)
-        self.handshake_timer.start(HANDSHAKE_TIMEOUT_MS)
+    def __handle_disconnected(self) -> None:
+        """
+        Tears down the connection once the client disconnected. Before
+        start_reading(), the GUI side may not be listening for
+        connectionClosed yet, so start_reading() checks for a client that
+        is already gone instead.
+        """
 
-    def __handshake_timeout(self) -> None:
+        if self.__reading:
+            self.connection_lost()
+
+    def __handle_incoming_data(self) -> None:
         """
-        Kick a still-connected client that never set its name in time.
+        Reads incoming data from the client and hands it to the protocol.
         """
 
-        if self.client_name_set:
-            return
-        if self.client_socket.state() != QLocalSocket.ConnectedState:
-            return
-        logging.warning(
-            "Kicking client '%s' for not completing its handshake in time",
-            self.client_name_or_unknown(),
-        )
-        self.kick_client()
+        ## mypy doesn't seem to know that QByteArray.data() returns a
+        ## "bytes" value
+        new_data: bytes = self.client_socket.readAll().data()  # type: ignore
+        self.handle_data(new_data)
 
-    def client_name_or_unknown(self) -> str:
+    @pyqtSlot(str)
+    def kick_client(self, reason: str) -> None:
         """
-        Returns the client name if set, otherwise returns "Unknown".
+        Forcibly disconnects the client, see SdwdateGuiProtocol.kick_client.
+        Invoked from the GUI thread as well.
         """
 
-        if self.client_name is not None:
-            return self.client_name
+        SdwdateGuiProtocol.kick_client(self, reason)
 
-        return "Unknown"
+    @pyqtSlot(str)
+    def call_rpc(self, function_name: str) -> None:
+        """
+        Sends an RPC call to the client, see SdwdateGuiProtocol.call_rpc.
+        Invoked from the GUI thread as well.
+        """
+
+        SdwdateGuiProtocol.call_rpc(self, function_name)
 
-    def kick_client(self) -> None:
+    ## SdwdateGuiProtocol I/O
+    def write_data(self, data: bytes) -> None:
         """
-        Forcibly disconnects the client from the server. Used when a client
-        sends invalid data to the server as a security measure.
+        Writes data to the client's socket.
         """
 
-        ## Guard against re-entrancy. On Qubes OS this calls
-        ## suppress_client_reconnect(), which sends an RPC; if that send hits
-        ## a write error, __generic_rpc_call() calls kick_client() again,
-        ## which would recurse indefinitely.
-        if self.kick_in_progress:
-            return
-        self.kick_in_progress = True
+        remaining: int = len(data)
+        while remaining > 0:
+            if self.client_socket.state() != QLocalSocket.ConnectedState:
+                return
+            bytes_written: int = self.client_socket.write(
+                data[len(data) - remaining :]
+            )
+            if bytes_written < 0:
+                ## write() returns -1 on error. 0 is a theoretically possible
+                ## return value depending on how Qt (both current and future
+                ## versions) implements write() internally, so do not bail out
+                ## when 0 is returned. This has a chance of causing us to
+                ## busy-wait, but that shouldn't happen unless there is a bug
+                ## in Qt or PyQt.
+                self.kick_client("write_error")
+                return
+            remaining -= bytes_written
 
-        if running_in_qubes_os():
-            ## Under Qubes OS, the client will automatically reconnect if the
-            ## server disconnects it. Suggest to the client that it not do
-            ## that. Assuming the cause of client misbehavior is simply a bug,
-            ## this should help prevent endless reconnect loops. Note that the
-            ## client may disregard this; we cannot assume the client won't
-            ## try to reconnect after receiving this.
-            self.suppress_client_reconnect()
-
-        ## Disconnect the "disconnected" signal from the
-        ## "clientDisconnected.emit" function, so that we don't end up
-        ## triggering clientDisconnected twice. The similar naming of the
+    def close_connection(self) -> None:
+        """
+        Disconnects the client's socket.
+        """
+
+        ## Disconnect the "disconnected" signal from __handle_disconnected, so
+        ## that we do not end up closing twice. The similar naming of the
         ## "disconnected" signal and "disconnect" method is a coincidence, the
         ## "disconnect" method has nothing to do with disconnecting a socket
         ## connection.
         self.client_socket.disconnected.disconnect()
-
         self.client_socket.disconnectFromServer()
-        self.clientDisconnected.emit()
 
-    ## SOCKET MANAGEMENT
-    def __parse_qubes_data(self) -> bool:
+    def start_flush_timer(self, delay: float) -> None:
         """
-        Gets the client name from the qrexec connection header if possible.
+        Schedules flush_pending_updates.
         """
 
-        qrexec_header_bytes: bytes | None = None
-        for idx, byte in enumerate(self.__sock_buf):
-            if byte == 0:
-                qrexec_header_bytes = self.__sock_buf[:idx]
-                self.__sock_buf = self.__sock_buf[idx + 1 :]
-                break
+        self.__flush_timer.start(max(1, math.ceil(delay * 1000)))
 
-        if qrexec_header_bytes is None:
-            if len(self.__sock_buf) > 4096:
-                logging.warning(
-                    "Kicking client '%s' for sending too much data in qrexec "
-                    "header",
-                    self.client_name_or_unknown(),
-                )
-                self.kick_client()
-            return False
+    def stop_flush_timer(self) -> None:
+        """
+        Cancels the scheduled flush_pending_updates.
+        """
 
-        if not check_bytes_printable(qrexec_header_bytes):
-            logging.warning(
-                "Kicking client '%s' for sending invalid bytes in qrexec "
-                "header",
-                self.client_name_or_unknown(),
-            )
-            self.kick_client()
-            return False
+        self.__flush_timer.stop()
 
-        self.qubes_header_parsed = True
+    def pass_on_name(self, client_name: str) -> None:
+        """
+        Passes the client's name on to the GUI thread.
+        """
 
-        qrexec_header: str = qrexec_header_bytes.decode("ascii")
-        qrexec_header_parts = qrexec_header.split(" ")
-        if len(qrexec_header_parts) < 2:
-            return True
+        self.nameReceived.emit(client_name)
 
-        ## Don't set the client name directly in this function,
-        ## __set_client_name is designed to handle the qrexec case too.
-        header_name: str = qrexec_header_parts[1]
-        self.__set_client_name(header_name)
+    def pass_on_sdwdate_status(
+        self,
+        sdwdate_status: SdwdateStatus,
+        sdwdate_msg_str: str,
+        trace: ServerTrace | None,
+    ) -> None:
+        """
+        Passes an sdwdate status update on to the GUI thread.
+        """
 
-        return True
+        self.sdwdateStatusReceived.emit(sdwdate_status, sdwdate_msg_str, trace)
 
-    # pylint: disable=too-many-return-statements
-    def __try_parse_commands(self) -> None:
+    def pass_on_tor_status(self, tor_status: TorStatus) -> None:
         """
-        Tries to run any commands in the buffer.
+        Passes a Tor status update on to the GUI thread.
         """
 
-        while len(self.__sock_buf) >= 2:
-            function_name: str | None
-            msg_parts: list[str] | None
-            try:
-                preproc_sock_buf_len: int = len(self.__sock_buf)
-                self.__sock_buf, function_name, msg_parts = parse_ipc_command(
-                    self.__sock_buf
-                )
-                postproc_sock_buf_len: int = len(self.__sock_buf)
-                if preproc_sock_buf_len == postproc_sock_buf_len:
-                    ## If the buffer didn't shrink, that means that we've only
-                    ## received part of a message. Break so that we can receive
-                    ## the rest of it later on.
-                    break
-                if function_name is None:
-                    continue
-                assert function_name is not None
-                assert msg_parts is not None
-            except ValueError:
-                logging.warning(
-                    "Kicking client '%s' for sending invalid bytes in "
-                    "command buffer",
-                    self.client_name_or_unknown(),
-                )
-                self.kick_client()
-                return
+        self.torStatusReceived.emit(tor_status)
 
-            match function_name:
-                case "set_client_name":
-                    if len(msg_parts) != 1:
-                        logging.warning(
-                            "Kicking client '%s' for sending incorrect "
-                            "number of arguments for 'set_client_name' "
-                            "call",
-                            self.client_name_or_unknown(),
-                        )
-                        self.kick_client()
-                        return
-                    if not self.__set_client_name(msg_parts[0]):
-                        return
-                case "set_sdwdate_status":
-                    if len(msg_parts) != 2:
-                        logging.warning(
-                            "Kicking client '%s' for sending incorrect "
-                            "number of arguments for 'set_sdwdate_status' "
-                            "call",
-                            self.client_name_or_unknown(),
-                        )
-                        self.kick_client()
-                        return
-                    if not self.__set_sdwdate_status(
-                        msg_parts[0], msg_parts[1]
-                    ):
-                        return
-                case "set_tor_status":
-                    if len(msg_parts) != 1:
-                        logging.warning(
-                            "Kicking client '%s' for sending incorrect "
-                            "number of arguments for 'set_tor_status' "
-                            "call",
-                            self.client_name_or_unknown(),
-                        )
-                        self.kick_client()
-                        return
-                    if not self.__set_tor_status(msg_parts[0]):
-                        return
-                case _:
-                    self.kick_client()
-                    return
+    def pass_on_close(self) -> None:
+        """
+        Tells the GUI thread that the client is gone.
+        """
 
-    def __handle_incoming_data(self) -> None:
+        self.connectionClosed.emit()
+        self.deleteLater()
+
+
+# pylint: disable=too-many-instance-attributes
+class SdwdateGuiClient(QObject):
+    """
+    The GUI side of a sdwdate-gui client. Holds the client's state as shown
+    in the GUI, which only changes through the validated updates posted by
+    the client's SdwdateGuiConnection. Server-to-client RPC calls and kicks
+    are posted back to the connection the same way. See
+    SdwdateGuiConnection for the wire format.
+
+    Everything here runs in the GUI thread. A client is considered
+    disconnected as soon as it is kicked, even though the connection only
+    closes the socket once the I/O thread gets to it, so that no further
+    state changes of a kicked client are applied.
+
+    A client without a connection is a stale placeholder for a client's
+    last known state, restored from the state snapshot at startup. It is
+    never connected, and is replaced once the real client reconnects.
+    """
+
+    clientDisconnected: pyqtSignal = pyqtSignal()
+    clientNameChanged: pyqtSignal = pyqtSignal()
+    sdwdateStatusChanged: pyqtSignal = pyqtSignal()
+    torStatusChanged: pyqtSignal = pyqtSignal()
+    rpcRequested: pyqtSignal = pyqtSignal(str)
+    kickRequested: pyqtSignal = pyqtSignal(str)
+    startRequested: pyqtSignal = pyqtSignal()
+
+    def __init__(
+        self,
+        connection: SdwdateGuiConnection | None,
+        parent: QObject | None = None,
+    ) -> None:
         """
-        Reads incoming data from the client into a buffer, parsing and running
-        commands from the data.
+        Creates a new SdwdateGuiClient object for a connection living in the
+        I/O thread, or a stale client if `connection` is None. The connection
+        does not pass on any state changes before start() is called.
         """
+        QObject.__init__(self, parent)
+        self.client_name: str | None = None
+        self.client_name_set: bool = False
+        self.sdwdate_status: SdwdateStatus = SdwdateStatus.UNKNOWN
+        self.sdwdate_msg: StoredMessage | None = None
+        self.tor_status: TorStatus = TorStatus.UNKNOWN
+        self.present_in_menu: bool = False
+        self.connected: bool = connection is not None
+        self.stale: bool = connection is None
+        ## time.monotonic() time the client connected at, and Unix time of
+        ## its last status change, as reported on the query socket.
+        self.connected_at: float | None = (
+            None if connection is None else time.monotonic()
+        )
+        self.last_update: float | None = None
 
-        ## mypy doesn't seem to know that QByteArray.data() returns a
-        ## "bytes" value
-        self.__sock_buf += self.client_socket.readAll().data()  # type: ignore
+        ## Recent status changes, oldest first. SdwdateTrayIcon additionally
+        ## trims these so that all clients together stay within the
+        ## 'status_history_max_entries' budget.
+        self.status_history: deque[StatusHistoryEntry] = deque(
+            maxlen=ConfigData.conf_dict["status_history_depth"]
+        )
 
-        if not self.qubes_header_parsed:
-            if not self.__parse_qubes_data():
-                return
+        ## Trace of the latest sdwdate status update, finished once the tray
+        ## icon reflects it. See sdwdate_gui_trace.
+        self.pending_trace: ServerTrace | None = None
 
-        self.__try_parse_commands()
+        if connection is None:
+            return
+        ## The connection lives in another thread, so these are all queued
+        ## connections.
+        connection.nameReceived.connect(self.handle_name)
+        connection.sdwdateStatusReceived.connect(self.handle_sdwdate_status)
+        connection.torStatusReceived.connect(self.handle_tor_status)
+        connection.connectionClosed.connect(self.handle_connection_closed)
+        self.rpcRequested.connect(connection.call_rpc)
+        self.kickRequested.connect(connection.kick_client)
+        self.startRequested.connect(connection.start_reading)
 
-    ## CLIENT-TO-SERVER RPC CALLS
-    def __set_client_name(self, client_name: str) -> bool:
+    def start(self) -> None:
+        """
+        Lets the connection start passing on state changes, once everything
+        interested in them is connected to this object's signals.
         """
-        RPC call from client to server. Sets the client's name on the
-        server side.
 
-        IMPORTANT: On non-Qubes systems, this data MUST be provided by the
-        client itself, while on Qubes OS, this data MUST be provided by the
-        qrexec subsystem. NOT provided by the client. If a client never
-        sends a client name, the client will never appear in the GUI on
-        non-Qubes systems, while if the client always sends a client name,
-        the server will forcibly disconnect it under Qubes OS.
+        self.startRequested.emit()
+
+    def client_name_or_unknown(self) -> str:
+        """
+        Returns the client name if set, otherwise returns "Unknown".
         """
 
-        if self.client_name_set:
-            ## Client is attempting to change its name after already providing
-            ## it once, kick it
-            logging.warning(
-                "Kicking client '%s' for attempting to change its name to "
-                "'%s'",
-                self.client_name_or_unknown(),
-                client_name,
-            )
-            self.kick_client()
-            return False
+        if self.client_name is not None:
+            return self.client_name
 
-        if running_in_qubes_os():
-            ## Name rules taken from Qubes OS
-            ## (qubes-core-admin/qubes/vm/__init__.py)
-            if (
-                ## Name must be shorter than 32 characters
-                len(client_name) > 31
-                ## Name must consist of alphanumeric characters, numbers, underscores,
-                ## dots, and hyphens, and the first character must be an alphabetic
-                ## character
-                or re.match(r"\A[a-zA-Z][a-zA-Z0-9_.-]*\Z", client_name) is None
-                ## Name cannot be "Domain-0", "none", or "default"
-                or client_name in ("Domain-0", "none", "default")
-                ## Name cannot end in "-dm"
-                or client_name.endswith("-dm")
-            ):
-                logging.warning(
-                    "Kicking client '%s' for attempting to set invalid name '%s'",
-                    self.client_name_or_unknown(),
-                    client_name,
-                )
-                self.kick_client()
-                return False
-        else:
-            ## Less restrictive set of rules for outside of Qubes OS
-            ## Name must be shorter than 256 characters
-            if len(client_name) > 255:
-                logging.warning(
-                    "Kicking client '%s' for attempting to set invalid name '%s'",
-                    self.client_name_or_unknown(),
-                    client_name,
-                )
-                self.kick_client()
-                return False
-
-        ## It's theoretically possible for a client name to be "unsafe"
-        ## without being malicious (what if the hostname contains Unicode?),
-        ## so fix unsafe names instead of rejecting them.
-        safe_name: str = sanitize_for_richtext(
-            client_name, MAX_DISPLAY_NAME_LEN
-        )
+        return "Unknown"
 
-        self.client_name = safe_name
-        self.client_name_set = True
-        self.clientNameChanged.emit()
-        return True
+    def kick_client(self, reason: str) -> None:
+        """
+        Forcibly disconnects the client from the server. `reason` is a short
+        machine-readable tag used for metrics.
+        """
+
+        if not self.connected:
+            return
+        self.connected = False
+        self.kickRequested.emit(reason)
+        self.clientDisconnected.emit()
 
-    @staticmethod
-    def __octal_decode(octal_match: re.Match[str]) -> str:
+    def release_sdwdate_msg(self) -> None:
         """
-        Decodes an octal escape in an sdwdate status string.
+        Drops the client's reference to its current sdwdate message in the
+        message store.
         """
 
-        octal_str: str = octal_match.group().strip("\\")
-        octal_int: int = int(octal_str, 8)
-        if (octal_int < 0x20 or octal_int > 0x7E) and octal_int != 0x0A:
-            raise ValueError(f"Unsafe octal escape '{octal_str}'")
-        real_char: str = chr(octal_int)
-        return real_char
+        if self.sdwdate_msg is not None:
+            GlobalData.message_store.release(self.sdwdate_msg)
+            self.sdwdate_msg = None
 
-    def __set_sdwdate_status(
-        self, sdwdate_status_str: str, sdwdate_msg_str: str
-    ) -> bool:
+    ## STATE CHANGES POSTED BY THE CONNECTION
+    @pyqtSlot(str)
+    def handle_name(self, client_name: str) -> None:
         """
-        RPC call from client to server. Updates the sdwdate status shown by
-        the server.
+        Sets the client's validated and sanitized name.
         """
 
-        if not self.client_name_set:
-            logging.warning(
-                "Kicking client '%s' for attempting to set sdwdate status "
-                "before setting name",
-                self.client_name_or_unknown(),
-            )
-            self.kick_client()
-            return False
+        if not self.connected:
+            return
+        self.client_name = client_name
+        self.client_name_set = True
+        self.clientNameChanged.emit()
 
-        match sdwdate_status_str:
-            case "success":
-                self.sdwdate_status = SdwdateStatus.SUCCESS
-            case "busy":
-                self.sdwdate_status = SdwdateStatus.BUSY
-            case "error":
-                self.sdwdate_status = SdwdateStatus.ERROR
-            case _:
-                logging.warning(
-                    "Kicking client '%s' for attempting to set an invalid "
-                    "status of '%s'",
-                    self.client_name_or_unknown(),
-                    sdwdate_status_str,
-                )
-                self.kick_client()
-                return False
-
-        ## Decode octal escapes. We used to do this by getting a set of all
-        ## escapes, then iterating through them and replacing each one, but
-        ## this could cause non-deterministic behavior and was inefficient.
-        ## Now we offload most of the work to Python's regex engine, which
-        ## processes everything in a single left-to-right pass.
-        decode_re: Pattern[str] = re.compile(r"\\\d{3}")
-        try:
-            sdwdate_msg_str = decode_re.sub(
-                self.__octal_decode, sdwdate_msg_str
-            )
-        except Exception as e:
-            logging.warning(
-                "Kicking client '%s' for sending invalid or unsafe octal "
-                "escape in sdwdate status message '%s'",
-                self.client_name_or_unknown(),
-                sdwdate_msg_str,
-                exc_info=e,
-            )
-            self.kick_client()
-            return False
+    @pyqtSlot(object, str, object)
+    def handle_sdwdate_status(
+        self,
+        sdwdate_status: SdwdateStatus,
+        sdwdate_msg_str: str,
+        trace: ServerTrace | None,
+    ) -> None:
+        """
+        Updates the sdwdate status shown by the server with a validated
+        status update. An update that changes nothing is dropped here, so
+        a client repeating its status costs no redraw.
+        """
 
-        self.sdwdate_msg = sdwdate_msg_str
+        if not self.connected:
+            return
+        if (
+            sdwdate_status == self.sdwdate_status
+            and self.sdwdate_msg is not None
+            and sdwdate_msg_str == self.sdwdate_msg.text
+        ):
+            count_metric("status_updates_suppressed", kind="sdwdate")
+            ## The tray icon already reflects this update.
+            if trace is not None:
+                trace.finish(self.client_name_or_unknown())
+            return
+        self.sdwdate_status = sdwdate_status
+        self.last_update = time.time()
+        if trace is not None:
+            self.pending_trace = trace
+        new_msg: StoredMessage = GlobalData.message_store.acquire(
+            sdwdate_msg_str
+        )
+        self.release_sdwdate_msg()
+        self.sdwdate_msg = new_msg
+        self.status_history.append(
+            StatusHistoryEntry(self.sdwdate_status, self.sdwdate_msg)
+        )
 
         self.sdwdateStatusChanged.emit()
-        return True
 
-    def __set_tor_status(self, tor_status_str: str) -> bool:
+    @pyqtSlot(object)
+    def handle_tor_status(self, tor_status: TorStatus) -> None:
         """
-        RPC call from client to server. Updates the sdwdate status shown by
-        the server.
+        Updates the Tor status shown by the server with a validated status
+        update. An update that changes nothing is dropped here.
         """
 
-        if not self.client_name_set:
-            logging.warning(
-                "Kicking client '%s' for attempting to set tor status "
-                "before setting name",
-                self.client_name_or_unknown(),
-            )
-            self.kick_client()
-            return False
-
-        match tor_status_str:
-            case "running":
-                self.tor_status = TorStatus.RUNNING
-            case "stopped":
-                self.tor_status = TorStatus.STOPPED
-            case "disabled":
-                self.tor_status = TorStatus.DISABLED
-            case "disabled_running":
-                self.tor_status = TorStatus.DISABLED_RUNNING
-            case "absent":
-                self.tor_status = TorStatus.ABSENT
-            case _:
-                logging.warning(
-                    "Kicking client '%s' for attempting to set an invalid "
-                    "Tor status of '%s'",
-                    self.client_name_or_unknown(),
-                    tor_status_str,
-                )
-                self.kick_client()
-                return False
+        if not self.connected:
+            return
+        if tor_status == self.tor_status:
+            count_metric("status_updates_suppressed", kind="tor")
+            return
+        self.tor_status = tor_status
+        self.last_update = time.time()
+        self.status_history.append(StatusHistoryEntry(self.tor_status, None))
 
         self.torStatusChanged.emit()
-        return True
+
+    @pyqtSlot()
+    def handle_connection_closed(self) -> None:
+        """
+        Marks the client as disconnected once its connection closed.
+        """
+
+        if not self.connected:
+            return
+        self.connected = False
+        self.clientDisconnected.emit()
 
     ## SERVER-TO-CLIENT RPC CALLS
-    def __generic_rpc_call(self, msg_bytes: bytes) -> None:
+    def __generic_rpc_call(self, function_name: str) -> None:
         """
-        Sends an RPC call from the server to the client, following the wire
-        format documented for this object.
+        Posts an RPC call from the server to the client to the connection,
+        which sends it.
         """
 
-        msg_len: int = len(msg_bytes)
-        if msg_len > MAX_MSG_SIZE:
+        if len(function_name) + 2 > MAX_MSG_SIZE:
             ## We already reject overly large messages on the receiving end,
             ## try to not send them either.
             logging.critical("Server tried to send an oversized IPC message!")
             sys.exit(1)
-        msg_buf: bytes = (
-            msg_len.to_bytes(2, byteorder="big", signed=False) + msg_bytes
-        )
-        msg_len += 2
-        while msg_len > 0:
-            if self.client_socket.state() != QLocalSocket.ConnectedState:
-                return
-            bytes_written: int = self.client_socket.write(
-                msg_buf[len(msg_buf) - msg_len :]
-            )
-            if bytes_written < 0:
-                ## write() returns -1 on error. 0 is a theoretically possible
-                ## return value depending on how Qt (both current and future
-                ## versions) implements write() internally, so do not bail out
-                ## when 0 is returned. This has a chance of causing us to
-                ## busy-wait, but that shouldn't happen unless there is a bug
-                ## in Qt or PyQt.
-                self.kick_client()
-                return
-            msg_len -= bytes_written
+        if not self.connected:
+            return
+        self.rpcRequested.emit(function_name)
 
     def open_tor_control_panel(self) -> None:
         """
@@ -625,7 +797,7 @@ class SdwdateGuiClient(QObject):
         if self.tor_status in (TorStatus.ABSENT, TorStatus.UNKNOWN):
             return
 
-        self.__generic_rpc_call(b"open_tor_control_panel")
+        self.__generic_rpc_call("open_tor_control_panel")
 
     def open_sdwdate_log(self) -> None:
         """
@@ -633,7 +805,7 @@ class SdwdateGuiClient(QObject):
         sdwdate logs on the client machine.
         """
 
-        self.__generic_rpc_call(b"open_sdwdate_log")
+        self.__generic_rpc_call("open_sdwdate_log")
 
     def restart_sdwdate(self) -> None:
         """
@@ -641,14 +813,14 @@ class SdwdateGuiClient(QObject):
         machine.
         """
 
-        self.__generic_rpc_call(b"restart_sdwdate")
+        self.__generic_rpc_call("restart_sdwdate")
 
     def stop_sdwdate(self) -> None:
         """
         RPC call from server to client. Stops sdwdate on the client machine.
         """
 
-        self.__generic_rpc_call(b"stop_sdwdate")
+        self.__generic_rpc_call("stop_sdwdate")
 
     def suppress_client_reconnect(self) -> None:
         """
@@ -658,20 +830,343 @@ class SdwdateGuiClient(QObject):
         this suggestion.
         """
 
-        self.__generic_rpc_call(b"suppress_client_reconnect")
+        self.__generic_rpc_call("suppress_client_reconnect")
 
 
-# pylint: disable=too-few-public-methods
-class SdwdateGuiFrame(QDialog):
-    """
-    A window displaying sdwdate or tor status based on information provided by
-    a client.
+## Tor states that make a client need attention, regardless of its sdwdate
+## status. A client is healthy if sdwdate succeeded and Tor is in none of
+## these states.
+PROBLEM_TOR_STATUSES: tuple[TorStatus, ...] = (
+    TorStatus.STOPPED,
+    TorStatus.DISABLED,
+    TorStatus.DISABLED_RUNNING,
+)
+PROBLEM_SDWDATE_STATUSES: tuple[SdwdateStatus, ...] = (
+    SdwdateStatus.ERROR,
+    SdwdateStatus.BUSY,
+    SdwdateStatus.UNKNOWN,
+)
+
+
+def client_ready(client: SdwdateGuiClient) -> bool:
+    """
+    Checks if a client has provided enough data to be shown in the menu.
+    """
+
+    return client.client_name is not None and not (
+        client.tor_status == TorStatus.UNKNOWN
+        and client.sdwdate_status == SdwdateStatus.UNKNOWN
+    )
+
+
+def effective_sdwdate_status(client: SdwdateGuiClient) -> SdwdateStatus:
+    """
+    Returns the sdwdate status to display for a client. A client that has
+    not reported its sdwdate status yet is shown as busy.
+    """
+
+    if client.sdwdate_status == SdwdateStatus.UNKNOWN:
+        return SdwdateStatus.BUSY
+    return client.sdwdate_status
+
+
+def client_menu_sort_key(client: SdwdateGuiClient) -> tuple[int, str]:
+    """
+    Orders clients in the menu, the ones most in need of attention first,
+    then alphabetically.
+    """
+
+    severity: int
+    if client.tor_status in (TorStatus.STOPPED, TorStatus.DISABLED):
+        severity = 0
+    elif client.sdwdate_status == SdwdateStatus.ERROR:
+        severity = 1
+    elif client.tor_status == TorStatus.DISABLED_RUNNING:
+        severity = 2
+    elif client.sdwdate_status != SdwdateStatus.SUCCESS:
+        severity = 3
+    else:
+        severity = 4
+    return (severity, (client.client_name or "").casefold())
+
+
+def snapshot_clock() -> float:
+    """
+    Returns the current time as used for state snapshot entries. Unlike the
+    wall clock, which sdwdate itself may step, this keeps counting through
+    server restarts and suspend, and the snapshot does not outlive a boot
+    anyway since it is kept under /run.
+    """
+
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+def is_snapshot_text(text: Any) -> bool:
+    """
+    Checks if a value read from the state snapshot is a string only
+    containing characters a validated client update could contain.
+    """
+
+    return isinstance(text, str) and all(
+        char == "\n" or " " <= char <= "~" for char in text
+    )
+
+
+# pylint: disable=too-many-return-statements
+def parse_snapshot_entry(
+    entry: Any,
+) -> tuple[str, SdwdateStatus, str | None, TorStatus, float] | None:
+    """
+    Validates a client entry read from the state snapshot. Returns the
+    client's name, sdwdate status, sdwdate message, Tor status and the time
+    its state was last confirmed, or None if the entry is invalid.
+
+    The snapshot is written by the server itself, but is still treated as
+    untrusted and held to the same limits as updates from a client.
+    """
+
+    if not isinstance(entry, dict):
+        return None
+    client_name: Any = entry.get("name")
+    sdwdate_status_str: Any = entry.get("sdwdate_status")
+    sdwdate_msg: Any = entry.get("sdwdate_msg")
+    tor_status_str: Any = entry.get("tor_status")
+    confirmed_at: Any = entry.get("confirmed_at")
+
+    if (
+        not is_snapshot_text(client_name)
+        or len(client_name) == 0
+        or client_name
+        != sanitize_for_richtext(client_name, MAX_DISPLAY_NAME_LEN)
+    ):
+        return None
+    if (
+        not isinstance(sdwdate_status_str, str)
+        or sdwdate_status_str not in SdwdateStatus.__members__
+    ):
+        return None
+    if (
+        not isinstance(tor_status_str, str)
+        or tor_status_str not in TorStatus.__members__
+    ):
+        return None
+    if sdwdate_msg is not None and (
+        not is_snapshot_text(sdwdate_msg) or len(sdwdate_msg) > MAX_MSG_SIZE
+    ):
+        return None
+    if (
+        sdwdate_status_str == SdwdateStatus.UNKNOWN.name
+        and tor_status_str == TorStatus.UNKNOWN.name
+    ):
+        return None
+    if isinstance(confirmed_at, bool) or not isinstance(
+        confirmed_at, (int, float)
+    ):
+        return None
+
+    return (
+        client_name,
+        SdwdateStatus[sdwdate_status_str],
+        sdwdate_msg,
+        TorStatus[tor_status_str],
+        float(confirmed_at),
+    )
+
+
+class ClientRegistry:
+    """
+    The set of clients connected to the server, with indexes that keep all
+    per-event operations independent of the number of connected clients:
+    - clients are kept in connection order, keyed by the client object
+      (which owns exactly one connection),
+    - named clients are indexed by name, for duplicate name detection,
+    - clients are bucketed by their sdwdate and Tor status, so the tray icon
+      and "which clients are in error" queries only look at the buckets.
+
+    The registry keeps its own record of which bucket each client is in, so
+    update_status must be called after a client's status changes.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes an empty registry.
+        """
+
+        ## Dicts with None values are used as insertion-ordered sets.
+        self.__clients: dict[SdwdateGuiClient, None] = {}
+        self.__by_name: dict[str, SdwdateGuiClient] = {}
+        self.__sdwdate_status: dict[SdwdateGuiClient, SdwdateStatus] = {}
+        self.__tor_status: dict[SdwdateGuiClient, TorStatus] = {}
+        self.__sdwdate_buckets: dict[
+            SdwdateStatus, dict[SdwdateGuiClient, None]
+        ] = {status: {} for status in SdwdateStatus}
+        self.__tor_buckets: dict[TorStatus, dict[SdwdateGuiClient, None]] = {
+            status: {} for status in TorStatus
+        }
+
+    def __len__(self) -> int:
+        return len(self.__clients)
+
+    def __iter__(self) -> Iterator[SdwdateGuiClient]:
+        return iter(tuple(self.__clients))
+
+    def __contains__(self, client: object) -> bool:
+        return client in self.__clients
+
+    def add(self, client: SdwdateGuiClient) -> None:
+        """
+        Adds a newly connected client.
+        """
+
+        self.__clients[client] = None
+        self.__sdwdate_status[client] = client.sdwdate_status
+        self.__sdwdate_buckets[client.sdwdate_status][client] = None
+        self.__tor_status[client] = client.tor_status
+        self.__tor_buckets[client.tor_status][client] = None
+        if client.client_name is not None:
+            self.__by_name[client.client_name] = client
+
+    def remove(self, client: SdwdateGuiClient) -> bool:
+        """
+        Removes a client. Returns False if the client was not registered.
+        """
+
+        if client not in self.__clients:
+            return False
+        del self.__clients[client]
+        del self.__sdwdate_buckets[self.__sdwdate_status.pop(client)][client]
+        del self.__tor_buckets[self.__tor_status.pop(client)][client]
+        if (
+            client.client_name is not None
+            and self.__by_name.get(client.client_name) is client
+        ):
+            del self.__by_name[client.client_name]
+        return True
+
+    def find_by_name(self, client_name: str) -> SdwdateGuiClient | None:
+        """
+        Returns the registered client with the given name, if any.
+        """
+
+        return self.__by_name.get(client_name)
+
+    def register_name(self, client: SdwdateGuiClient) -> None:
+        """
+        Indexes a client under the name it has just set. Replaces any other
+        client registered under the same name, callers are expected to have
+        resolved the conflict with find_by_name first.
+        """
+
+        assert client.client_name is not None
+        self.__by_name[client.client_name] = client
+
+    def update_status(self, client: SdwdateGuiClient) -> None:
+        """
+        Moves a client to the buckets matching its current sdwdate and Tor
+        status.
+        """
+
+        if client not in self.__clients:
+            return
+        old_sdwdate_status: SdwdateStatus = self.__sdwdate_status[client]
+        if old_sdwdate_status != client.sdwdate_status:
+            del self.__sdwdate_buckets[old_sdwdate_status][client]
+            self.__sdwdate_buckets[client.sdwdate_status][client] = None
+            self.__sdwdate_status[client] = client.sdwdate_status
+        old_tor_status: TorStatus = self.__tor_status[client]
+        if old_tor_status != client.tor_status:
+            del self.__tor_buckets[old_tor_status][client]
+            self.__tor_buckets[client.tor_status][client] = None
+            self.__tor_status[client] = client.tor_status
+
+    def clients_with_sdwdate_status(
+        self, sdwdate_status: SdwdateStatus
+    ) -> tuple[SdwdateGuiClient, ...]:
+        """
+        Returns the clients whose sdwdate status is `sdwdate_status`, e.g.
+        SdwdateStatus.ERROR for the clients in error.
+        """
+
+        return tuple(self.__sdwdate_buckets[sdwdate_status])
+
+    def clients_with_tor_status(
+        self, tor_status: TorStatus
+    ) -> tuple[SdwdateGuiClient, ...]:
+        """
+        Returns the clients whose Tor status is `tor_status`.
+        """
+
+        return tuple(self.__tor_buckets[tor_status])
+
+    def count_sdwdate_status(self, sdwdate_status: SdwdateStatus) -> int:
+        """
+        Returns the number of clients whose sdwdate status is
+        `sdwdate_status`.
+        """
+
+        return len(self.__sdwdate_buckets[sdwdate_status])
+
+    def count_tor_status(self, tor_status: TorStatus) -> int:
+        """
+        Returns the number of clients whose Tor status is `tor_status`.
+        """
+
+        return len(self.__tor_buckets[tor_status])
+
+    def problem_clients(self) -> list[SdwdateGuiClient]:
+        """
+        Returns the clients that need attention, i.e. whose sdwdate status is
+        not SUCCESS or whose Tor status is in PROBLEM_TOR_STATUSES. Only the
+        corresponding buckets are looked at.
+        """
+
+        problem_clients: dict[SdwdateGuiClient, None] = {}
+        for sdwdate_status in PROBLEM_SDWDATE_STATUSES:
+            problem_clients.update(self.__sdwdate_buckets[sdwdate_status])
+        for tor_status in PROBLEM_TOR_STATUSES:
+            problem_clients.update(self.__tor_buckets[tor_status])
+        return list(problem_clients)
+
+    def healthy_clients(self) -> list[SdwdateGuiClient]:
+        """
+        Returns the clients that do not need attention.
+        """
+
+        return [
+            client
+            for client in self.__sdwdate_buckets[SdwdateStatus.SUCCESS]
+            if self.__tor_status[client] not in PROBLEM_TOR_STATUSES
+        ]
+
+    def count_healthy(self) -> int:
+        """
+        Returns the number of clients that do not need attention, without
+        looking at the healthy clients themselves.
+        """
+
+        unhealthy_count: int = 0
+        for tor_status in PROBLEM_TOR_STATUSES:
+            for client in self.__tor_buckets[tor_status]:
+                if self.__sdwdate_status[client] == SdwdateStatus.SUCCESS:
+                    unhealthy_count += 1
+        return (
+            len(self.__sdwdate_buckets[SdwdateStatus.SUCCESS])
+            - unhealthy_count
+        )
+
+
+# pylint: disable=too-few-public-methods
+class SdwdateGuiFrame(QDialog):
+    """
+    A window displaying sdwdate or tor status based on information provided by
+    a client. A frame is kept around after being closed, and updated in place
+    with update_content when it is shown again or its status changes.
     """
 
     def __init__(
         self,
         text: str,
-        icon: QIcon,
+        icon_name: str,
         parent: QWidget | None = None,
     ) -> None:
         """
@@ -684,28 +1179,45 @@ class SdwdateGuiFrame(QDialog):
         self.setWindowTitle("Time Synchronization Monitor")
         self.setMinimumWidth(200)
 
-        icon_widget: QLabel = QLabel(self)
-        icon_widget.setTextFormat(Qt.TextFormat.PlainText)
-        icon_widget.setAlignment(Qt.AlignRight)
-        icon_widget.setPixmap(icon.pixmap(64, 64))
+        self.icon_widget: QLabel = QLabel(self)
+        self.icon_widget.setTextFormat(Qt.TextFormat.PlainText)
+        self.icon_widget.setAlignment(Qt.AlignRight)
+        self.icon_name: str | None = None
 
-        text_widget: QLabel = QLabel(self)
-        text_widget.setTextFormat(Qt.TextFormat.PlainText)
-        text_widget.setTextInteractionFlags(
+        self.text_widget: QLabel = QLabel(self)
+        self.text_widget.setTextFormat(Qt.TextFormat.PlainText)
+        self.text_widget.setTextInteractionFlags(
             Qt.LinksAccessibleByMouse | Qt.TextSelectableByMouse
         )
-        text_widget.setAlignment(Qt.AlignTop)
-        text_widget.setText(text)
+        self.text_widget.setAlignment(Qt.AlignTop)
 
         close_button: QPushButton = QPushButton("Close", self)
         close_button.setMaximumWidth(50)
         close_button.clicked.connect(self.quiet_close)
 
         frame_content: QGridLayout = QGridLayout(self)
-        frame_content.addWidget(icon_widget, 0, 0, 1, 1)
-        frame_content.addWidget(text_widget, 0, 1, 1, 2)
+        frame_content.addWidget(self.icon_widget, 0, 0, 1, 1)
+        frame_content.addWidget(self.text_widget, 0, 1, 1, 2)
         frame_content.addWidget(close_button, 1, 1, 1, 2)
 
+        self.update_content(text, icon_name)
+
+    def update_content(self, text: str, icon_name: str) -> None:
+        """
+        Replaces the text and icon shown in the window. Widgets are only
+        touched if their content actually changes.
+        """
+
+        if icon_name != self.icon_name:
+            self.icon_widget.setPixmap(
+                GlobalData.icon_cache.pixmap(
+                    icon_name, 64, self.devicePixelRatioF()
+                )
+            )
+            self.icon_name = icon_name
+        if text != self.text_widget.text():
+            self.text_widget.setText(text)
+
     def quiet_close(self) -> None:
         """
         Close the window and return nothing.
@@ -714,6 +1226,214 @@ class SdwdateGuiFrame(QDialog):
         self.close()
 
 
+class ConfigWatcher(QObject):
+    """
+    Watches the configuration directories, and re-parses the configuration
+    once they have been quiet for CONFIG_RELOAD_DELAY_MS after a change.
+    """
+
+    configChanged: pyqtSignal = pyqtSignal(object)
+
+    def __init__(self, parent: QObject | None = None) -> None:
+        """
+        Starts watching the configuration directories.
+        """
+
+        QObject.__init__(self, parent)
+        self.reload_timer: QTimer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(CONFIG_RELOAD_DELAY_MS)
+        self.reload_timer.timeout.connect(self.reload)
+
+        ## Directory watches only report files being added, removed or
+        ## renamed, so every configuration file is watched as well.
+        self.watcher: QFileSystemWatcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.reload_timer.start)
+        self.watcher.fileChanged.connect(self.reload_timer.start)
+        self.update_watches()
+
+    def update_watches(self) -> None:
+        """
+        Watches all configuration directories and files that exist right
+        now. Watches of removed files are dropped by Qt automatically.
+        """
+
+        watch_paths: list[str] = []
+        for conf_dir in ConfigData.conf_dir_list:
+            conf_dir_path: Path = Path(conf_dir)
+            if not conf_dir_path.is_dir():
+                continue
+            watch_paths.append(conf_dir)
+            watch_paths.extend(
+                str(conf_file) for conf_file in conf_dir_path.glob("*.conf")
+            )
+        watched_paths: set[str] = set(
+            self.watcher.directories() + self.watcher.files()
+        )
+        new_paths: list[str] = [
+            path for path in watch_paths if path not in watched_paths
+        ]
+        if len(new_paths) != 0:
+            self.watcher.addPaths(new_paths)
+
+    def reload(self) -> None:
+        """
+        Re-parses the configuration, and announces which keys changed.
+        """
+
+        changed_keys: set[str] = reload_config_files()
+        self.update_watches()
+        if len(changed_keys) != 0:
+            self.configChanged.emit(changed_keys)
+
+
+class QueryListener(QObject):
+    """
+    Serves the query socket, see sdwdate_gui_query. Lives in the GUI thread,
+    next to the client state it reports.
+    """
+
+    def __init__(
+        self,
+        query_entries: Callable[[], list[dict[str, Any]]],
+        parent: QObject | None = None,
+    ) -> None:
+        """
+        Starts listening on the query socket. `query_entries` returns the
+        descriptions of all clients for a snapshot message.
+        """
+
+        QObject.__init__(self, parent)
+        self.query_entries: Callable[[], list[dict[str, Any]]] = query_entries
+        ## All connected query clients, mapped to what they sent so far, or
+        ## None once their request was answered.
+        self.query_clients: dict[QLocalSocket, bytes | None] = {}
+        self.subscribers: set[QLocalSocket] = set()
+
+        try:
+            os.remove(GlobalData.query_socket_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error("Could not erase old query socket!", exc_info=e)
+        self.server: QLocalServer = QLocalServer(self)
+        self.server.setSocketOptions(
+            QLocalServer.SocketOption.UserAccessOption
+        )
+        self.server.newConnection.connect(self.accept_query)
+        if not self.server.listen(str(GlobalData.query_socket_path)):
+            logging.error(
+                "Could not listen on query socket: %s",
+                self.server.errorString(),
+            )
+
+    def stop_listening(self) -> None:
+        """
+        Disconnects all query clients and removes the query socket.
+        """
+
+        for query_socket in list(self.query_clients):
+            self.drop_query(query_socket)
+        self.server.close()
+
+    def accept_query(self) -> None:
+        """
+        Accepts a new query client, which has QUERY_REQUEST_TIMEOUT_MS to
+        send its request.
+        """
+
+        query_socket: QLocalSocket | None = self.server.nextPendingConnection()
+        assert query_socket is not None
+        if len(self.query_clients) >= MAX_QUERY_CONNECTIONS:
+            count_metric("queries_rejected")
+            query_socket.abort()
+            query_socket.deleteLater()
+            return
+        self.query_clients[query_socket] = b""
+        query_socket.readyRead.connect(
+            functools.partial(self.read_request, query_socket)
+        )
+        query_socket.disconnected.connect(
+            functools.partial(self.drop_query, query_socket)
+        )
+        request_timer: QTimer = QTimer(query_socket)
+        request_timer.setSingleShot(True)
+        request_timer.timeout.connect(
+            functools.partial(self.expire_request, query_socket)
+        )
+        request_timer.start(QUERY_REQUEST_TIMEOUT_MS)
+
+    def read_request(self, query_socket: QLocalSocket) -> None:
+        """
+        Reads the request of a query client, and answers it once complete.
+        """
+
+        ## mypy doesn't seem to know that QByteArray.data() returns a
+        ## "bytes" value
+        new_data: bytes = query_socket.readAll().data()  # type: ignore
+        request_buf: bytes | None = self.query_clients.get(query_socket)
+        if request_buf is None:
+            ## Subscribers have nothing more to say, anything they send is
+            ## ignored.
+            return
+        request_buf += new_data
+        newline_idx: int = request_buf.find(b"\n")
+        if newline_idx < 0:
+            if len(request_buf) >= QUERY_REQUEST_MAX_LEN:
+                self.drop_query(query_socket)
+                return
+            self.query_clients[query_socket] = request_buf
+            return
+
+        request: str | None = parse_query_request(
+            request_buf[: newline_idx + 1]
+        )
+        if request is None:
+            self.drop_query(query_socket)
+            return
+        self.query_clients[query_socket] = None
+        count_metric("queries_answered", request=request)
+        query_socket.write(snapshot_message(self.query_entries()))
+        if request == "snapshot":
+            ## Only disconnects once the answer is written.
+            query_socket.disconnectFromServer()
+            return
+        self.subscribers.add(query_socket)
+
+    def expire_request(self, query_socket: QLocalSocket) -> None:
+        """
+        Disconnects a query client that did not send its request in time.
+        """
+
+        if self.query_clients.get(query_socket) is not None:
+            self.drop_query(query_socket)
+
+    def drop_query(self, query_socket: QLocalSocket) -> None:
+        """
+        Disconnects and forgets a query client.
+        """
+
+        if query_socket not in self.query_clients:
+            return
+        del self.query_clients[query_socket]
+        self.subscribers.discard(query_socket)
+        query_socket.abort()
+        query_socket.deleteLater()
+
+    def publish(self, message: bytes) -> None:
+        """
+        Sends an update or remove message to all subscribed query clients.
+        """
+
+        for query_socket in list(self.subscribers):
+            if query_socket.bytesToWrite() > MAX_SUBSCRIBER_BACKLOG:
+                count_metric("query_subscribers_dropped")
+                self.drop_query(query_socket)
+                continue
+            query_socket.write(message)
+
+
+# pylint: disable=too-many-public-methods
 class SdwdateTrayIcon(QSystemTrayIcon):
     """
     The core GUI of sdwdate-gui. Displays a system tray icon with a context
@@ -721,6 +1441,7 @@ class SdwdateTrayIcon(QSystemTrayIcon):
     configuring certain aspects of both services on the client side.
     """
 
+    # pylint: disable=too-many-statements
     def __init__(self, parent: QObject | None = None):
         """
         Initializes the tray icon.
@@ -730,46 +1451,32 @@ class SdwdateTrayIcon(QSystemTrayIcon):
 
         self.title: str = "Time Synchronization Monitor"
 
-        self.client_list: list[SdwdateGuiClient] = []
+        self.client_registry: ClientRegistry = ClientRegistry()
 
         self.clicked_once: bool = False
         self.pos_x: int = 0
         self.pos_y: int = 0
+        ## The status window currently shown, and the windows shown earlier
+        ## and kept around to be reused, one per client name and message
+        ## type.
         self.msg_window: SdwdateGuiFrame | None = None
         self.msg_window_client: str | None = None
         self.msg_window_type: MessageType | None = None
-
-        self.icon_path: str = "/usr/share/sdwdate-gui/icons/"
-        self.error_icon: QIcon = QIcon(self.icon_path + "error.png")
-        self.tor_icon_list: list[QIcon] = [
-            QIcon(self.icon_path + "tor-ok.png"),
-            self.error_icon,
-            self.error_icon,
-            QIcon(self.icon_path + "tor-warning.png"),
-        ]
-        self.sdwdate_icon_list: list[QIcon] = [
-            QIcon(self.icon_path + "sdwdate-success.png"),
-            QIcon(self.icon_path + "sdwdate-wait.png"),
-            QIcon(self.icon_path + "sdwdate-stopped.png"),
-        ]
-        self.advanced_settings_icon: QIcon = QIcon(
-            self.icon_path + "advancedsettings.ico"
-        )
-        self.sdwdate_log_icon: QIcon = QIcon(self.icon_path + "sdwdate-log.png")
-        self.restart_sdwdate_icon: QIcon = QIcon(
-            self.icon_path + "restart-sdwdate.png"
-        )
-        self.stop_sdwdate_icon: QIcon = QIcon(
-            self.icon_path + "stop-sdwdate.png"
-        )
-        self.application_exit_icon: QIcon = QIcon(
-            self.icon_path + "application-exit.png"
+        self.msg_window_dict: dict[
+            tuple[str, MessageType], SdwdateGuiFrame
+        ] = {}
+
+        ## Only the initial tray icon is loaded right away, everything else
+        ## is loaded when first shown.
+        self.icon_cache: IconCache = GlobalData.icon_cache
+        self.setIcon(
+            self.icon_cache.icon(SDWDATE_ICON_FILES[SdwdateStatus.BUSY.value])
         )
-        self.setIcon(self.sdwdate_icon_list[SdwdateStatus.BUSY.value])
         self.setToolTip("Time Synchronization Monitor \nRight-click for menu.")
 
         self.menu: QMenu = QMenu()
         self.menu_client_list: list[SdwdateGuiClient] = []
+        self.menu_submenu_list: list[QMenu] = []
         self.menu_action_list: list[QAction] = []
         self.menu_regen_pending: bool = False
         self.regen_menu()
@@ -777,8 +1484,57 @@ class SdwdateTrayIcon(QSystemTrayIcon):
         self.setContextMenu(self.menu)
         self.activated.connect(self.show_menu)
 
-        self.listener: SdwdateGuiListener = SdwdateGuiListener(self)
+        ## All socket I/O, framing and validation happens in a separate
+        ## thread, so that no amount of client traffic can delay the GUI. See
+        ## SdwdateGuiConnection.
+        self.io_thread: SdwdateGuiIoThread = SdwdateGuiIoThread(self)
+        self.listener: SdwdateGuiListener = SdwdateGuiListener()
+        self.listener.moveToThread(self.io_thread)
         self.listener.newClient.connect(self.accept_client)
+        self.io_thread.finished.connect(self.listener.deleteLater)
+        register_profiled_thread(self.toggle_io_thread_profiling)
+        self.io_thread.start()
+        ## Qt aborts if a running thread is destroyed, e.g. while the
+        ## interpreter shuts down.
+        atexit.register(self.stop_io_thread)
+        QMetaObject.invokeMethod(
+            self.listener,
+            "start_listening",
+            Qt.ConnectionType.BlockingQueuedConnection,
+        )
+
+        self.config_watcher: ConfigWatcher = ConfigWatcher(self)
+        self.config_watcher.configChanged.connect(self.apply_config)
+
+        self.query_listener: QueryListener = QueryListener(
+            self.query_entries, self
+        )
+        atexit.register(self.query_listener.stop_listening)
+
+        ## See sdwdate_gui_textfile.
+        self.metrics_textfile: MetricsTextfile = MetricsTextfile()
+        self.metrics_textfile_timer: QTimer = QTimer(self)
+        self.metrics_textfile_timer.setInterval(METRICS_TEXTFILE_INTERVAL_MS)
+        self.metrics_textfile_timer.timeout.connect(
+            self.update_metrics_textfile
+        )
+        self.apply_metrics_textfile_config()
+        atexit.register(self.metrics_textfile.remove)
+
+        ## Clients restored from the state snapshot whose real client has
+        ## not reconnected yet, mapped to the snapshot_clock() time their
+        ## state was last confirmed at. See restore_state_snapshot.
+        self.stale_clients: dict[SdwdateGuiClient, float] = {}
+        self.stale_timer: QTimer = QTimer(self)
+        self.stale_timer.setSingleShot(True)
+        self.stale_timer.timeout.connect(self.expire_stale_clients)
+        self.state_snapshot_pending: bool = False
+        self.state_snapshot_timer: QTimer = QTimer(self)
+        self.state_snapshot_timer.setSingleShot(True)
+        self.state_snapshot_timer.setInterval(STATE_SNAPSHOT_DELAY_MS)
+        self.state_snapshot_timer.timeout.connect(self.write_state_snapshot)
+        self.restore_state_snapshot()
+        atexit.register(self.flush_state_snapshot)
 
     def show_disconnected_msg(
         self,
@@ -794,21 +1550,79 @@ class SdwdateTrayIcon(QSystemTrayIcon):
             self.pos_y = QCursor.pos().y() - 50
             self.clicked_once = True
 
-        msg_window: SdwdateGuiFrame = SdwdateGuiFrame(
-            f"Client '{client.client_name}' is no longer connected.",
-            self.error_icon,
+        msg_text: str
+        if client.stale:
+            msg_text = (
+                f"Client '{client.client_name}' has not reconnected since "
+                "sdwdate-gui was restarted."
+            )
+        else:
+            msg_text = f"Client '{client.client_name}' is no longer connected."
+        self.present_msg_window(
+            msg_text,
+            ERROR_ICON,
+            MessageType.DISCONNECTED,
+            client,
         )
-        if self.msg_window is not None and self.msg_window.isVisible():
+
+    def present_msg_window(
+        self,
+        text: str,
+        icon_name: str,
+        message_type: MessageType,
+        client: SdwdateGuiClient,
+    ) -> None:
+        """
+        Shows a status window with the given content. The window for this
+        client and message type is reused and updated in place if there is
+        one. Any other status window shown at the moment is closed.
+        """
+
+        window_key: tuple[str, MessageType] = (
+            client.client_name_or_unknown(),
+            message_type,
+        )
+        msg_window: SdwdateGuiFrame | None = self.msg_window_dict.get(
+            window_key
+        )
+        if msg_window is None:
+            msg_window = SdwdateGuiFrame(text, icon_name)
+            self.msg_window_dict[window_key] = msg_window
+        else:
+            msg_window.update_content(text, icon_name)
+
+        if (
+            self.msg_window is not None
+            and self.msg_window is not msg_window
+            and self.msg_window.isVisible()
+        ):
             self.msg_window.close()
-        if self.msg_window is not None:
-            self.msg_window.deleteLater()
 
         self.msg_window = msg_window
-        self.msg_window_type = MessageType.DISCONNECTED
+        self.msg_window_type = message_type
         self.msg_window_client = client.client_name
-        self.msg_window.move(self.pos_x, self.pos_y)
-        self.msg_window.show()
+        if not msg_window.isVisible():
+            msg_window.move(self.pos_x, self.pos_y)
+            msg_window.show()
+        self.prune_msg_windows()
+
+    def prune_msg_windows(self) -> None:
+        """
+        Deletes hidden status windows of clients that are no longer
+        connected.
+        """
+
+        for window_key, msg_window in list(self.msg_window_dict.items()):
+            if msg_window.isVisible():
+                continue
+            if self.client_registry.find_by_name(window_key[0]) is not None:
+                continue
+            del self.msg_window_dict[window_key]
+            if msg_window is self.msg_window:
+                self.msg_window = None
+            msg_window.deleteLater()
 
+    @timed_metric("show_status_msg_seconds")
     def show_status_msg(
         self,
         message_type: MessageType,
@@ -819,7 +1633,7 @@ class SdwdateTrayIcon(QSystemTrayIcon):
         sdwdate or the Tor state depending on the value of `message_type`.
         """
 
-        if not client.client_socket.state() == QLocalSocket.ConnectedState:
+        if not client.connected and not client.stale:
             self.show_disconnected_msg(client)
             return
 
@@ -828,25 +1642,21 @@ class SdwdateTrayIcon(QSystemTrayIcon):
             self.pos_y = QCursor.pos().y() - 50
             self.clicked_once = True
 
-        msg_window: SdwdateGuiFrame | None
+        window_text: str
+        window_icon: str
 
         if message_type == MessageType.SDWDATE:
             if client.sdwdate_msg is None:
                 return
-            safe_msg: str = sanitize_for_richtext(
-                client.sdwdate_msg, MAX_DISPLAY_MSG_LEN
-            )
+            safe_msg: str = client.sdwdate_msg.display_text()
             if running_in_qubes_os():
-                msg_window = SdwdateGuiFrame(
+                window_text = (
                     "Last message from sdwdate on "
-                    f"{client.client_name}:\n\n{safe_msg}",
-                    self.sdwdate_icon_list[client.sdwdate_status.value],
+                    f"{client.client_name}:\n\n{safe_msg}"
                 )
             else:
-                msg_window = SdwdateGuiFrame(
-                    f"Last message from sdwdate:\n\n{safe_msg}",
-                    self.sdwdate_icon_list[client.sdwdate_status.value],
-                )
+                window_text = f"Last message from sdwdate:\n\n{safe_msg}"
+            window_icon = SDWDATE_ICON_FILES[client.sdwdate_status.value]
         else:  # message_type == MessageType.TOR
             msg_text: str
             match client.tor_status:
@@ -886,210 +1696,356 @@ to connect to or configure the Tor network."""
                     return
 
             if running_in_qubes_os():
-                msg_window = SdwdateGuiFrame(
-                    f"Tor status on {client.client_name}:\n\n{msg_text}",
-                    self.tor_icon_list[client.tor_status.value],
+                window_text = (
+                    f"Tor status on {client.client_name}:\n\n{msg_text}"
                 )
             else:
-                msg_window = SdwdateGuiFrame(
-                    f"Tor status:\n\n{msg_text}",
-                    self.tor_icon_list[client.tor_status.value],
-                )
+                window_text = f"Tor status:\n\n{msg_text}"
+            window_icon = TOR_ICON_FILES[client.tor_status.value]
 
-        if self.msg_window is not None and self.msg_window.isVisible():
-            self.msg_window.close()
-        if self.msg_window is not None:
-            self.msg_window.deleteLater()
+        if client.stale:
+            window_text += (
+                "\n\nThis is the last known status from before sdwdate-gui "
+                "was restarted.\nIt has not been confirmed by the client yet."
+            )
 
-        self.msg_window = msg_window
-        self.msg_window_type = message_type
-        self.msg_window_client = client.client_name
-        self.msg_window.move(self.pos_x, self.pos_y)
-        self.msg_window.show()
+        self.present_msg_window(window_text, window_icon, message_type, client)
 
-    def run_client_method(
-        self, client: SdwdateGuiClient, client_method: Callable[[], None]
-    ) -> None:
+    def show_history_msg(self, client: SdwdateGuiClient) -> None:
         """
-        Opens the Tor Control Panel for an sdwdate-gui-client instance if the
-        client is still connected.
+        Shows a window listing the recent sdwdate and Tor status changes of
+        the specified client, newest first.
         """
 
-        if not client.client_socket.state() == QLocalSocket.ConnectedState:
-            self.show_disconnected_msg(client)
-            return
-        client_method()
+        if not self.clicked_once:
+            self.pos_x = QCursor.pos().x() - 50
+            self.pos_y = QCursor.pos().y() - 50
+            self.clicked_once = True
 
-    # pylint: disable=too-many-statements, too-many-branches
-    def regen_menu(self, force_regen: bool = False) -> None:
-        """
-        Regenerates the context menu for the tray icon.
+        now: float = time.monotonic()
+        history_lines: list[str] = []
+        for entry in reversed(client.status_history):
+            line: str = f"{now - entry.timestamp:.1f}s ago: "
+            if isinstance(entry.status, SdwdateStatus):
+                line += f"sdwdate {entry.status.name.lower()}"
+            else:
+                line += f"Tor {entry.status.name.lower()}"
+            if entry.message is not None:
+                line += f": {entry.message.history_text()}"
+            history_lines.append(line)
+        if len(history_lines) == 0:
+            history_lines.append("No status changes recorded yet.")
+        history_text: str = "\n".join(history_lines)
+
+        if running_in_qubes_os():
+            history_text = (
+                f"Status history of {client.client_name}:\n\n{history_text}"
+            )
+        else:
+            history_text = f"Status history:\n\n{history_text}"
+
+        self.present_msg_window(
+            history_text,
+            SDWDATE_LOG_ICON,
+            MessageType.HISTORY,
+            client,
+        )
+
+    def run_client_method(
+        self, client: SdwdateGuiClient, client_method: Callable[[], None]
+    ) -> None:
+        """
+        Opens the Tor Control Panel for an sdwdate-gui-client instance if the
+        client is still connected.
         """
 
-        if self.menu.isVisible() and not force_regen:
-            ## Avoid mutating menu actions while the menu popup is on screen.
-            ## Queue a refresh to run when the popup opens next.
-            self.menu_regen_pending = True
+        if not client.connected:
+            self.show_disconnected_msg(client)
             return
+        client_method()
 
-        self.menu_regen_pending = False
-        for old_action in self.menu_action_list:
-            old_action.deleteLater()
-        self.menu_action_list.clear()
-        self.menu.clear()
-        for old_client in self.menu_client_list:
-            old_client.present_in_menu = False
-            if not old_client in self.client_list:
-                old_client.deleteLater()
-        self.menu_client_list.clear()
-
-        clients_shown: int = 0
+    def client_menu_icon(self, client: SdwdateGuiClient) -> QIcon:
+        """
+        Returns the icon representing a client in the menu.
+        """
 
-        for client in self.client_list:
-            if client.client_name is None or (
-                client.tor_status == TorStatus.UNKNOWN
-                and client.sdwdate_status == SdwdateStatus.UNKNOWN
-            ):
-                ## Client isn't ready yet, skip it
-                continue
+        ## Client icon is the client's sdwdate status icon, unless the
+        ## client is Tor-enabled and Tor is stopped or disabled.
+        ##
+        ## client.tor_status will be TorStatus.ABSENT if the client is not
+        ## Tor-enabled, so we don't have to explicitly check if the client
+        ## is Tor-enabled or not.
+        if client.tor_status in (TorStatus.STOPPED, TorStatus.DISABLED):
+            return self.icon_cache.icon(
+                TOR_ICON_FILES[client.tor_status.value]
+            )
+        return self.icon_cache.icon(
+            SDWDATE_ICON_FILES[effective_sdwdate_status(client).value]
+        )
 
-            effective_sdwdate_status: SdwdateStatus
-            if client.sdwdate_status == SdwdateStatus.UNKNOWN:
-                effective_sdwdate_status = SdwdateStatus.BUSY
-            else:
-                effective_sdwdate_status = client.sdwdate_status
-
-            ## Client icon is the client's sdwdate status icon, unless the
-            ## client is Tor-enabled and Tor is stopped or disabled.
-            ##
-            ## client.tor_status will be TorStatus.ABSENT if the client is not
-            ## Tor-enabled, so we don't have to explicitly check if the client
-            ## is Tor-enabled or not.
-            client_icon: QIcon
-            if client.tor_status in (TorStatus.STOPPED, TorStatus.DISABLED):
-                client_icon = self.tor_icon_list[client.tor_status.value]
-            else:
-                client_icon = self.sdwdate_icon_list[
-                    effective_sdwdate_status.value
-                ]
-
-            ## Each client gets its own submenu, unless there's only one
-            ## client.
-            if len(self.client_list) > 1:
-                action_menu: QMenu | None = self.menu.addMenu(
-                    client_icon,
-                    client.client_name,
-                )
-            else:
-                action_menu = self.menu
-            assert action_menu is not None
-
-            ## Tor-enabled clients get two extra menu items, one for Tor
-            ## status,and one to open the Tor control panel.
-            if client.tor_status != TorStatus.ABSENT:
-                ## ACTION: Tor status
-                target_tor_status: TorStatus
-                if client.tor_status in (TorStatus.ABSENT, TorStatus.UNKNOWN):
-                    target_tor_status = TorStatus.STOPPED
-                else:
-                    target_tor_status = client.tor_status
-                action: QAction = QAction(
-                    self.tor_icon_list[target_tor_status.value],
-                    "Show Tor status",
-                    action_menu,
-                )
-                action.triggered.connect(
-                    functools.partial(
-                        self.show_status_msg, MessageType.TOR, client
-                    )
-                )
-                action_menu.addAction(action)
-                self.menu_action_list.append(action)
-
-                ## ACTION: Tor control panel
-                action = QAction(
-                    self.advanced_settings_icon,
-                    "Tor control panel",
-                    action_menu,
-                )
-                action.triggered.connect(
-                    functools.partial(
-                        self.run_client_method,
-                        client,
-                        client.open_tor_control_panel,
-                    )
-                )
-                action_menu.addAction(action)
-                self.menu_action_list.append(action)
-                action_menu.addSeparator()
+    def add_client_actions(
+        self,
+        action_menu: QMenu,
+        client: SdwdateGuiClient,
+    ) -> None:
+        """
+        Adds the actions for a single client to a menu.
+        """
 
-            ## ACTION: Sdwdate status
-            action = QAction(
-                self.sdwdate_icon_list[effective_sdwdate_status.value],
-                "Show sdwdate status",
+        if client.stale:
+            notice_action: QAction = QAction(
+                "Last known status, waiting for client...",
                 action_menu,
             )
-            action.triggered.connect(
-                functools.partial(
-                    self.show_status_msg,
-                    MessageType.SDWDATE,
-                    client,
-                )
-            )
-            action_menu.addAction(action)
-            self.menu_action_list.append(action)
+            notice_action.setEnabled(False)
+            action_menu.addAction(notice_action)
+            self.menu_action_list.append(notice_action)
             action_menu.addSeparator()
 
-            ## ACTION: Show sdwdate log
-            action = QAction(
-                self.sdwdate_log_icon,
-                "Open sdwdate's log",
+        ## Tor-enabled clients get two extra menu items, one for Tor
+        ## status,and one to open the Tor control panel.
+        if client.tor_status != TorStatus.ABSENT:
+            ## ACTION: Tor status
+            target_tor_status: TorStatus
+            if client.tor_status in (TorStatus.ABSENT, TorStatus.UNKNOWN):
+                target_tor_status = TorStatus.STOPPED
+            else:
+                target_tor_status = client.tor_status
+            action: QAction = QAction(
+                self.icon_cache.icon(TOR_ICON_FILES[target_tor_status.value]),
+                "Show Tor status",
                 action_menu,
             )
             action.triggered.connect(
                 functools.partial(
-                    self.run_client_method, client, client.open_sdwdate_log
+                    self.show_status_msg, MessageType.TOR, client
                 )
             )
             action_menu.addAction(action)
             self.menu_action_list.append(action)
 
-            ## ACTION: Sdwdate restart
+            ## ACTION: Tor control panel
             action = QAction(
-                self.restart_sdwdate_icon,
-                "Restart sdwdate",
+                self.icon_cache.icon(ADVANCED_SETTINGS_ICON),
+                "Tor control panel",
                 action_menu,
             )
             action.triggered.connect(
                 functools.partial(
-                    self.run_client_method, client, client.restart_sdwdate
+                    self.run_client_method,
+                    client,
+                    client.open_tor_control_panel,
                 )
             )
             action_menu.addAction(action)
             self.menu_action_list.append(action)
+            action_menu.addSeparator()
 
-            ## ACTION: Sdwdate stop
-            action = QAction(
-                self.stop_sdwdate_icon,
-                "Stop sdwdate",
-                action_menu,
+        ## ACTION: Sdwdate status
+        action = QAction(
+            self.icon_cache.icon(
+                SDWDATE_ICON_FILES[effective_sdwdate_status(client).value]
+            ),
+            "Show sdwdate status",
+            action_menu,
+        )
+        action.triggered.connect(
+            functools.partial(
+                self.show_status_msg,
+                MessageType.SDWDATE,
+                client,
             )
-            action.triggered.connect(
-                functools.partial(
-                    self.run_client_method, client, client.stop_sdwdate
-                )
+        )
+        action_menu.addAction(action)
+        self.menu_action_list.append(action)
+        action_menu.addSeparator()
+
+        ## ACTION: Show sdwdate log
+        action = QAction(
+            self.icon_cache.icon(SDWDATE_LOG_ICON),
+            "Open sdwdate's log",
+            action_menu,
+        )
+        action.triggered.connect(
+            functools.partial(
+                self.run_client_method, client, client.open_sdwdate_log
             )
-            action_menu.addAction(action)
-            self.menu_action_list.append(action)
+        )
+        action_menu.addAction(action)
+        self.menu_action_list.append(action)
+
+        ## ACTION: Show status history
+        action = QAction(
+            self.icon_cache.icon(SDWDATE_LOG_ICON),
+            "Show status history",
+            action_menu,
+        )
+        action.triggered.connect(
+            functools.partial(self.show_history_msg, client)
+        )
+        action_menu.addAction(action)
+        self.menu_action_list.append(action)
+
+        ## ACTION: Sdwdate restart
+        action = QAction(
+            self.icon_cache.icon(RESTART_SDWDATE_ICON),
+            "Restart sdwdate",
+            action_menu,
+        )
+        action.triggered.connect(
+            functools.partial(
+                self.run_client_method, client, client.restart_sdwdate
+            )
+        )
+        action_menu.addAction(action)
+        self.menu_action_list.append(action)
+
+        ## ACTION: Sdwdate stop
+        action = QAction(
+            self.icon_cache.icon(STOP_SDWDATE_ICON),
+            "Stop sdwdate",
+            action_menu,
+        )
+        action.triggered.connect(
+            functools.partial(
+                self.run_client_method, client, client.stop_sdwdate
+            )
+        )
+        action_menu.addAction(action)
+        self.menu_action_list.append(action)
+
+    def track_menu_client(self, client: SdwdateGuiClient) -> None:
+        """
+        Prevents the client from being deleted while we still have a menu
+        entry for it, while still ensuring we free it once safe.
+        """
 
-            ## Prevent the client from being deleted if we still have a menu
-            ## entry for it, while still ensuring we free it once safe
+        if not client.present_in_menu:
             client.present_in_menu = True
             self.menu_client_list.append(client)
 
-            clients_shown += 1
+    def add_client_submenu(
+        self,
+        parent_menu: QMenu,
+        client: SdwdateGuiClient,
+    ) -> None:
+        """
+        Adds a submenu for a client. The submenu's actions are only created
+        once it is about to be shown.
+        """
+
+        assert client.client_name is not None
+        client_menu_title: str = client.client_name
+        if client.stale:
+            client_menu_title += " (last known)"
+        client_menu: QMenu = QMenu(client_menu_title, parent_menu)
+        client_menu.setIcon(self.client_menu_icon(client))
+        client_menu.aboutToShow.connect(
+            functools.partial(self.populate_client_menu, client_menu, client)
+        )
+        parent_menu.addMenu(client_menu)
+        self.menu_submenu_list.append(client_menu)
+        self.track_menu_client(client)
+
+    def populate_client_menu(
+        self,
+        client_menu: QMenu,
+        client: SdwdateGuiClient,
+    ) -> None:
+        """
+        Creates the actions of a client's submenu the first time it is shown.
+        """
+
+        if client_menu.isEmpty():
+            self.add_client_actions(client_menu, client)
+
+    def populate_healthy_menu(self, healthy_menu: QMenu) -> None:
+        """
+        Creates the submenus of all healthy clients the first time the
+        "N clients OK" submenu is shown.
+        """
+
+        if not healthy_menu.isEmpty():
+            return
+        for client in sorted(
+            self.client_registry.healthy_clients(),
+            key=client_menu_sort_key,
+        ):
+            self.add_client_submenu(healthy_menu, client)
+
+    @timed_metric("regen_menu_seconds")
+    def regen_menu(self, force_regen: bool = False) -> None:
+        """
+        Regenerates the context menu for the tray icon.
+
+        Clients that need attention are listed first, worst first, each with
+        its own submenu. Healthy clients are collapsed into a single
+        "N clients OK" submenu. Submenus are only filled in when they are
+        about to be shown, so the cost of this does not grow with the number
+        of healthy clients.
+        """
+
+        if self.menu.isVisible() and not force_regen:
+            ## Avoid mutating menu actions while the menu popup is on screen.
+            ## Queue a refresh to run when the popup opens next.
+            self.menu_regen_pending = True
+            count_metric("regen_menu_deferred")
+            return
+
+        self.menu_regen_pending = False
+        for old_action in self.menu_action_list:
+            old_action.deleteLater()
+        self.menu_action_list.clear()
+        self.menu.clear()
+        for old_submenu in self.menu_submenu_list:
+            old_submenu.deleteLater()
+        self.menu_submenu_list.clear()
+        for old_client in self.menu_client_list:
+            old_client.present_in_menu = False
+            if not old_client in self.client_registry:
+                old_client.deleteLater()
+        self.menu_client_list.clear()
+
+        problem_clients: list[SdwdateGuiClient] = sorted(
+            (
+                client
+                for client in self.client_registry.problem_clients()
+                if client_ready(client)
+            ),
+            key=client_menu_sort_key,
+        )
+        healthy_count: int = self.client_registry.count_healthy()
+
+        if len(self.client_registry) == 1 and (
+            len(problem_clients) + healthy_count == 1
+        ):
+            ## A single client's actions go directly into the main menu.
+            single_client: SdwdateGuiClient = next(iter(self.client_registry))
+            self.add_client_actions(self.menu, single_client)
+            self.track_menu_client(single_client)
+        else:
+            for client in problem_clients:
+                self.add_client_submenu(self.menu, client)
+            if healthy_count != 0:
+                if len(problem_clients) != 0:
+                    self.menu.addSeparator()
+                healthy_menu: QMenu = QMenu(
+                    f"{healthy_count} client"
+                    f"{'' if healthy_count == 1 else 's'} OK",
+                    self.menu,
+                )
+                healthy_menu.setIcon(
+                    self.icon_cache.icon(
+                        SDWDATE_ICON_FILES[SdwdateStatus.SUCCESS.value]
+                    )
+                )
+                healthy_menu.aboutToShow.connect(
+                    functools.partial(self.populate_healthy_menu, healthy_menu)
+                )
+                self.menu.addMenu(healthy_menu)
+                self.menu_submenu_list.append(healthy_menu)
 
-        if clients_shown == 0:
+        if len(problem_clients) + healthy_count == 0:
             no_clients_action: QAction = QAction(
                 "Waiting for sdwdate-gui client...",
                 self.menu,
@@ -1101,8 +2057,8 @@ to connect to or configure the Tor network."""
 
         ## Add a button to quit the sdwdate GUI server underneath all the
         ## client entries
-        action = QAction(
-            self.application_exit_icon,
+        action: QAction = QAction(
+            self.icon_cache.icon(APPLICATION_EXIT_ICON),
             "&Exit",
             self.menu,
         )
@@ -1119,36 +2075,45 @@ to connect to or configure the Tor network."""
         if self.menu_regen_pending:
             self.regen_menu(force_regen=True)
 
+    @timed_metric("set_tray_icon_seconds")
     def set_tray_icon(self) -> None:
         """
         Sets the system tray icon for the applet based on the status of
         connected clients.
         """
 
-        sdwdate_status_index: int = -1
-        tor_status_index: int = -1
-
-        for client in self.client_list:
-            if (
-                client.sdwdate_status != SdwdateStatus.UNKNOWN
-                and client.sdwdate_status.value > sdwdate_status_index
-            ):
-                sdwdate_status_index = client.sdwdate_status.value
-
-            if (
-                client.tor_status != TorStatus.ABSENT
-                and client.tor_status != TorStatus.UNKNOWN
-                and client.tor_status.value > tor_status_index
-            ):
-                tor_status_index = client.tor_status.value
+        ## The worst status of any client wins. Only the status buckets are
+        ## looked at, so this does not depend on the number of clients.
+        sdwdate_status_index: int = max(
+            (
+                status.value
+                for status in SdwdateStatus
+                if status != SdwdateStatus.UNKNOWN
+                and self.client_registry.count_sdwdate_status(status) != 0
+            ),
+            default=-1,
+        )
+        tor_status_index: int = max(
+            (
+                status.value
+                for status in TorStatus
+                if status not in (TorStatus.ABSENT, TorStatus.UNKNOWN)
+                and self.client_registry.count_tor_status(status) != 0
+            ),
+            default=-1,
+        )
 
         if tor_status_index in (
             TorStatus.STOPPED.value,
             TorStatus.DISABLED.value,
         ):
-            self.setIcon(self.tor_icon_list[tor_status_index])
+            self.setIcon(
+                self.icon_cache.icon(TOR_ICON_FILES[tor_status_index])
+            )
         elif sdwdate_status_index > -1:
-            self.setIcon(self.sdwdate_icon_list[sdwdate_status_index])
+            self.setIcon(
+                self.icon_cache.icon(SDWDATE_ICON_FILES[sdwdate_status_index])
+            )
 
         ## Continue without setting a new icon if both of these checks flunk.
 
@@ -1178,19 +2143,21 @@ to connect to or configure the Tor network."""
         kicked.
         """
 
-        duplicate_clients: list[SdwdateGuiClient] = [
-            client
-            for client in self.client_list
-            if client is not sender_client
-            and client.client_name == sender_client.client_name
-        ]
-        if len(duplicate_clients) != 0:
+        assert sender_client.client_name is not None
+        old_client: SdwdateGuiClient | None = (
+            self.client_registry.find_by_name(sender_client.client_name)
+        )
+        if old_client is not None and old_client.stale:
+            ## The client came back, its own state replaces the one restored
+            ## from the snapshot.
+            self.drop_client(old_client)
+            old_client = None
+        if old_client is not None and old_client is not sender_client:
             if running_in_qubes_os():
                 ## The same VM reconnected before the server noticed the
                 ## previous connection had dropped. Keep the new connection
-                ## and discard the stale duplicate(s).
-                for old_client in duplicate_clients:
-                    old_client.kick_client()
+                ## and discard the stale duplicate.
+                old_client.kick_client("stale_duplicate")
             else:
                 ## On non-Qubes systems the name is self-reported, so treat a
                 ## duplicate name as an impersonation attempt and kick the
@@ -1201,10 +2168,15 @@ to connect to or configure the Tor network."""
                     sender_client.client_name_or_unknown(),
                     sender_client.client_name,
                 )
-                sender_client.kick_client()
+                sender_client.kick_client("duplicate_name")
                 return
 
+        self.client_registry.register_name(sender_client)
         self.regen_menu()
+        self.schedule_state_snapshot()
+        self.query_listener.publish(
+            update_message(self.query_entry(sender_client))
+        )
 
     def handle_state_change(
         self,
@@ -1215,48 +2187,405 @@ to connect to or configure the Tor network."""
         Handles sdwdate and Tor state changes in any running client.
         """
 
+        self.client_registry.update_status(message_client)
+        self.trim_status_history(message_client)
+
         if self.msg_window is not None and self.msg_window.isVisible():
-            if (
-                message_type == self.msg_window_type
-                and message_client.client_name == self.msg_window_client
-            ):
-                self.show_status_msg(message_type, message_client)
+            if message_client.client_name == self.msg_window_client:
+                if message_type == self.msg_window_type:
+                    self.show_status_msg(message_type, message_client)
+                elif self.msg_window_type == MessageType.HISTORY:
+                    self.show_history_msg(message_client)
 
         self.regen_menu()
         self.set_tray_icon()
+        self.schedule_state_snapshot()
+        if self.query_registered(message_client):
+            self.query_listener.publish(
+                update_message(self.query_entry(message_client))
+            )
+
+        if message_client.pending_trace is not None:
+            message_client.pending_trace.finish(
+                message_client.client_name_or_unknown()
+            )
+            message_client.pending_trace = None
+
+    def status_history_share(self) -> int:
+        """
+        Returns how many status history entries each client may keep, so that
+        all clients combined stay within the 'status_history_max_entries'
+        budget.
+        """
+
+        max_entries: int = ConfigData.conf_dict["status_history_max_entries"]
+        return max(1, max_entries // max(1, len(self.client_registry)))
+
+    def trim_status_history(self, message_client: SdwdateGuiClient) -> None:
+        """
+        Trims the status history of a client to its equal share of the
+        'status_history_max_entries' budget, so a single flapping client
+        cannot push every other client's history out.
+        """
+
+        history_share: int = self.status_history_share()
+        while len(message_client.status_history) > history_share:
+            message_client.status_history.popleft()
 
     def drop_client(self, sender_client: SdwdateGuiClient) -> None:
         """
         Purges a disconnected client from the client list.
         """
 
+        sender_client.release_sdwdate_msg()
         if not sender_client.present_in_menu:
             sender_client.deleteLater()
-
-        for idx, client in enumerate(self.client_list):
-            if client == sender_client:
-                self.client_list.pop(idx)
-                self.regen_menu()
-                self.set_tray_icon()
-                return
+        self.stale_clients.pop(sender_client, None)
+
+        registered: bool = self.query_registered(sender_client)
+        if self.client_registry.remove(sender_client):
+            self.prune_msg_windows()
+            self.regen_menu()
+            self.set_tray_icon()
+            self.schedule_state_snapshot()
+            if registered:
+                assert sender_client.client_name is not None
+                self.query_listener.publish(
+                    remove_message(sender_client.client_name)
+                )
+            return
 
         logging.warning("Dropped client not present in client list!")
 
-    def accept_client(self, client: SdwdateGuiClient) -> None:
+    def query_registered(self, client: SdwdateGuiClient) -> bool:
+        """
+        Checks if a client is known under its name, and therefore reported
+        on the query socket.
+        """
+
+        return (
+            client.client_name is not None
+            and self.client_registry.find_by_name(client.client_name) is client
+        )
+
+    def query_entry(self, client: SdwdateGuiClient) -> dict[str, Any]:
+        """
+        Returns the description of a client sent to query clients.
+        """
+
+        assert client.client_name is not None
+        return client_entry(
+            client.client_name,
+            client.sdwdate_status,
+            None if client.sdwdate_msg is None else client.sdwdate_msg.text,
+            client.tor_status,
+            client.last_update,
+            client.connected_at,
+        )
+
+    def query_entries(self) -> list[dict[str, Any]]:
+        """
+        Returns the descriptions of all clients known under their name, for
+        a snapshot message on the query socket.
+        """
+
+        named_clients: list[SdwdateGuiClient] = [
+            client
+            for client in self.client_registry
+            if self.query_registered(client)
+        ]
+        named_clients.sort(key=lambda client: client.client_name or "")
+        return [self.query_entry(client) for client in named_clients]
+
+    def update_metrics_textfile(self) -> None:
+        """
+        Rewrites the metrics file if anything changed since it was last
+        written.
+        """
+
+        self.metrics_textfile.update(
+            self.query_entries(),
+            len(self.client_registry) - len(self.stale_clients),
+        )
+
+    def apply_metrics_textfile_config(self) -> None:
+        """
+        Starts or stops exporting the metrics file, following the
+        'metrics_textfile_dir' configuration key.
+        """
+
+        if ConfigData.conf_dict["metrics_textfile_dir"] == "":
+            self.metrics_textfile_timer.stop()
+            self.metrics_textfile.remove()
+            return
+        self.update_metrics_textfile()
+        self.metrics_textfile_timer.start()
+
+    def schedule_state_snapshot(self) -> None:
+        """
+        Schedules writing the state snapshot. Changes are batched, the
+        snapshot is written at most once per STATE_SNAPSHOT_DELAY_MS.
+        """
+
+        self.state_snapshot_pending = True
+        if not self.state_snapshot_timer.isActive():
+            self.state_snapshot_timer.start()
+
+    def flush_state_snapshot(self) -> None:
+        """
+        Writes a scheduled state snapshot right away, so that changes made
+        just before exiting are not lost.
+        """
+
+        if self.state_snapshot_pending:
+            self.write_state_snapshot()
+
+    @timed_metric("write_state_snapshot_seconds")
+    def write_state_snapshot(self) -> None:
+        """
+        Saves the last known state of all clients to the state snapshot. The
+        file is replaced atomically, so it is never seen half-written.
+        """
+
+        self.state_snapshot_pending = False
+        now: float = snapshot_clock()
+        entries: list[dict[str, Any]] = []
+        for client in self.client_registry:
+            if not client.client_name_set or not client_ready(client):
+                continue
+            entries.append(
+                {
+                    "name": client.client_name,
+                    "sdwdate_status": client.sdwdate_status.name,
+                    "sdwdate_msg": (
+                        None
+                        if client.sdwdate_msg is None
+                        else client.sdwdate_msg.text
+                    ),
+                    "tor_status": client.tor_status.name,
+                    "confirmed_at": self.stale_clients.get(client, now),
+                }
+            )
+
+        snapshot_path: Path = GlobalData.state_snapshot_path
+        temp_path: Path = snapshot_path.with_name(f"{snapshot_path.name}.tmp")
+        try:
+            temp_fd: int = os.open(
+                temp_path,
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW,
+                0o600,
+            )
+            with open(temp_fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": STATE_SNAPSHOT_VERSION, "clients": entries},
+                    f,
+                    separators=(",", ":"),
+                )
+            os.replace(temp_path, snapshot_path)
+        except Exception as e:
+            logging.warning("Could not write state snapshot!", exc_info=e)
+            return
+        count_metric("state_snapshots_written")
+
+    def restore_state_snapshot(self) -> None:
+        """
+        Shows the last known state of the clients of a previous server
+        instance, so that the tray icon and menu are useful right after a
+        restart rather than only once every client has reconnected. Restored
+        clients are marked as stale and replaced once their client reconnects
+        and sets its name.
+        """
+
+        try:
+            with open(
+                GlobalData.state_snapshot_path, "r", encoding="utf-8"
+            ) as f:
+                snapshot: Any = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning("Could not read state snapshot!", exc_info=e)
+            return
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("version") != STATE_SNAPSHOT_VERSION
+            or not isinstance(snapshot.get("clients"), list)
+        ):
+            logging.warning("Ignoring state snapshot of unknown format!")
+            return
+
+        now: float = snapshot_clock()
+        max_clients: int = ConfigData.conf_dict["max_clients"]
+        for entry in snapshot["clients"][:max_clients]:
+            parsed_entry: (
+                tuple[str, SdwdateStatus, str | None, TorStatus, float] | None
+            ) = parse_snapshot_entry(entry)
+            if parsed_entry is None:
+                logging.warning("Ignoring invalid state snapshot entry!")
+                continue
+            if not 0 <= now - parsed_entry[4] < STALE_STATE_TIMEOUT_SECONDS:
+                continue
+            if self.client_registry.find_by_name(parsed_entry[0]) is not None:
+                continue
+
+            client: SdwdateGuiClient = SdwdateGuiClient(None, self)
+            client.client_name = parsed_entry[0]
+            client.client_name_set = True
+            client.sdwdate_status = parsed_entry[1]
+            if parsed_entry[2] is not None:
+                client.sdwdate_msg = GlobalData.message_store.acquire(
+                    parsed_entry[2]
+                )
+            client.tor_status = parsed_entry[3]
+            client.last_update = time.time() - (now - parsed_entry[4])
+            self.client_registry.add(client)
+            self.stale_clients[client] = parsed_entry[4]
+            count_metric("stale_clients_restored")
+
+        if len(self.stale_clients) == 0:
+            return
+        logging.info(
+            "Restored last known state of %d clients", len(self.stale_clients)
+        )
+        self.regen_menu()
+        self.set_tray_icon()
+        self.expire_stale_clients()
+
+    def expire_stale_clients(self) -> None:
+        """
+        Drops restored client states whose client did not reconnect within
+        STALE_STATE_TIMEOUT_SECONDS of when they were last confirmed, and
+        schedules the next expiry.
+        """
+
+        now: float = snapshot_clock()
+        for client, confirmed_at in list(self.stale_clients.items()):
+            if now - confirmed_at >= STALE_STATE_TIMEOUT_SECONDS:
+                logging.info(
+                    "Client '%s' did not reconnect, dropping its last known "
+                    "state",
+                    client.client_name_or_unknown(),
+                )
+                self.drop_client(client)
+        if len(self.stale_clients) != 0:
+            next_expiry: float = (
+                min(self.stale_clients.values()) + STALE_STATE_TIMEOUT_SECONDS
+            )
+            self.stale_timer.start(math.ceil((next_expiry - now) * 1000))
+
+    def apply_config(self, changed_keys: set[str]) -> None:
         """
-        Adds a new client to the client list.
+        Applies a changed configuration without restarting.
         """
 
-        if len(self.client_list) >= MAX_CLIENTS:
-            logging.warning(
-                "Rejecting new client; already at the %d client limit",
-                MAX_CLIENTS,
+        if ConfigData.conf_dict["disable"]:
+            logging.info(
+                "'disable' configuration key set to 'True', therefore exiting."
+            )
+            sys.exit(0)
+        if (
+            running_in_qubes_os()
+            and not ConfigData.conf_dict["run_server_in_qubes"]
+        ):
+            logging.info(
+                "Running in Qubes OS, but 'run_server_in_qubes' config is "
+                "set to 'False', therefore exiting."
+            )
+            sys.exit(0)
+
+        if "status_history_depth" in changed_keys:
+            history_depth: int = ConfigData.conf_dict["status_history_depth"]
+            for client in self.client_registry:
+                client.status_history = deque(
+                    client.status_history, maxlen=history_depth
+                )
+        for client in self.client_registry:
+            self.trim_status_history(client)
+
+        if "metrics_textfile_dir" in changed_keys:
+            self.apply_metrics_textfile_config()
+
+        if (
+            "status_rate_limit" in changed_keys
+            or "status_rate_burst" in changed_keys
+        ):
+            QMetaObject.invokeMethod(
+                self.listener,
+                "apply_rate_limits",
+                Qt.ConnectionType.QueuedConnection,
             )
-            client.kick_client()
-            client.deleteLater()
+
+        if (
+            "max_clients" in changed_keys
+            or "admission_queue_size" in changed_keys
+        ):
+            QMetaObject.invokeMethod(
+                self.listener,
+                "admit_waiting",
+                Qt.ConnectionType.QueuedConnection,
+            )
+
+        ## 'status_flood_kick_limit' is looked up whenever it is needed.
+        ## Lowering 'max_clients' does not disconnect anyone, it only keeps
+        ## new clients waiting until enough clients have left.
+        connected_count: int = len(self.client_registry) - len(
+            self.stale_clients
+        )
+        if connected_count > ConfigData.conf_dict["max_clients"]:
+            logging.info(
+                "%d clients connected, more than the new 'max_clients' "
+                "limit of %d",
+                connected_count,
+                ConfigData.conf_dict["max_clients"],
+            )
+
+    def stop_io_thread(self) -> None:
+        """
+        Stops the I/O thread, dropping all client connections.
+        """
+
+        if not self.io_thread.isRunning():
             return
+        QMetaObject.invokeMethod(
+            self.listener,
+            "stop_listening",
+            Qt.ConnectionType.BlockingQueuedConnection,
+        )
+        self.io_thread.quit()
+        self.io_thread.wait()
+
+    def toggle_io_thread_profiling(self, enable: bool) -> None:
+        """
+        Starts or stops the I/O thread's profiler, see
+        sdwdate_gui_profiling.
+        """
+
+        if not self.io_thread.isRunning():
+            return
+        QMetaObject.invokeMethod(
+            self.listener,
+            "start_profiling" if enable else "stop_profiling",
+            Qt.ConnectionType.BlockingQueuedConnection,
+        )
+
+    @pyqtSlot(SdwdateGuiConnection)
+    def accept_client(self, connection: SdwdateGuiConnection) -> None:
+        """
+        Creates a client for a new connection and adds it to the client list.
+        """
 
-        self.client_list.append(client)
+        ## The listener enforces 'max_clients' before passing connections
+        ## on.
+        client: SdwdateGuiClient = SdwdateGuiClient(connection, self)
+        self.client_registry.add(client)
+        count_metric("clients_accepted")
+        observe_metric(
+            "accept_latency_seconds", time.monotonic() - connection.accepted_at
+        )
+        ## Every client's share of the status history budget just shrank.
+        ## Trim them all now, rather than on each status change.
+        for other_client in self.client_registry:
+            self.trim_status_history(other_client)
         client.clientNameChanged.connect(
             functools.partial(
                 self.handle_client_name_change,
@@ -1283,119 +2612,332 @@ to connect to or configure the Tor network."""
                 client,
             )
         )
+        client.start()
+
+
+class SdwdateGuiIoThread(QThread):
+    """
+    The thread SdwdateGuiListener and all connections live in. Its event
+    loop is run from Python, so that the thread keeps a single Python thread
+    state. Otherwise PyQt creates a new one for every slot call, and a
+    profiler enabled in the thread would only see the call that enabled it.
+    """
+
+    def run(self) -> None:
+        """
+        Runs the thread's event loop, profiling it as long as profiling is
+        running, see sdwdate_gui_profiling.
+        """
+
+        start_thread_profiling()
+        self.exec()
+        stop_thread_profiling()
+
+
+# pylint: disable=invalid-name
+class SdwdateGuiServer(QLocalServer):
+    """
+    A QLocalServer that creates the sockets for new connections from Python
+    and queues them in `pending_sockets`. PyQt is not told when a socket
+    QLocalServer created itself is deleted, so under a burst of connections
+    a new socket at the same address could be handed out as the deleted
+    one.
+    """
+
+    def __init__(self, parent: QObject | None = None) -> None:
+        """
+        Creates a server that is not listening yet.
+        """
+
+        QLocalServer.__init__(self, parent)
+        self.pending_sockets: deque[QLocalSocket] = deque()
+
+    ## PyQt5 passes and takes the descriptor as an int, its stubs disagree.
+    def incomingConnection(  # type: ignore[override]
+        self, socket_descriptor: int
+    ) -> None:
+        """
+        Queues a socket for a newly accepted connection.
+        """
+
+        client_socket: QLocalSocket = QLocalSocket(self)
+        client_socket.setSocketDescriptor(
+            socket_descriptor  # type: ignore[arg-type]
+        )
+        self.pending_sockets.append(client_socket)
+        self.newConnection.emit()
 
 
 class SdwdateGuiListener(QObject):
     """
-    Listens for new client connections and creates SdwdateGuiClient objects
-    for them.
+    Listens for new client connections and creates SdwdateGuiConnection
+    objects for them. Lives in the I/O thread, together with all
+    connections.
+
+    At most 'max_clients' connections are passed on at once. Further
+    clients wait in a queue of up to 'admission_queue_size' entries until
+    a connection closes, so that a burst of reconnecting clients is served
+    in order rather than turned away.
     """
 
-    newClient: pyqtSignal = pyqtSignal(SdwdateGuiClient)
+    newClient: pyqtSignal = pyqtSignal(SdwdateGuiConnection)
 
-    # pylint: disable=too-many-statements
     def __init__(self, parent: QObject | None = None) -> None:
         """
-        Initializes a listening socket.
+        Prepares the listening socket. It starts listening once
+        start_listening() is called in the I/O thread.
         """
 
         QObject.__init__(self, parent)
 
-        uid_str: str = str(os.getuid())
-        sdwdate_run_dir: Path = Path(f"/run/user/{uid_str}/sdwdate-gui")
-        sdwdate_pid_file = sdwdate_run_dir.joinpath("server_pid")
-        sdwdate_socket_file = sdwdate_run_dir.joinpath(
-            "sdwdate-gui-server.socket"
+        self.activation_fd: int | None = claim_server_socket(
+            GlobalData.sdwdate_run_dir,
+            GlobalData.server_pid_path,
+            GlobalData.server_socket_path,
         )
-        try:
-            sdwdate_run_dir.mkdir(
-                parents=True,
-                exist_ok=True,
-            )
-        except Exception:
-            logging.critical(
-                "Could not create '%s' directory!'!",
-                str(sdwdate_run_dir),
-            )
-            sys.exit(1)
 
-        ## This PID file mechanism is prone to race conditions. If we were
-        ## trying to be highly robust, we'd want to use advisory locking via
-        ## os.lockf rather than a PID file. That would probably be overkill
-        ## for this applet though, as the OS will only ever try to start once
-        ## instance of the server per logged-in user account, unless the
-        ## end-user is intentionally trying to run multiple server instances.
-        if sdwdate_pid_file.is_file():
+        ## QLocalServer always listens with a backlog of 50 under Qt 5, so
+        ## the server socket is created here with the configured backlog
+        ## and handed over to QLocalServer, like a socket from systemd.
+        self.listen_fd: int
+        if self.activation_fd is not None:
+            self.listen_fd = self.activation_fd
+        else:
             try:
-                with open(sdwdate_pid_file, "r", encoding="utf-8") as f:
-                    sdwdate_pid_str: str = f.readline().strip()
-                pid_verify_re: Pattern[str] = re.compile("^[0-9]+$")
-                if not pid_verify_re.match(sdwdate_pid_str):
-                    logging.error(
-                        "PID marker file contains non-numeric characters!",
-                    )
-                    sys.exit(1)
-                if Path(f"/proc/{sdwdate_pid_str}").is_dir():
-                    logging.error(
-                        "sdwdate_gui_server is already running!",
-                    )
-                    sys.exit(1)
+                self.listen_fd = bind_server_socket(
+                    GlobalData.server_socket_path,
+                    ConfigData.conf_dict["listen_backlog"],
+                ).detach()
             except Exception as e:
-                logging.error(
-                    "Could not check for running sdwdate_gui_server!",
-                    exc_info=e,
-                )
+                logging.error("Could not create server socket!", exc_info=e)
                 sys.exit(1)
 
-        try:
-            os.remove(sdwdate_pid_file)
-        except FileNotFoundError:
-            pass
-        except Exception as e:
-            logging.error(
-                "Could not erase old PID file!",
-                exc_info=e,
-            )
-            sys.exit(1)
+        self.server: SdwdateGuiServer = SdwdateGuiServer(self)
+        self.server.newConnection.connect(self.spawn_client)
 
-        try:
-            with open(sdwdate_pid_file, "w", encoding="utf-8") as f:
-                f.write(str(os.getpid()))
-        except Exception as e:
+        ## Number of connections passed on and not closed yet, and the
+        ## sockets of clients waiting for admission along with the time
+        ## they were accepted.
+        self.connection_count: int = 0
+        self.admission_queue: deque[tuple[float, QLocalSocket]] = deque()
+
+        ## Handshake deadlines of all clients, in the order they connected.
+        ## Since every client gets the same timeout, this is also the order
+        ## of the deadlines, and a single coarse timer sweeping from the
+        ## front replaces one timer per client.
+        self.handshake_deadlines: deque[
+            tuple[float, SdwdateGuiConnection]
+        ] = deque()
+        self.handshake_timer: QTimer = QTimer(self)
+        self.handshake_timer.setInterval(HANDSHAKE_SWEEP_INTERVAL_MS)
+        self.handshake_timer.timeout.connect(self.sweep_handshakes)
+
+    @pyqtSlot()
+    def start_listening(self) -> None:
+        """
+        Starts listening for clients. Called in the I/O thread.
+        """
+
+        ## PyQt5 takes the descriptor as an int, its stubs disagree.
+        listening: bool = self.server.listen(
+            self.listen_fd  # type: ignore[call-overload]
+        )
+        if not listening:
             logging.error(
-                "Could not save PID to PID file!",
-                exc_info=e,
+                "Could not listen on server socket: %s",
+                self.server.errorString(),
             )
-            sys.exit(1)
 
+    @pyqtSlot()
+    def start_profiling(self) -> None:
+        """
+        Starts profiling the I/O thread. Called in the I/O thread.
+        """
+
+        start_thread_profiling()
+
+    @pyqtSlot()
+    def stop_profiling(self) -> None:
+        """
+        Stops profiling the I/O thread. Called in the I/O thread.
+        """
+
+        stop_thread_profiling()
+
+    @pyqtSlot()
+    def stop_listening(self) -> None:
+        """
+        Stops listening for clients. Called in the I/O thread.
+        """
+
+        while len(self.admission_queue) != 0:
+            waiting_socket: QLocalSocket = self.admission_queue.popleft()[1]
+            waiting_socket.disconnected.disconnect()
+            waiting_socket.abort()
+            waiting_socket.deleteLater()
+
+        if self.activation_fd is None:
+            self.server.close()
+            return
+
+        ## QLocalServer removes the socket file when closing, even one it did
+        ## not create. A socket from systemd has to stay for the next server
+        ## to be activated by, so keep it under a second name meanwhile.
+        socket_path: Path = GlobalData.server_socket_path
+        keep_path: Path = socket_path.with_name(f"{socket_path.name}.keep")
         try:
-            os.remove(sdwdate_socket_file)
-        except FileNotFoundError:
-            pass
+            keep_path.unlink(missing_ok=True)
+            os.link(socket_path, keep_path)
+            self.server.close()
+            os.replace(keep_path, socket_path)
         except Exception as e:
             logging.error(
-                "Could not erase old server socket!",
-                exc_info=e,
+                "Could not keep server socket from systemd!", exc_info=e
             )
-            sys.exit(1)
 
-        self.server: QLocalServer = QLocalServer(self)
-        ## Restrict the IPC socket to the owning user rather than relying
-        ## solely on the 0700 mode of the parent /run/user/UID directory.
-        self.server.setSocketOptions(QLocalServer.SocketOption.UserAccessOption)
-        self.server.listen(str(sdwdate_socket_file))
-        self.server.newConnection.connect(self.spawn_client)
+    @pyqtSlot()
+    def apply_rate_limits(self) -> None:
+        """
+        Applies changed 'status_rate_limit' and 'status_rate_burst'
+        configuration to all connections. Called in the I/O thread.
+        """
 
+        for connection in self.findChildren(SdwdateGuiConnection):
+            connection.status_bucket.reconfigure(
+                ConfigData.conf_dict["status_rate_limit"],
+                ConfigData.conf_dict["status_rate_burst"],
+            )
+
+    @pyqtSlot()
     def spawn_client(self) -> None:
         """
-        Creates a new client and provides the new client to a listening
-        object via a signal.
+        Takes all pending connections from the server socket, and admits,
+        queues or rejects each of them.
+        """
+
+        max_clients: int = ConfigData.conf_dict["max_clients"]
+        while len(self.server.pending_sockets) != 0:
+            new_socket: QLocalSocket = self.server.pending_sockets.popleft()
+            accepted_at: float = time.monotonic()
+            if (
+                self.connection_count < max_clients
+                and len(self.admission_queue) == 0
+            ):
+                self.admit_client(new_socket, accepted_at)
+            elif (
+                len(self.admission_queue)
+                < ConfigData.conf_dict["admission_queue_size"]
+            ):
+                new_socket.setReadBufferSize(WAITING_READ_BUFFER_SIZE)
+                new_socket.disconnected.connect(
+                    functools.partial(self.drop_waiting_client, new_socket)
+                )
+                self.admission_queue.append((accepted_at, new_socket))
+                count_metric("clients_queued")
+            else:
+                logging.warning(
+                    "Rejecting new client; already at the %d client limit",
+                    max_clients,
+                )
+                SdwdateGuiConnection(new_socket, self).kick_client(
+                    "client_limit"
+                )
+
+    def admit_client(
+        self, client_socket: QLocalSocket, accepted_at: float
+    ) -> None:
+        """
+        Creates a new connection and provides it to a listening object via a
+        signal.
+        """
+
+        connection: SdwdateGuiConnection = SdwdateGuiConnection(
+            client_socket, self
+        )
+        connection.accepted_at = accepted_at
+        self.connection_count += 1
+        connection.connectionClosed.connect(self.release_client)
+        self.handshake_deadlines.append(
+            (time.monotonic() + HANDSHAKE_TIMEOUT_MS / 1000, connection)
+        )
+        if not self.handshake_timer.isActive():
+            self.handshake_timer.start()
+        self.newClient.emit(connection)
+
+    @pyqtSlot()
+    def release_client(self) -> None:
+        """
+        Frees the slot of a closed connection for a waiting client.
+        """
+
+        self.connection_count -= 1
+        self.admit_waiting()
+
+    @pyqtSlot()
+    def admit_waiting(self) -> None:
+        """
+        Admits waiting clients for as long as fewer than 'max_clients'
+        connections are open, and rejects those beyond a lowered
+        'admission_queue_size'. Called in the I/O thread.
+        """
+
+        while (
+            len(self.admission_queue) != 0
+            and self.connection_count < ConfigData.conf_dict["max_clients"]
+        ):
+            accepted_at: float
+            waiting_socket: QLocalSocket
+            accepted_at, waiting_socket = self.admission_queue.popleft()
+            waiting_socket.disconnected.disconnect()
+            if waiting_socket.state() != QLocalSocket.ConnectedState:
+                waiting_socket.deleteLater()
+                continue
+            waiting_socket.setReadBufferSize(0)
+            self.admit_client(waiting_socket, accepted_at)
+
+        while (
+            len(self.admission_queue)
+            > ConfigData.conf_dict["admission_queue_size"]
+        ):
+            waiting_socket = self.admission_queue.pop()[1]
+            waiting_socket.disconnected.disconnect()
+            SdwdateGuiConnection(waiting_socket, self).kick_client(
+                "client_limit"
+            )
+
+    def drop_waiting_client(self, waiting_socket: QLocalSocket) -> None:
+        """
+        Forgets a waiting client that disconnected.
         """
 
-        new_socket: QLocalSocket | None = self.server.nextPendingConnection()
-        assert new_socket is not None
-        client: SdwdateGuiClient = SdwdateGuiClient(new_socket, self)
-        self.newClient.emit(client)
+        for index, entry in enumerate(self.admission_queue):
+            if entry[1] is waiting_socket:
+                del self.admission_queue[index]
+                break
+        waiting_socket.deleteLater()
+
+    @pyqtSlot()
+    def sweep_handshakes(self) -> None:
+        """
+        Kicks all clients whose handshake deadline has passed without them
+        providing a name.
+        """
+
+        now: float = time.monotonic()
+        expired_count: int = 0
+        while (
+            len(self.handshake_deadlines) != 0
+            and self.handshake_deadlines[0][0] <= now
+        ):
+            connection: SdwdateGuiConnection
+            _, connection = self.handshake_deadlines.popleft()
+            if connection.handshake_pending:
+                expired_count += 1
+                connection.handshake_timeout()
+        if expired_count != 0:
+            count_metric("handshakes_expired", expired_count)
+        if len(self.handshake_deadlines) == 0:
+            self.handshake_timer.stop()
 
 
 # pylint: disable=unused-argument
@@ -1408,6 +2950,17 @@ def signal_handler(sig: int, frame: FrameType | None) -> None:
     sys.exit(128 + sig)
 
 
+# pylint: disable=unused-argument
+def metrics_signal_handler(sig: int, frame: FrameType | None) -> None:
+    """
+    Handles SIGUSR2 by dumping all runtime metrics to the log.
+    """
+
+    logging.info("Runtime metrics:")
+    for line in format_metrics():
+        logging.info("  %s", line)
+
+
 def main() -> NoReturn:
     """
     Main function.
@@ -1430,6 +2983,9 @@ def main() -> NoReturn:
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGUSR2, metrics_signal_handler)
+    setup_profiling("server")
+    setup_tracing()
 
     try:
         parse_config_files()
@@ -1438,6 +2994,15 @@ def main() -> NoReturn:
         sys.exit(1)
     assert isinstance(ConfigData.conf_dict["disable"], bool)
     assert isinstance(ConfigData.conf_dict["run_server_in_qubes"], bool)
+    assert isinstance(ConfigData.conf_dict["status_history_depth"], int)
+    assert isinstance(ConfigData.conf_dict["status_history_max_entries"], int)
+    assert isinstance(ConfigData.conf_dict["max_clients"], int)
+    assert isinstance(ConfigData.conf_dict["listen_backlog"], int)
+    assert isinstance(ConfigData.conf_dict["admission_queue_size"], int)
+    assert isinstance(ConfigData.conf_dict["status_rate_limit"], int)
+    assert isinstance(ConfigData.conf_dict["status_rate_burst"], int)
+    assert isinstance(ConfigData.conf_dict["status_flood_kick_limit"], int)
+    assert isinstance(ConfigData.conf_dict["metrics_textfile_dir"], str)
     if ConfigData.conf_dict["disable"]:
         logging.info(
             "'disable' configuration key set to 'True', therefore exiting."
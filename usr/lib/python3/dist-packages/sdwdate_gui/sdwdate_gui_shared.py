@@ -9,6 +9,8 @@
 Code shared between sdwdate_gui_client and sdwdate_gui_server.
 """
 
+import logging
+
 from typing import Any
 import schema  # type: ignore
 
@@ -30,12 +32,48 @@ class ConfigData:
             schema.Optional("disable"): bool,
             schema.Optional("run_server_in_qubes"): bool,
             schema.Optional("gateway"): str,
+            schema.Optional("status_history_depth"): schema.And(
+                int, lambda n: n > 0
+            ),
+            schema.Optional("status_history_max_entries"): schema.And(
+                int, lambda n: n > 0
+            ),
+            schema.Optional("max_clients"): schema.And(
+                int, lambda n: n > 0
+            ),
+            schema.Optional("listen_backlog"): schema.And(
+                int, lambda n: n > 0
+            ),
+            schema.Optional("admission_queue_size"): schema.And(
+                int, lambda n: n >= 0
+            ),
+            schema.Optional("status_rate_limit"): schema.And(
+                int, lambda n: n > 0
+            ),
+            schema.Optional("status_rate_burst"): schema.And(
+                int, lambda n: n > 0
+            ),
+            schema.Optional("status_flood_kick_limit"): schema.And(
+                int, lambda n: n > 0
+            ),
+            schema.Optional("metrics_textfile_dir"): schema.And(
+                str, lambda s: s == "" or s.startswith("/")
+            ),
         },
     )
     defaults_dict: dict[str, Any] = {
         "disable": False,
         "run_server_in_qubes": False,
         "gateway": "sys-whonix",
+        "status_history_depth": 32,
+        "status_history_max_entries": 1024,
+        "max_clients": 64,
+        "listen_backlog": 128,
+        "admission_queue_size": 64,
+        "status_rate_limit": 10,
+        "status_rate_burst": 20,
+        "status_flood_kick_limit": 500,
+        "metrics_textfile_dir": "",
     }
     conf_dict: dict[str, Any] = {}
 
@@ -45,6 +83,11 @@ class ConfigData:
 ## no reasonable message should be even close to 4 KiB.
 MAX_MSG_SIZE: int = 4096
 
+## Configuration changes are applied once the configuration directories have
+## been quiet for this long, so that a file being written or several files
+## being changed at once only cause a single reload.
+CONFIG_RELOAD_DELAY_MS: int = 250
+
 
 def check_bytes_printable(buf: bytes) -> bool:
     """
@@ -100,6 +143,39 @@ def parse_config_files() -> None:
     )
 
 
+def reload_config_files() -> set[str]:
+    """
+    Re-parses config files for sdwdate-gui after they changed, and returns
+    the names of all configuration keys whose value changed. If the changed
+    configuration is invalid, the current configuration stays in effect.
+    """
+
+    old_conf_dict: dict[str, Any] = ConfigData.conf_dict
+    try:
+        parse_config_files()
+    except Exception as e:
+        logging.error(
+            "Configuration file parsing failed, keeping the current "
+            "configuration!",
+            exc_info=e,
+        )
+        ConfigData.conf_dict = old_conf_dict
+        return set()
+
+    changed_keys: set[str] = {
+        key
+        for key in old_conf_dict.keys() | ConfigData.conf_dict.keys()
+        if old_conf_dict.get(key) != ConfigData.conf_dict.get(key)
+    }
+    for key in sorted(changed_keys):
+        logging.info(
+            "Configuration key '%s' changed to '%s'.",
+            key,
+            ConfigData.conf_dict.get(key),
+        )
+    return changed_keys
+
+
 ## Debugging.
 if __name__ == "__main__":
     parse_config_files()
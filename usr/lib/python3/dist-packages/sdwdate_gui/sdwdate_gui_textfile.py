@@ -0,0 +1,190 @@
+#!/usr/bin/python3 -su
+
+## Copyright (C) 2026 - 2026 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
+## See the file COPYING for copying conditions.
+
+# pylint: disable=broad-exception-caught
+
+"""
+Exports the state of all clients and the runtime metrics of
+sdwdate_gui_server as a file in the Prometheus text exposition format, for
+node_exporter's textfile collector or any other local collector. Enabled by
+the 'metrics_textfile_dir' configuration key.
+
+The file is checked at most once per METRICS_TEXTFILE_INTERVAL_MS and only
+rewritten if its contents changed, so an idle server does no I/O. For the
+same reason the time of a client's last status change is exported as a
+timestamp rather than as an age, which a collector computes as
+'time() - sdwdate_gui_client_last_update_timestamp_seconds'.
+"""
+
+import os
+import logging
+
+from typing import Any
+from pathlib import Path
+
+from .sdwdate_gui_metrics import (
+    format_exposition_key,
+    format_exposition_metrics,
+)
+from .sdwdate_gui_shared import ConfigData
+from .sdwdate_gui_protocol import (
+    SdwdateStatus,
+    TorStatus,
+)
+
+METRICS_TEXTFILE_NAME: str = "sdwdate-gui.prom"
+METRICS_TEXTFILE_INTERVAL_MS: int = 10000
+METRICS_PREFIX: str = "sdwdate_gui_"
+
+
+def format_client_metrics(
+    entries: list[dict[str, Any]], connected_count: int
+) -> list[str]:
+    """
+    Renders gauges for the clients described by `entries`, as returned by
+    sdwdate_gui_query.client_entry, and for the number of connected clients.
+    """
+
+    sdwdate_lines: list[str] = []
+    tor_lines: list[str] = []
+    connected_lines: list[str] = []
+    last_update_lines: list[str] = []
+    for entry in entries:
+        client_label: tuple[tuple[str, str], ...] = (
+            ("client", entry["name"]),
+        )
+        for sdwdate_status in SdwdateStatus:
+            sdwdate_lines.append(
+                format_exposition_key(
+                    f"{METRICS_PREFIX}client_sdwdate_status",
+                    client_label + (("status", sdwdate_status.name),),
+                )
+                + (
+                    " 1"
+                    if sdwdate_status.name == entry["sdwdate_status"]
+                    else " 0"
+                )
+            )
+        for tor_status in TorStatus:
+            tor_lines.append(
+                format_exposition_key(
+                    f"{METRICS_PREFIX}client_tor_status",
+                    client_label + (("status", tor_status.name),),
+                )
+                + (" 1" if tor_status.name == entry["tor_status"] else " 0")
+            )
+        connected_lines.append(
+            format_exposition_key(
+                f"{METRICS_PREFIX}client_connected", client_label
+            )
+            + (" 0" if entry["connection_age"] is None else " 1")
+        )
+        if entry["last_update"] is not None:
+            last_update_lines.append(
+                format_exposition_key(
+                    f"{METRICS_PREFIX}client_last_update_timestamp_seconds",
+                    client_label,
+                )
+                + f" {entry['last_update']:.3f}"
+            )
+
+    return [
+        f"# TYPE {METRICS_PREFIX}clients_connected gauge",
+        f"{METRICS_PREFIX}clients_connected {connected_count}",
+        f"# TYPE {METRICS_PREFIX}client_sdwdate_status gauge",
+        *sdwdate_lines,
+        f"# TYPE {METRICS_PREFIX}client_tor_status gauge",
+        *tor_lines,
+        f"# TYPE {METRICS_PREFIX}client_connected gauge",
+        *connected_lines,
+        f"# TYPE {METRICS_PREFIX}client_last_update_timestamp_seconds gauge",
+        *last_update_lines,
+    ]
+
+
+class MetricsTextfile:
+    """
+    The metrics file in the directory configured by 'metrics_textfile_dir'.
+    """
+
+    def __init__(self) -> None:
+        """
+        Nothing is written before the first update().
+        """
+
+        self.last_text: str | None = None
+        self.last_path: Path | None = None
+        self.failing: bool = False
+
+    def update(
+        self, entries: list[dict[str, Any]], connected_count: int
+    ) -> None:
+        """
+        Rewrites the metrics file if its contents changed. The file is
+        replaced atomically, so a collector never reads it half-written.
+        """
+
+        textfile_dir: str = ConfigData.conf_dict["metrics_textfile_dir"]
+        if textfile_dir == "":
+            self.remove()
+            return
+        textfile_path: Path = Path(textfile_dir, METRICS_TEXTFILE_NAME)
+        if textfile_path != self.last_path:
+            self.remove()
+        text: str = (
+            "\n".join(
+                format_client_metrics(entries, connected_count)
+                + format_exposition_metrics(METRICS_PREFIX)
+            )
+            + "\n"
+        )
+        if text == self.last_text:
+            return
+
+        temp_path: Path = textfile_path.with_name(f"{textfile_path.name}.tmp")
+        try:
+            textfile_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_fd: int = os.open(
+                temp_path,
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW,
+                0o644,
+            )
+            with open(temp_fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(temp_path, textfile_path)
+        except Exception as e:
+            ## Retried on the next update, but only logged once.
+            if not self.failing:
+                logging.warning(
+                    "Could not write metrics file '%s'!",
+                    str(textfile_path),
+                    exc_info=e,
+                )
+            self.failing = True
+            return
+        self.failing = False
+        self.last_text = text
+        self.last_path = textfile_path
+
+    def remove(self) -> None:
+        """
+        Removes the metrics file written last, so a collector does not keep
+        reporting the state of a server that stopped exporting it.
+        """
+
+        if self.last_path is None:
+            return
+        try:
+            os.remove(self.last_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(
+                "Could not remove metrics file '%s'!",
+                str(self.last_path),
+                exc_info=e,
+            )
+        self.last_text = None
+        self.last_path = None
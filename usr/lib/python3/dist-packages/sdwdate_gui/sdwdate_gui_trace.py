@@ -0,0 +1,157 @@
+#!/usr/bin/python3 -su
+
+## Copyright (C) 2025 - 2025 ENCRYPTED SUPPORT LLC <adrelanos@whonix.org>
+## See the file COPYING for copying conditions.
+
+"""
+Optional tracing of how long sdwdate status updates take to travel from the
+status file to the tray icon. Enabled by setting SDWDATE_GUI_TRACE=1 in the
+environment of the client and the server.
+
+When enabled, the client appends a trace token to each set_sdwdate_status
+call triggered by an inotify event. The token carries a per-update sequence
+number, the time the client spent between the inotify event and parsing the
+status file, the time between parsing and writing the frame, and the wall
+clock time the frame was written at. The server adds its own hops and
+records everything in histograms of the 'status_trace_seconds' metric, one
+per hop. Client names are self-reported outside of Qubes OS, so they are
+not used as a metric label; the hops of each update are logged along with
+the client's name instead.
+
+Client-side hops are measured with the monotonic clock, so they stay
+accurate across VMs. The hop between writing and receiving the frame
+compares wall clocks of two processes, which on Qubes OS may be in different
+VMs, so it is only as accurate as the clock synchronization between them.
+"""
+
+import logging
+import os
+import re
+import time
+
+from typing import Pattern
+
+from .sdwdate_gui_metrics import observe_metric
+
+## seq:inotify_to_parsed_ns:parsed_to_written_ns:written_wall_ns
+TRACE_TOKEN_RE: Pattern[str] = re.compile(
+    r"\A\d{1,20}:\d{1,20}:\d{1,20}:\d{1,20}\Z"
+)
+
+
+# pylint: disable=too-few-public-methods
+class TraceData:
+    """
+    Global tracing state.
+    """
+
+    enabled: bool = False
+    next_seq: int = 0
+
+
+class ClientTrace:
+    """
+    Timestamps the client collects for one status update.
+    """
+
+    __slots__ = ("seq", "event_ns", "parsed_ns")
+
+    def __init__(self, event_ns: int) -> None:
+        """
+        Starts a trace for a status update whose inotify event was received
+        at the monotonic time event_ns.
+        """
+
+        self.seq: int = TraceData.next_seq
+        TraceData.next_seq += 1
+        self.event_ns: int = event_ns
+        self.parsed_ns: int = event_ns
+
+    def mark_parsed(self) -> None:
+        """
+        Records that the status file has been read and validated.
+        """
+
+        self.parsed_ns = time.monotonic_ns()
+
+    def token(self) -> str:
+        """
+        Renders the trace token, to be sent right away.
+        """
+
+        return (
+            f"{self.seq}:{self.parsed_ns - self.event_ns}:"
+            f"{time.monotonic_ns() - self.parsed_ns}:{time.time_ns()}"
+        )
+
+
+class ServerTrace:
+    """
+    A trace token received by the server, along with the server's own
+    timestamps for the update.
+    """
+
+    __slots__ = (
+        "seq",
+        "inotify_to_parsed_ns",
+        "parsed_to_written_ns",
+        "written_wall_ns",
+        "received_wall_ns",
+        "received_ns",
+        "frame_parsed_ns",
+    )
+
+    def __init__(self, token: str, received_wall_ns: int, received_ns: int):
+        """
+        Parses a trace token. Raises ValueError if it is malformed.
+        """
+
+        if TRACE_TOKEN_RE.match(token) is None:
+            raise ValueError(f"Invalid trace token '{token}'")
+        token_parts: list[int] = [int(part) for part in token.split(":")]
+        self.seq: int = token_parts[0]
+        self.inotify_to_parsed_ns: int = token_parts[1]
+        self.parsed_to_written_ns: int = token_parts[2]
+        self.written_wall_ns: int = token_parts[3]
+        self.received_wall_ns: int = received_wall_ns
+        self.received_ns: int = received_ns
+        self.frame_parsed_ns: int = time.monotonic_ns()
+
+    def finish(self, client_name: str) -> None:
+        """
+        Records all hops of this update, now that the tray icon has been
+        updated, and logs them for `client_name`.
+        """
+
+        ## A negative transfer time means the clocks are out of sync, there
+        ## is nothing sensible to record for it.
+        written_to_received_ns: int = max(
+            0, self.received_wall_ns - self.written_wall_ns
+        )
+        hops: tuple[tuple[str, int], ...] = (
+            ("inotify_to_parsed", self.inotify_to_parsed_ns),
+            ("parsed_to_written", self.parsed_to_written_ns),
+            ("written_to_received", written_to_received_ns),
+            ("received_to_parsed", self.frame_parsed_ns - self.received_ns),
+            ("parsed_to_icon", time.monotonic_ns() - self.frame_parsed_ns),
+        )
+        total_ns: int = 0
+        for hop, hop_ns in hops:
+            total_ns += hop_ns
+            observe_metric("status_trace_seconds", hop_ns / 1e9, hop=hop)
+        observe_metric("status_trace_seconds", total_ns / 1e9, hop="total")
+        logging.info(
+            "Status trace %d of client '%s': %s total=%.3fms",
+            self.seq,
+            client_name,
+            " ".join(f"{hop}={hop_ns / 1e6:.3f}ms" for hop, hop_ns in hops),
+            total_ns / 1e6,
+        )
+
+
+def setup_tracing() -> None:
+    """
+    Enables tracing if requested through the environment.
+    """
+
+    TraceData.enabled = os.environ.get("SDWDATE_GUI_TRACE", "") == "1"